@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -91,7 +93,7 @@ DATABASES = {
 # settings for rest api jwt authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -196,6 +198,122 @@ SWAGGER_SETTINGS = {
 # settings for cors
 # CORS_ALLOW_ALL_ORIGINS = True
 # CORS_ALLOW_CREDENTIALS = True   
-DATA_UPLOAD_MAX_MEMORY_SIZE = None
-
-
+# Non-file form data kept in memory per request (uploaded files are streamed to disk
+# and are not counted, see user/upload_handlers.py)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# settings for home timeline (fan-out-on-write feed)
+TIMELINE_MAX_ENTRIES = 500  # Oldest entries beyond this are trimmed
+TIMELINE_BACKFILL_SIZE = 50  # Posts copied into the timeline on follow
+FEED_CACHE_MAX_AGE = 60  # Seconds clients may cache a seeded or cursor feed page
+
+# settings for the write-behind like counter buffer
+COUNTER_BUFFER_ENABLED = True  # False applies every like/unlike to the database immediately
+COUNTER_FLUSH_INTERVAL = 2  # Seconds between flushes of buffered like counts
+
+# Maximum number of post ids and of user ids per bulk membership request
+MEMBERSHIP_MAX_IDS = 100
+
+# Seconds a viewer's story tray stays cached (it is also invalidated on changes)
+STORY_TRAY_CACHE_TTL = 60
+# The default cache is per process, so invalidations don't reach the other workers
+# (they serve a stale tray for up to STORY_TRAY_CACHE_TTL). Use a shared cache to fix that
+STORY_TRAY_CACHE_ALIAS = "default"
+
+
+
+# settings for image derivatives (resized copies generated at upload time)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1080)  # Pixel widths, never larger than the original
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')  # WebP for modern clients, JPEG as the fallback
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# settings for background processing of post and story uploads
+MEDIA_STAGING_DIR = MEDIA_ROOT / "staging"  # Uploads wait here until a worker moves them into storage
+MEDIA_PROCESSING_SYNC = False  # True processes uploads inline right after the commit
+MEDIA_PROCESSING_THREADS = 4  # Workers moving files and saving rows
+MEDIA_PROCESSING_PROCESSES = 2  # Workers rendering image derivatives (0 renders in the threads)
+MEDIA_PROCESSING_STALE_AFTER = 60 * 60  # Seconds after which process_pending_media takes back a row a worker claimed
+
+# settings for resumable chunked uploads
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # Chunk size suggested to clients
+UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024  # Largest chunk accepted in one request
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # Largest file accepted
+UPLOAD_SESSION_TTL = 24 * 60 * 60  # Seconds an idle upload session is kept
+UPLOAD_MAX_RUNNING_HASHES = 1000  # Running upload hashes kept per process (evicted uploads are hashed again later)
+
+# Size caps of uploaded post and story media, enforced while the upload is streamed
+MEDIA_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MEDIA_MAX_VIDEO_SIZE = 500 * 1024 * 1024
+
+# settings for the orphaned media collector (collect_orphan_media command)
+MEDIA_QUARANTINE_DIR = BASE_DIR / "media_quarantine"  # Outside MEDIA_ROOT, so it is never served
+MEDIA_ORPHAN_GRACE_PERIOD = 24 * 60 * 60  # Seconds a new file is left alone
+
+# settings for media metadata probing (dimensions, duration, placeholder)
+FFPROBE_BINARY = "ffprobe"  # Videos fall back to reading the MP4/MOV header when it is not installed
+FFPROBE_TIMEOUT = 30  # Seconds
+
+# settings for media serving (user/media_serving.py)
+MEDIA_SENDFILE_MODE = None  # None (Django streams the file), "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd)
+MEDIA_SENDFILE_PREFIX = "/protected-media/"  # nginx internal location aliased to MEDIA_ROOT, for "x-accel"
+
+# settings for video posters and renditions (need ffmpeg; skipped when it is not installed)
+FFMPEG_BINARY = "ffmpeg"
+FFMPEG_TIMEOUT = 60  # Seconds to grab a poster frame
+VIDEO_POSTER_OFFSET = 1.0  # Seconds into the video the poster is taken from (at most half the duration)
+VIDEO_RENDITION_HEIGHTS = (480,)  # Short side, in pixels, of the low-bitrate copies for feed autoplay
+VIDEO_RENDITION_CRF = 28
+VIDEO_RENDITION_MAX_BITRATE = "1000k"
+VIDEO_RENDITION_BUFFER_SIZE = "2000k"
+VIDEO_RENDITION_TIMEOUT = 15 * 60  # Seconds per rendition
+MEDIA_RENDITION_THREADS = 1  # Transcodes running at once per process, apart from the upload workers
+
+# settings for the cached JWT authentication (user/authentication.py)
+AUTH_USER_CACHE_TTL = 60  # Seconds an authenticated user is served from the cache
+
+# settings for SMS login codes (user/otp.py)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by the worker processes of the host: a code sent by one worker is verified by another.
+    # Use Redis/Memcached here when the API runs on several hosts. Kept outside the repository,
+    # OTP_CACHE_DIR moves it (e.g. to a directory only the app user can read)
+    "otp": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("OTP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "istan-otp-cache")),
+    },
+}
+OTP_CACHE_ALIAS = "otp"
+OTP_TTL = 5 * 60  # Seconds a code stays valid
+OTP_LENGTH = 4
+OTP_FIXED_CODE = "1111"  # Every code is this one while SMS sending is disabled; set to None in production
+OTP_MAX_ATTEMPTS = 5  # Wrong guesses before a code is burnt
+# Token buckets: scope -> (capacity, seconds to refill one token)
+OTP_RATE_LIMITS = {
+    "send_phone": (3, 60),
+    "send_ip": (20, 30),
+    "verify_phone": (10, 30),
+    "verify_ip": (30, 10),
+}
+OTP_TRUSTED_PROXY_COUNT = 0  # Reverse proxies in front of the API that append to X-Forwarded-For
+
+# settings for the SMS outbox (user/sms_outbox.py)
+SMS_TRANSPORT = "user.sms_outbox.ConsoleTransport"  # "user.sms_outbox.EskizTransport" to really send
+SMS_OUTBOX_SYNC = False  # True sends in the request thread (tests)
+SMS_CODE_TEMPLATE = "Bu Eskiz dan test"  # Eskiz test accounts may only send this text; use "{code}" in the approved template
+SMS_SENDER = "4546"
+SMS_BATCH_SIZE = 50  # Messages per provider call
+SMS_BATCH_WINDOW = 0.2  # Seconds the sender waits for more messages before sending a batch
+SMS_MAX_ATTEMPTS = 5
+SMS_RETRY_BACKOFF = 2  # Seconds before the first retry, doubled on every attempt
+# Eskiz account, from the environment only (EskizTransport refuses to start without it)
+ESKIZ_EMAIL = os.environ.get("ESKIZ_EMAIL", "")
+ESKIZ_PASSWORD = os.environ.get("ESKIZ_PASSWORD", "")
+
+# settings for the username availability index (user/username_index.py)
+USERNAME_INDEX_TTL = 5 * 60  # Seconds before the in-memory index is rebuilt from the database
+USERNAME_BLOOM_ERROR_RATE = 0.01  # False positives, each costs one confirming query
+
+# settings for the profession catalog (user/profession_catalog.py)
+PROFESSION_CATALOG_TTL = 10 * 60  # Seconds other processes may serve a catalog after a change
@@ -3,12 +3,15 @@ from .models import User, Profession, SmSCode
 from .post_models import Post, MediaItem, PostLike, PostComment, SavedPost
 from .story_models import Story, StoryView
 from .following_models import UserFollowing
+from .timeline_models import TimelineEntry
+from .upload_models import UploadSession
+from .blob_models import MediaBlob
 
 # Register your models here.
 
 @admin.register(Profession)
 class ProfessionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name')
+    list_display = ('id', 'name', 'updated_at')
     search_fields = ('name',)
     ordering = ('-id',)
     list_per_page = 10
@@ -96,3 +99,25 @@ class UserFollowingAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'following_user__username')
     ordering = ('-created_at',)
     list_per_page = 20
+
+@admin.register(TimelineEntry)
+class TimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'post', 'created_at')
+    search_fields = ('user__username',)
+    ordering = ('-created_at',)
+    list_per_page = 20
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'filename', 'size', 'received', 'state', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('user__username', 'filename')
+    ordering = ('-created_at',)
+    list_per_page = 20
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    ordering = ('-created_at',)
+    list_per_page = 20
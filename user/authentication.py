@@ -0,0 +1,53 @@
+"""
+JWT authentication that resolves the user from the cache.
+
+simplejwt's JWTAuthentication loads the User row by the token's user_id
+claim on every request. CachedJWTAuthentication keeps the loaded user in the
+cache for AUTH_USER_CACHE_TTL seconds, so an API call no longer starts with a
+users-table query. The entry is dropped whenever the row changes: on every
+save and delete (see signals.py) and on counter updates (see counters.py).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_cache_key(user_id):
+    return f"auth_user:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    """Drop the cached user, now and again after the commit (a request may re-cache the old row meanwhile)"""
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication reading the user from the cache before the database"""
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            # Let simplejwt reject the token
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+            return user
+
+        # The checks simplejwt runs on a freshly loaded user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class MediaBlob(models.Model):
+    """
+    A media file stored once under its content hash (see blobs.py),
+    shared by every MediaItem, Story and PortfolioImage with the same bytes
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500)  # Storage name: cas/ab/cd/abcd....ext
+    size = models.BigIntegerField()
+    # Number of rows using the file; the blob is deleted when it drops to zero
+    ref_count = models.PositiveIntegerField(default=0)
+    # Resized WebP/JPEG copies shared by those rows: {width: {format: name}} (see image_derivatives.py)
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Low-bitrate MP4 copies of videos: {size: {'mp4': name}} (see video_derivatives.py)
+    renditions = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Media Blob"
+        verbose_name_plural = "Media Blobs"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} reference(s))"
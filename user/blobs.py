@@ -0,0 +1,145 @@
+"""
+Content-addressed media storage.
+
+Every uploaded post, story and portfolio file is stored under the SHA-256 of
+its bytes (cas/ab/cd/abcd....ext) and recorded as a MediaBlob with a
+reference count. Re-posted and forwarded media therefore take disk space
+once: when the hash is already known the upload is not written again and
+its derivatives and video renditions are not rendered again, the new row
+just references the existing blob. Rows release their blob when they are deleted (see
+signals.py); a blob whose count drops to zero is deleted with its files.
+"""
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .blob_models import MediaBlob
+from .image_derivatives import delete_derivatives, render_derivatives, store_derivatives
+from .video_derivatives import store_renditions
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'cas/'
+
+
+def blob_name(sha256, extension):
+    """Storage name of a blob, fanned out over two directory levels"""
+    return f"{BLOB_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}{extension.lower()}"
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def file_sha256(content):
+    """SHA-256 of a django File, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def acquire_blob(content, extension, sha256=None):
+    """
+    Take a reference on the blob holding content, storing it only if the hash is new.
+    :param content: django File with the bytes
+    :return: (blob, created)
+    """
+    sha256 = sha256 or file_sha256(content)
+
+    # Known content: just count the new reference, nothing is written
+    if MediaBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+        return MediaBlob.objects.get(sha256=sha256), False
+
+    name = blob_name(sha256, extension)
+    # Read the size first, saving a staged file moves it away
+    size = content.size
+    if not default_storage.exists(name):
+        stored_name = default_storage.save(name, content)
+        if stored_name != name:
+            # Another request wrote the same blob meanwhile; its copy is identical
+            default_storage.delete(stored_name)
+
+    try:
+        with transaction.atomic():
+            return MediaBlob.objects.create(sha256=sha256, name=name, size=size, ref_count=1), True
+    except IntegrityError:
+        # A concurrent upload of the same bytes created the row first
+        MediaBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        return MediaBlob.objects.get(sha256=sha256), False
+
+
+def attach_blob_derivatives(blob, rendered):
+    """
+    Store rendered derivatives on a blob that has none yet.
+    :return: the blob's derivatives (the ones stored by a concurrent request if it won)
+    """
+    derivatives = store_derivatives(default_storage, blob.name, rendered)
+    if MediaBlob.objects.filter(pk=blob.pk, derivatives={}).update(derivatives=derivatives):
+        blob.derivatives = derivatives
+    else:
+        delete_derivatives(default_storage, derivatives)
+        blob.refresh_from_db(fields=['derivatives'])
+    return blob.derivatives
+
+
+def attach_blob_renditions(blob, renditions):
+    """
+    Store transcoded renditions on a video blob that has none yet.
+    :return: the blob's renditions (the ones stored by a concurrent request if it won)
+    """
+    stored = store_renditions(default_storage, blob.name, renditions)
+    if MediaBlob.objects.filter(pk=blob.pk, renditions={}).update(renditions=stored):
+        blob.renditions = stored
+    else:
+        delete_derivatives(default_storage, stored)
+        blob.refresh_from_db(fields=['renditions'])
+    return blob.renditions
+
+
+def ensure_blob_derivatives(blob):
+    """Render and store the derivatives of an image blob unless it has them already"""
+    if blob.derivatives:
+        return blob.derivatives
+    with default_storage.open(blob.name, 'rb') as source:
+        rendered = render_derivatives(
+            source,
+            settings.IMAGE_DERIVATIVE_WIDTHS,
+            settings.IMAGE_DERIVATIVE_FORMATS,
+            settings.IMAGE_DERIVATIVE_QUALITY,
+        )
+    if not rendered:
+        return {}
+    return attach_blob_derivatives(blob, rendered)
+
+
+def release_blob(name):
+    """Drop one reference to the blob stored under name (no-op for files stored before blobs existed)"""
+    if not is_blob_name(name):
+        return
+    sha256, _ = os.path.splitext(os.path.basename(name))
+    MediaBlob.objects.filter(sha256=sha256, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    # Only delete once the release is committed, a rollback would resurrect the reference
+    transaction.on_commit(lambda: delete_blob_if_unreferenced(sha256))
+
+
+def delete_blob_if_unreferenced(sha256):
+    """Delete a blob and its files if nothing references it anymore"""
+    with transaction.atomic():
+        blob = MediaBlob.objects.filter(sha256=sha256, ref_count=0).first()
+        if blob is None or not MediaBlob.objects.filter(pk=blob.pk, ref_count=0).delete()[0]:
+            return
+        # Files go inside the transaction: a concurrent acquire_blob() waits for it,
+        # then finds neither the row nor the file and writes both again
+        try:
+            default_storage.delete(blob.name)
+        except Exception:
+            logger.exception("Failed to delete blob %s", blob.name)
+        delete_derivatives(default_storage, blob.derivatives)
+        delete_derivatives(default_storage, blob.renditions)
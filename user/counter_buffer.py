@@ -0,0 +1,129 @@
+"""
+Write-behind buffer for hot counters.
+
+When a post goes viral every like would otherwise queue on the same row
+update (and on SQLite, on the database-wide write lock). Instead, like/unlike
+deltas are accumulated in process memory and a background thread flushes
+them in one short transaction every COUNTER_FLUSH_INTERVAL seconds, grouping
+posts with the same delta into a single UPDATE. Reads add the pending delta
+to the persisted value.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .post_models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """Thread-safe per-process buffer of pending deltas for one counter column"""
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self._pending = defaultdict(int)
+        # Deltas taken by a flush that is still writing them, still counted by reads
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # One flush at a time (the flusher thread and atexit)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def add(self, pk, delta):
+        """
+        Record a delta, or apply it right away when buffering is disabled.
+        :return: the part of delta already written to the database (0 when buffered)
+        """
+        if not settings.COUNTER_BUFFER_ENABLED:
+            self._apply({pk: delta})
+            return delta
+        with self._lock:
+            self._pending[pk] += delta
+        self._ensure_flusher()
+        return 0
+
+    def pending(self, pk):
+        """Delta of pk that is not flushed to the database yet"""
+        with self._lock:
+            return self._pending.get(pk, 0) + self._inflight.get(pk, 0)
+
+    def pending_many(self, pks):
+        """Pending deltas for several rows, as a dict"""
+        with self._lock:
+            return {
+                pk: self._pending.get(pk, 0) + self._inflight.get(pk, 0)
+                for pk in pks if pk in self._pending or pk in self._inflight
+            }
+
+    def flush(self):
+        """Write all pending deltas to the database"""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            deltas = {pk: delta for pk, delta in self._pending.items() if delta}
+            self._pending = defaultdict(int)
+            # Readers keep seeing these deltas until the UPDATE is committed
+            self._inflight = deltas
+        if not deltas:
+            return
+        try:
+            self._apply(deltas)
+        except Exception:
+            logger.exception("Failed to flush %s.%s counters, retrying later", self.model.__name__, self.field)
+            # Put the deltas back so they are retried on the next flush
+            with self._lock:
+                self._inflight = {}
+                for pk, delta in deltas.items():
+                    self._pending[pk] += delta
+        else:
+            with self._lock:
+                self._inflight = {}
+
+    def _apply(self, deltas):
+        # Rows that moved by the same amount share one UPDATE
+        pks_by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            pks_by_delta[delta].append(pk)
+
+        with transaction.atomic():
+            for delta, pks in pks_by_delta.items():
+                self.model.objects.filter(pk__in=pks).update(
+                    **{self.field: Greatest(F(self.field) + delta, Value(0))}
+                )
+
+    def _ensure_flusher(self):
+        # Threads don't survive a fork, so a worker process starts its own flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=f"{self.model.__name__}.{self.field} flusher", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.COUNTER_FLUSH_INTERVAL)
+            self.flush()
+
+
+likes_buffer = CounterBuffer(Post, 'likes_count')
+
+# Don't lose buffered likes on a clean shutdown
+atexit.register(likes_buffer.flush)
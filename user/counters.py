@@ -0,0 +1,84 @@
+"""
+Denormalized counters on Post and User.
+
+The views keep the counter columns in step with atomic F() increments so
+profile and feed reads never run COUNT(*). reconcile_counters() recomputes
+them from the source tables to repair any drift (cascaded deletes, admin edits).
+
+Post.likes_count is written behind by each web worker (see counter_buffer.py):
+likes that are not flushed yet are invisible to another process, so while
+COUNTER_BUFFER_ENABLED is on the reconcile leaves that counter alone unless
+asked to include it (with the web workers stopped, or buffering switched off).
+"""
+from django.conf import settings
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .authentication import invalidate_cached_user
+from .counter_buffer import likes_buffer
+from .following_models import UserFollowing
+from .models import User
+from .post_models import Post, PostLike, PostComment
+
+# (model, counter field, counted model, foreign key of the counted model to model)
+COUNTERS = [
+    (Post, 'likes_count', PostLike, 'post'),
+    (Post, 'comments_count', PostComment, 'post'),
+    (User, 'post_count', Post, 'user'),
+    (User, 'follower_count', UserFollowing, 'following_user'),
+    (User, 'following_count', UserFollowing, 'user'),
+]
+
+# Counters whose recent deltas may still sit in a worker's write-behind buffer
+BUFFERED_COUNTERS = [(likes_buffer.model, likes_buffer.field)]
+
+
+def adjust_counter(model, pk, field, delta):
+    """Atomically add delta to a counter column (never going below zero)"""
+    model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + delta, Value(0))})
+    if model is User:
+        # update() sends no post_save: drop the copy request.user is loaded from
+        invalidate_cached_user(pk)
+
+
+def actual_count(counted_model, foreign_key):
+    """Correlated COUNT(*) of the counted rows pointing at the outer row"""
+    counts = counted_model.objects.filter(
+        **{foreign_key: OuterRef('pk')}
+    ).order_by().values(foreign_key).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def reconcile_counters(batch_size=1000, dry_run=False, include_buffered=False):
+    """
+    Recompute every counter and fix the rows that drifted
+    :param include_buffered: also reconcile buffered counters while buffering is on
+        (only safe when no web worker holds unflushed deltas)
+    :return: a dict mapping "Model.field" to the number of drifted rows
+    """
+    # Buffered deltas of this process are written first; other processes' can't be seen
+    likes_buffer.flush()
+    skip_buffered = settings.COUNTER_BUFFER_ENABLED and not include_buffered
+
+    drifted = {}
+    for model, field, counted_model, foreign_key in COUNTERS:
+        if skip_buffered and (model, field) in BUFFERED_COUNTERS:
+            # "Fixing" it would double count the likes still pending in the workers
+            continue
+        drifted_ids = list(
+            model.objects.annotate(actual=actual_count(counted_model, foreign_key))
+            .exclude(**{field: F('actual')})
+            .values_list('pk', flat=True)
+        )
+        drifted[f"{model.__name__}.{field}"] = len(drifted_ids)
+        if dry_run:
+            continue
+
+        for i in range(0, len(drifted_ids), batch_size):
+            model.objects.filter(pk__in=drifted_ids[i:i + batch_size]).update(
+                **{field: actual_count(counted_model, foreign_key)}
+            )
+        if model is User:
+            for pk in drifted_ids:
+                invalidate_cached_user(pk)
+    return drifted
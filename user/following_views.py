@@ -1,7 +1,9 @@
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
 from django.db.models import Q, Count, Exists, OuterRef
@@ -9,20 +11,29 @@ from .response import CustomResponse as Response
 from .models import User
 from .following_models import UserFollowing
 from .post_models import Post
+from .counters import adjust_counter
+from .toggles import toggle
+from .story_tray import invalidate_story_trays
+from .timeline import (
+    backfill_timeline, purge_timeline, timeline_page,
+    new_feed_session, parse_feed_session, shuffled_timeline_window, shuffle_key,
+)
+from .post_serializers import post_queryset, serialize_posts
+from .pagination import is_cursor_request, decode_cursor, cursor_pagination_info
 import random
 
 class FollowUserView(APIView):
     """
     View for following/unfollowing a user
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
     def post(self, request, user_id):
         try:
             # Get the user to follow
-            user_to_follow = get_object_or_404(User, id=user_id)
+            user_to_follow = get_object_or_404(User.objects.only('id', 'username'), id=user_id)
             
             # Check if user is trying to follow themselves
             if request.user.id == user_id:
@@ -31,29 +42,30 @@ class FollowUserView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Check if already following
-            following_exists = UserFollowing.objects.filter(
-                user=request.user,
-                following_user=user_to_follow
-            ).exists()
+            # Follow or unfollow in a single delete-or-insert
+            following, changed = toggle(UserFollowing, user=request.user, following_user=user_to_follow)
             
-            if following_exists:
-                # If already following, unfollow
-                UserFollowing.objects.filter(
-                    user=request.user,
-                    following_user=user_to_follow
-                ).delete()
+            if not following:
+                if changed:
+                    adjust_counter(User, request.user.id, 'following_count', -1)
+                    adjust_counter(User, user_to_follow.id, 'follower_count', -1)
+                    
+                    # Remove their posts from the home timeline and their stories from the tray
+                    purge_timeline(request.user.id, user_to_follow.id)
+                    transaction.on_commit(lambda: invalidate_story_trays([request.user.id]))
                 
                 return Response.success(
                     message=f"You have unfollowed {user_to_follow.username}",
                     status=status.HTTP_200_OK
                 )
             else:
-                # If not following, follow
-                UserFollowing.objects.create(
-                    user=request.user,
-                    following_user=user_to_follow
-                )
+                if changed:
+                    adjust_counter(User, request.user.id, 'following_count', 1)
+                    adjust_counter(User, user_to_follow.id, 'follower_count', 1)
+                    
+                    # Backfill the home timeline with their latest posts and refresh the story tray
+                    backfill_timeline(request.user.id, user_to_follow.id)
+                    transaction.on_commit(lambda: invalidate_story_trays([request.user.id]))
                 
                 return Response.success(
                     message=f"You are now following {user_to_follow.username}",
@@ -70,7 +82,7 @@ class GetFollowersView(APIView):
     """
     View for getting a user's followers
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -106,7 +118,7 @@ class GetFollowingView(APIView):
     """
     View for getting users that the current user is following
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -143,9 +155,11 @@ class RandomizedPostFeedView(APIView):
     View for getting a randomized feed of posts from followed users
     with the current user's latest post at the top if it exists.
     For new users with no following relationships, shows random posts from other users.
-    Implements pagination with 10 posts per page.
+    Implements pagination with 10 posts per page. The shuffle is seeded: page 1 returns
+    a `seed` that the client echoes back so later pages come from the same permutation
+    (in cursor mode the seed travels inside the cursor).
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -154,113 +168,31 @@ class RandomizedPostFeedView(APIView):
             page = int(request.query_params.get('page', 1))
             page_size = 10  # Fixed page size of 10 posts per request
             
-            # Get all users that the current user is following
-            following_users = UserFollowing.objects.filter(user=request.user).values_list('following_user', flat=True)
-            
             # Get the latest post from the current user (if any)
-            user_latest_post = Post.objects.filter(user=request.user).order_by('-created_at').first()
+            user_latest_post_id = Post.objects.filter(
+                user=request.user
+            ).order_by('-created_at').values_list('id', flat=True).first()
             
             # Check if the user is following anyone
-            has_following = following_users.exists()
+            has_following = UserFollowing.objects.filter(user=request.user).exists()
             
-            # Get all posts for the feed (we'll paginate later)
-            if has_following:
-                # Get posts from followed users
-                feed_posts = Post.objects.filter(
-                    user__in=following_users,
-                    is_public=True
-                ).select_related('user').prefetch_related('media_items')
+            if is_cursor_request(request):
+                page_post_ids, pagination_info = self._cursor_post_ids(
+                    request, page_size, has_following, user_latest_post_id
+                )
             else:
-                # For new users with no following relationships, get random public posts from other users
-                # Exclude the user's own posts to avoid duplication (we'll add the latest one separately)
-                feed_posts = Post.objects.filter(
-                    is_public=True
-                ).exclude(user=request.user).select_related('user').prefetch_related('media_items')
-                
-                # Limit to 10 random posts for new users
-                feed_posts = feed_posts.order_by('?')[:10]
-            
-            # Convert queryset to list for randomization
-            posts_list = list(feed_posts)
-            
-            # Randomize the order
-            random.shuffle(posts_list)
-            
-            # If the user has a latest post and we're on the first page, add it to the beginning
-            if user_latest_post and page == 1:
-                # Check if the post is already in the list (could happen if user follows themselves)
-                if user_latest_post not in posts_list:
-                    posts_list.insert(0, user_latest_post)
-                    
-            # Calculate total posts and pages
-            total_posts = len(posts_list)
-            total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
-            
-            # Apply pagination
-            start_idx = (page - 1) * page_size
-            end_idx = min(start_idx + page_size, total_posts)
+                page_post_ids, pagination_info = self._page_post_ids(
+                    request, page, page_size, has_following, user_latest_post_id
+                )
             
-            # Get the paginated subset of posts
-            paginated_posts = posts_list[start_idx:end_idx]
+            # Load only the posts of the requested page, keeping the shuffled order
+            posts_by_id = post_queryset().in_bulk(page_post_ids)
+            paginated_posts = [posts_by_id[post_id] for post_id in page_post_ids if post_id in posts_by_id]
             
             # Prepare response data
-            posts_data = []
-            for post in paginated_posts:  # Use paginated_posts instead of posts_list
-                # Get the main media for the post
-                main_media = post.main_media
-                
-                # Get additional media items
-                additional_media_items = []
-                for media in post.additional_media:
-                    additional_media_items.append({
-                        'id': media.id,
-                        'media_type': media.media_type,
-                        'file_url': media.file_url,
-                        'filename': media.filename
-                    })
-                
-                # Check if the current user has liked this post
-                has_liked = post.likes.filter(user=request.user).exists()
-                
-                # Check if the current user has saved this post
-                has_saved = post.saved_by.filter(user=request.user).exists()
-                
-                posts_data.append({
-                    'id': post.id,
-                    'user': {
-                        'id': post.user.id,
-                        'username': post.user.username,
-                        'name': post.user.name,
-                        'profile_picture': post.user.img.url if post.user.img else None,
-                    },
-                    'caption': post.caption,
-                    'location_name': post.location_name,
-                    'created_at': post.created_at,
-                    'likes_count': post.likes.count(),
-                    'comments_count': post.comments.count(),
-                    'has_liked': has_liked,
-                    'has_saved': has_saved,
-                    'main_media': {
-                        'id': main_media.id if main_media else None,
-                        'media_type': main_media.media_type if main_media else None,
-                        'file_url': main_media.file_url if main_media else None,
-                        'filename': main_media.filename if main_media else None
-                    } if main_media else None,
-                    'additional_media': additional_media_items,
-                    'is_own_post': post.user.id == request.user.id
-                })
-            
-            # Add pagination information to the response
-            pagination_info = {
-                'current_page': page,
-                'total_pages': total_pages,
-                'page_size': page_size,
-                'total_posts': total_posts,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
-            }
+            posts_data = serialize_posts(paginated_posts, request.user)
             
-            return Response.success(
+            response = Response.success(
                 data={
                     'posts': posts_data,
                     'pagination': pagination_info
@@ -269,8 +201,101 @@ class RandomizedPostFeedView(APIView):
                 status=status.HTTP_200_OK
             )
             
+            # A request that carries its seed or cursor is reproducible, so it can be cached
+            if request.query_params.get('cursor') or request.query_params.get('seed'):
+                patch_cache_control(response, private=True, max_age=settings.FEED_CACHE_MAX_AGE)
+                patch_vary_headers(response, ['Authorization'])
+            return response
+            
         except Exception as e:
             return Response.error(
                 message=f"Error retrieving post feed: {str(e)}",
                 status=status.HTTP_400_BAD_REQUEST
             )
+    
+    def _random_post_ids(self, request, seed):
+        """Random public posts from other users, for users that don't follow anyone yet"""
+        # Exclude the user's own posts to avoid duplication (we'll add the latest one separately)
+        # Limit to 10 random posts for new users
+        return list(Post.objects.filter(
+            is_public=True
+        ).exclude(user=request.user).annotate(
+            shuffle=shuffle_key('id', seed)
+        ).order_by('shuffle', 'id').values_list('id', flat=True)[:10])
+    
+    def _page_post_ids(self, request, page, page_size, has_following, user_latest_post_id):
+        """Post ids of the requested page and the pagination info (page number mode)"""
+        # Reuse the feed session echoed back by the client, or start a new one on page 1
+        session = request.query_params.get('seed') or new_feed_session(request.user.id)
+        seed, _ = parse_feed_session(session)
+        
+        # Apply pagination
+        start_idx = (page - 1) * page_size
+        end_idx = start_idx + page_size
+        
+        if has_following:
+            # Read only the requested window of the seeded shuffle of the home timeline
+            post_ids, total_posts = shuffled_timeline_window(request.user.id, session, start_idx, end_idx)
+        else:
+            sample_ids = self._random_post_ids(request, seed)
+            post_ids, total_posts = sample_ids[start_idx:end_idx], len(sample_ids)
+        
+        # If the user has a latest post and we're on the first page, add it to the beginning
+        if user_latest_post_id and page == 1:
+            # Check if the post is already in the list (could happen if user follows themselves)
+            if user_latest_post_id not in post_ids:
+                post_ids.insert(0, user_latest_post_id)
+                
+        # Calculate total pages
+        total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
+        
+        # Add pagination information to the response
+        pagination_info = {
+            'current_page': page,
+            'total_pages': total_pages,
+            'page_size': page_size,
+            'total_posts': total_posts,
+            'has_next': page < total_pages,
+            'has_previous': page > 1,
+            'seed': session
+        }
+        
+        return post_ids, pagination_info
+    
+    def _cursor_post_ids(self, request, page_size, has_following, user_latest_post_id):
+        """Post ids of the requested page and the pagination info (cursor mode)"""
+        cursor = request.query_params.get('cursor')
+        state = decode_cursor(cursor)
+        if state is None:
+            # First page: a new feed session, unless the client echoes one back
+            session = request.query_params.get('seed') or new_feed_session(request.user.id)
+            position = None
+        else:
+            # Later pages carry the session of the first one
+            try:
+                session, position = state['session'], state['position']
+            except (TypeError, KeyError):
+                raise ValueError("Invalid cursor")
+        seed, _ = parse_feed_session(session)
+        
+        # The same session and cursor always yield the same order
+        rng = random.Random(f"{seed}:{cursor}")
+        
+        if has_following:
+            # Walk the timeline by (created_at, id), shuffling only within the page
+            post_ids, next_position = timeline_page(request.user.id, position, page_size)
+        else:
+            # The random sample for new users is a single page
+            post_ids = self._random_post_ids(request, seed) if position is None else []
+            next_position = None
+        
+        rng.shuffle(post_ids)
+        
+        # The user's latest post goes on top of the first page
+        if user_latest_post_id and position is None and user_latest_post_id not in post_ids:
+            post_ids.insert(0, user_latest_post_id)
+        
+        next_state = {'session': session, 'position': next_position} if next_position is not None else None
+        pagination_info = cursor_pagination_info(next_state, page_size)
+        pagination_info['seed'] = session
+        return post_ids, pagination_info
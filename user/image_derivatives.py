@@ -0,0 +1,125 @@
+"""
+Resized, recompressed copies (derivatives) of uploaded images.
+
+Feed grids render 300px tiles, so shipping the multi-megabyte original to
+every list view wastes bandwidth and client decode time. At upload time each
+image is rendered at a few fixed widths in WebP and JPEG and stored next to
+the original; the names are kept in a JSON field on the row:
+
+    {"320": {"webp": "post_media/2026/1/2/abc_320.webp", "jpeg": "..."}, ...}
+
+render_derivatives() is a pure function (source in, encoded bytes out), so it
+can run anywhere; store_derivatives() writes its output to the storage.
+"""
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Pillow format names and file extensions of the derivative formats
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def render_derivatives(source, widths, formats, quality):
+    """
+    Render an image at the given widths and formats.
+    :param source: path or binary file object of the original image
+    :return: list of (width, format, bytes); empty when source is not an image
+    """
+    try:
+        image = Image.open(source)
+        # Let the JPEG decoder downscale while decoding when the original is huge
+        image.draft('RGB', (max(widths), max(widths) * image.height // max(image.width, 1)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, OSError, ValueError):
+        return []
+
+    # Never upscale: widths above the original collapse to the original width
+    targets = sorted({min(width, image.width) for width in widths}, reverse=True)
+
+    rendered = []
+    current = image
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        # Resize from the previous (smaller) step instead of the full original
+        if current.width != width:
+            current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        for name in formats:
+            pillow_format, _ = FORMATS[name]
+            frame = current
+            if pillow_format == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                frame = frame.convert('RGB')
+            elif frame.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                frame = frame.convert('RGBA')
+            buffer = io.BytesIO()
+            frame.save(buffer, pillow_format, quality=quality, optimize=True)
+            rendered.append((width, name, buffer.getvalue()))
+    return rendered
+
+
+def store_derivatives(storage, original_name, rendered):
+    """
+    Save rendered derivatives next to the original file.
+    :return: {width: {format: stored name}} as kept in the derivatives JSON field
+    """
+    root, _ = os.path.splitext(original_name)
+    derivatives = {}
+    for width, name, data in rendered:
+        _, extension = FORMATS[name]
+        stored_name = storage.save(f"{root}_{width}.{extension}", ContentFile(data))
+        derivatives.setdefault(str(width), {})[name] = stored_name
+    return derivatives
+
+
+def generate_derivatives(field_file):
+    """Render and store the derivatives of a saved image file"""
+    if not field_file:
+        return {}
+    with field_file.storage.open(field_file.name, 'rb') as source:
+        rendered = render_derivatives(
+            source,
+            settings.IMAGE_DERIVATIVE_WIDTHS,
+            settings.IMAGE_DERIVATIVE_FORMATS,
+            settings.IMAGE_DERIVATIVE_QUALITY,
+        )
+    return store_derivatives(field_file.storage, field_file.name, rendered)
+
+
+def attach_derivatives(instance, file_field, derivatives_field='derivatives'):
+    """Generate derivatives for instance.<file_field> and save them on the row"""
+    try:
+        derivatives = generate_derivatives(getattr(instance, file_field))
+    except Exception:
+        # The original is still served when derivatives can't be made
+        logger.exception("Failed to generate derivatives for %s %s", type(instance).__name__, instance.pk)
+        return
+    setattr(instance, derivatives_field, derivatives)
+    instance.save(update_fields=[derivatives_field])
+
+
+def derivative_urls(storage, derivatives):
+    """Turn a derivatives JSON field into the same map of URLs"""
+    return {
+        width: {name: storage.url(stored_name) for name, stored_name in names.items()}
+        for width, names in (derivatives or {}).items()
+    }
+
+
+def delete_derivatives(storage, derivatives):
+    """Remove derivative files from storage, logging (not raising) on failure"""
+    for names in (derivatives or {}).values():
+        for stored_name in names.values():
+            try:
+                storage.delete(stored_name)
+            except Exception:
+                logger.exception("Failed to delete derivative %s", stored_name)
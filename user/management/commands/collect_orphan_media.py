@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from user.orphan_media import collect_orphan_media
+
+
+class Command(BaseCommand):
+    """
+    Remove media files that no post, story, profile or blob row references anymore
+    (meant to be run periodically, e.g. from a nightly cron job)
+    """
+    help = "Delete or quarantine unreferenced files under MEDIA_ROOT and abandoned staged uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report orphaned files, don't touch them")
+        parser.add_argument('--quarantine', action='store_true',
+                            help="Move orphaned files to MEDIA_QUARANTINE_DIR instead of deleting them")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows loaded per query and files handled per batch")
+        parser.add_argument('--grace-period', type=int, default=None,
+                            help="Leave files younger than this many seconds alone (default MEDIA_ORPHAN_GRACE_PERIOD)")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Stop after this many orphaned files")
+
+    def handle(self, *args, **options):
+        stats = collect_orphan_media(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            quarantine=options['quarantine'],
+            grace_period=options['grace_period'],
+            limit=options['limit'],
+        )
+        self.stdout.write(f"Scanned {stats['scanned']} file(s)")
+
+        if options['dry_run']:
+            action = "Found"
+        elif options['quarantine']:
+            action = "Quarantined"
+        else:
+            action = "Deleted"
+        count = stats['orphans'] if options['dry_run'] else stats['handled']
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {count} orphaned file(s), {stats['bytes']} byte(s)"
+        ))
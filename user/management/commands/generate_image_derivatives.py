@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from user.blob_models import MediaBlob
+from user.blobs import ensure_blob_derivatives, is_blob_name
+from user.image_derivatives import attach_derivatives
+from user.models import User
+from user.post_models import MediaItem
+from user.profile_models import PortfolioImage
+from user.story_models import Story
+
+
+class Command(BaseCommand):
+    """
+    Generate the resized copies of images uploaded before derivatives existed
+    (or whose generation failed at upload time)
+    """
+    help = "Generate missing image derivatives for posts, stories, portfolios and profile pictures"
+
+    def handle(self, *args, **options):
+        # (queryset, file field, derivatives field) of every image that lacks derivatives
+        sources = [
+            (MediaItem.objects.filter(derivatives={}, processing_state='ready').exclude(media_type='video'), 'file', 'derivatives'),
+            (Story.objects.filter(derivatives={}, processing_state='ready', media_type='image'), 'media', 'derivatives'),
+            (PortfolioImage.objects.filter(derivatives={}), 'image', 'derivatives'),
+            (User.objects.filter(img_derivatives={}).exclude(img='').exclude(img__isnull=True), 'img', 'img_derivatives'),
+        ]
+
+        generated = 0
+        for queryset, file_field, derivatives_field in sources:
+            for instance in queryset.order_by('pk').iterator():
+                name = getattr(instance, file_field).name
+                blob = MediaBlob.objects.filter(name=name).first() if is_blob_name(name) else None
+                if blob is not None:
+                    # Content-addressed files share their blob's derivatives
+                    setattr(instance, derivatives_field, ensure_blob_derivatives(blob))
+                    instance.save(update_fields=[derivatives_field])
+                else:
+                    attach_derivatives(instance, file_field, derivatives_field)
+                generated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {generated} image(s)"))
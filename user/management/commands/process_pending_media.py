@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from user.media_pipeline import process_pending_media
+
+
+class Command(BaseCommand):
+    """
+    Finish uploads left in the 'processing' state, e.g. by a restart while
+    the worker pool still had queued work
+    """
+    help = "Process staged post and story uploads that were never finished"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-failed', action='store_true',
+                            help="Also retry uploads whose processing failed")
+
+    def handle(self, *args, **options):
+        processed = process_pending_media(include_failed=options['include_failed'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} upload(s)"))
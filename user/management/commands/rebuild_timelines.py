@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from user.following_models import UserFollowing
+from user.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    """
+    Rebuild materialized home timelines from the following graph, e.g. to
+    repair a user's feed (existing timelines were filled by migration 0023)
+    """
+    help = "Rebuild home timelines for every user that follows someone"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only rebuild the timeline of this user id (can be repeated)")
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = UserFollowing.objects.values_list(
+                'user_id', flat=True
+            ).distinct().order_by('user_id').iterator()
+
+        rebuilt = 0
+        for user_id in user_ids:
+            rebuild_timeline(user_id)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timeline(s)"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from user.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    """
+    Repair drift in the denormalized like, comment, post and follow counters
+    """
+    help = (
+        "Recompute denormalized counters on posts and users and fix the ones that drifted. "
+        "While COUNTER_BUFFER_ENABLED is on, Post.likes_count is skipped: likes buffered by "
+        "the web workers are not in the database yet and would be counted twice. Use "
+        "--include-buffered with the web workers stopped to reconcile it anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of rows fixed per UPDATE")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report drifted rows, don't fix them")
+        parser.add_argument('--include-buffered', action='store_true',
+                            help="Also reconcile buffered counters (Post.likes_count) while buffering is on")
+
+    def handle(self, *args, **options):
+        drifted = reconcile_counters(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            include_buffered=options['include_buffered'],
+        )
+        for counter, count in drifted.items():
+            self.stdout.write(f"{counter}: {count} drifted row(s)")
+
+        action = "Found" if options['dry_run'] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(f"{action} {sum(drifted.values())} drifted counter(s)"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from user.story_sweeper import sweep_expired_stories
+
+
+class Command(BaseCommand):
+    """
+    Delete expired stories, their views and their media files
+    (meant to be run periodically, e.g. from cron every few minutes)
+    """
+    help = "Delete expired stories with their views and media files in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of stories deleted per transaction")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches (default: until no expired story is left)")
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired_stories(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired story(ies)"))
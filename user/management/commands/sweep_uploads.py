@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from user.uploads import sweep_upload_sessions
+
+
+class Command(BaseCommand):
+    """
+    Delete resumable upload sessions that were abandoned or already used,
+    with their partial files (meant to be run periodically, e.g. from cron)
+    """
+    help = "Delete upload sessions idle for longer than UPLOAD_SESSION_TTL"
+
+    def handle(self, *args, **options):
+        deleted = sweep_upload_sessions()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} upload session(s)"))
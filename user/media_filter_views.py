@@ -1,13 +1,15 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Q, Count, Exists, OuterRef
 import random
 
 from .response import CustomResponse as Response
 from .post_models import Post, MediaItem, PostLike, SavedPost
+from .post_serializers import post_queryset, serialize_posts
+from .pagination import is_cursor_request, decode_cursor, keyset_page, cursor_pagination_info
 from django.contrib.auth import get_user_model
 
 
@@ -15,7 +17,7 @@ class UserPostsView(APIView):
     """
     View for getting posts of a specific user
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -38,37 +40,44 @@ class UserPostsView(APIView):
                 )
             
             # Get all posts by the user
-            user_posts = Post.objects.filter(
+            user_posts = post_queryset().filter(
                 user=target_user
-            ).select_related('user').prefetch_related('media_items')
-            
-            # Apply ordering
-            user_posts = user_posts.order_by('-created_at')
-            
-            # Count total posts
-            total_posts = user_posts.count()
-            
-            # Apply pagination
-            start_idx = (page - 1) * page_size
-            end_idx = start_idx + page_size
+            )
             
-            # Get paginated posts
-            paginated_posts = user_posts[start_idx:end_idx]
+            if is_cursor_request(request):
+                # Keyset pagination on (created_at, id), no total count
+                paginated_posts, next_position = keyset_page(
+                    user_posts, decode_cursor(request.query_params.get('cursor')), page_size
+                )
+                pagination_info = cursor_pagination_info(next_position, page_size)
+            else:
+                # Apply ordering
+                user_posts = user_posts.order_by('-created_at')
+                
+                # Count total posts
+                total_posts = user_posts.count()
+                
+                # Apply pagination
+                start_idx = (page - 1) * page_size
+                end_idx = start_idx + page_size
+                
+                # Get paginated posts
+                paginated_posts = user_posts[start_idx:end_idx]
+                
+                # Calculate pagination info
+                total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
+                
+                pagination_info = {
+                    'current_page': page,
+                    'total_pages': total_pages,
+                    'page_size': page_size,
+                    'total_posts': total_posts,
+                    'has_next': page < total_pages,
+                    'has_previous': page > 1
+                }
             
             # Process posts
-            posts_data = self._process_posts(request, paginated_posts)
-            
-            # Calculate pagination info
-            total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
-            
-            pagination_info = {
-                'current_page': page,
-                'total_pages': total_pages,
-                'page_size': page_size,
-                'total_posts': total_posts,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
-            }
+            posts_data = serialize_posts(paginated_posts, request.user)
             
             # Return user posts
             return Response.success(
@@ -92,57 +101,6 @@ class UserPostsView(APIView):
                 message=f"Error retrieving user posts: {str(e)}",
                 status=status.HTTP_400_BAD_REQUEST
             )
-    
-    def _process_posts(self, request, posts):
-        """Helper method to process posts and format them for the response"""
-        posts_data = []
-        
-        for post in posts:
-            # Get the main media for the post
-            main_media = post.main_media
-            
-            # Get additional media items
-            additional_media_items = []
-            for media in post.additional_media:
-                additional_media_items.append({
-                    'id': media.id,
-                    'media_type': media.media_type,
-                    'file_url': media.file_url,
-                    'filename': media.filename
-                })
-            
-            # Check if the current user has liked this post
-            has_liked = post.likes.filter(user=request.user).exists()
-            
-            # Check if the current user has saved this post
-            has_saved = post.saved_by.filter(user=request.user).exists()
-            
-            posts_data.append({
-                'id': post.id,
-                'user': {
-                    'id': post.user.id,
-                    'username': post.user.username,
-                    'name': post.user.name if hasattr(post.user, 'name') else post.user.username,
-                    'profile_picture': post.user.img.url if hasattr(post.user, 'img') and post.user.img else None,
-                },
-                'caption': post.caption,
-                'location_name': post.location_name,
-                'created_at': post.created_at,
-                'likes_count': post.likes.count(),
-                'comments_count': post.comments.count(),
-                'has_liked': has_liked,
-                'has_saved': has_saved,
-                'main_media': {
-                    'id': main_media.id if main_media else None,
-                    'media_type': main_media.media_type if main_media else None,
-                    'file_url': main_media.file_url if main_media else None,
-                    'filename': main_media.filename if main_media else None
-                } if main_media else None,
-                'additional_media': additional_media_items,
-                'is_own_post': post.user.id == request.user.id
-            })
-        
-        return posts_data
 
 
 class MediaFilteredPostsView(APIView):
@@ -150,7 +108,7 @@ class MediaFilteredPostsView(APIView):
     View for getting posts filtered by media type (image or video)
     Returns separate lists for image posts and video posts
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     # permission_classes = [IsAuthenticated]``
     
     def get(self, request):
@@ -163,9 +121,9 @@ class MediaFilteredPostsView(APIView):
             media_type = request.query_params.get('media_type', None)
             
             # Base query for posts with media items
-            base_query = Post.objects.filter(
+            base_query = post_queryset().filter(
                 is_public=True
-            ).select_related('user').prefetch_related('media_items')
+            )
             
             # Get posts with images
             image_posts = base_query.filter(
@@ -177,6 +135,10 @@ class MediaFilteredPostsView(APIView):
                 media_items__media_type='video'
             ).distinct()
             
+            # Keyset pagination when the client sends a cursor
+            if is_cursor_request(request):
+                return self._get_cursor_page(request, media_type, image_posts, video_posts, page_size)
+            
             # If media_type is specified, filter by that type only
             if media_type == 'image':
                 posts_to_process = image_posts
@@ -204,8 +166,8 @@ class MediaFilteredPostsView(APIView):
                 paginated_video_posts = video_posts[start_idx:end_idx]
                 
                 # Process both lists
-                image_posts_data = self._process_posts(request, paginated_image_posts)
-                video_posts_data = self._process_posts(request, paginated_video_posts)
+                image_posts_data = serialize_posts(paginated_image_posts, request.user)
+                video_posts_data = serialize_posts(paginated_video_posts, request.user)
                 
                 # Calculate pagination info
                 total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
@@ -242,7 +204,7 @@ class MediaFilteredPostsView(APIView):
             paginated_posts = posts_to_process[start_idx:end_idx]
             
             # Process posts
-            posts_data = self._process_posts(request, paginated_posts)
+            posts_data = serialize_posts(paginated_posts, request.user)
             
             # Calculate pagination info
             total_pages = (total_posts + page_size - 1) // page_size  # Ceiling division
@@ -272,53 +234,48 @@ class MediaFilteredPostsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    def _process_posts(self, request, posts):
-        """Helper method to process posts and format them for the response"""
-        posts_data = []
+    def _get_cursor_page(self, request, media_type, image_posts, video_posts, page_size):
+        """Keyset-paginated variant of get(), used when the client sends a cursor"""
+        position = decode_cursor(request.query_params.get('cursor'))
         
-        for post in posts:
-            # Get the main media for the post
-            main_media = post.main_media
-            
-            # Get additional media items
-            additional_media_items = []
-            for media in post.additional_media:
-                additional_media_items.append({
-                    'id': media.id,
-                    'media_type': media.media_type,
-                    'file_url': media.file_url,
-                    'filename': media.filename
-                })
-            
-            # Check if the current user has liked this post
-            has_liked = post.likes.filter(user=request.user).exists()
-            
-            # Check if the current user has saved this post
-            has_saved = post.saved_by.filter(user=request.user).exists()
+        # Filtering by a specific media type: a single list with a single position
+        if media_type in ('image', 'video'):
+            posts = image_posts if media_type == 'image' else video_posts
+            paginated_posts, next_position = keyset_page(posts, position, page_size)
             
-            posts_data.append({
-                'id': post.id,
-                'user': {
-                    'id': post.user.id,
-                    'username': post.user.username,
-                    'name': post.user.name,
-                    'profile_picture': post.user.img.url if post.user.img else None,
+            return Response.success(
+                data={
+                    'posts': serialize_posts(paginated_posts, request.user),
+                    'pagination': cursor_pagination_info(next_position, page_size)
                 },
-                'caption': post.caption,
-                'location_name': post.location_name,
-                'created_at': post.created_at,
-                'likes_count': post.likes.count(),
-                'comments_count': post.comments.count(),
-                'has_liked': has_liked,
-                'has_saved': has_saved,
-                'main_media': {
-                    'id': main_media.id if main_media else None,
-                    'media_type': main_media.media_type if main_media else None,
-                    'file_url': main_media.file_url if main_media else None,
-                    'filename': main_media.filename if main_media else None
-                } if main_media else None,
-                'additional_media': additional_media_items,
-                'is_own_post': post.user.id == request.user.id
-            })
+                message=f'{media_type.capitalize()} posts retrieved successfully',
+                status=status.HTTP_200_OK
+            )
+        
+        # Both lists: the cursor carries one position per list, a missing key means
+        # that list was exhausted on a previous page
+        if position is None:
+            position = {'image': None, 'video': None}
+        elif not isinstance(position, dict):
+            raise ValueError("Invalid cursor")
+        
+        posts_data = {}
+        next_positions = {}
+        for key, posts in (('image', image_posts), ('video', video_posts)):
+            if key not in position:
+                posts_data[key] = []
+                continue
+            paginated_posts, next_position = keyset_page(posts, position[key], page_size)
+            posts_data[key] = serialize_posts(paginated_posts, request.user)
+            if next_position is not None:
+                next_positions[key] = next_position
         
-        return posts_data
+        return Response.success(
+            data={
+                'image_posts': posts_data['image'],
+                'video_posts': posts_data['video'],
+                'pagination': cursor_pagination_info(next_positions or None, page_size)
+            },
+            message='Media filtered posts retrieved successfully',
+            status=status.HTTP_200_OK
+        )
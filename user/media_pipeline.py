@@ -0,0 +1,334 @@
+"""
+Background processing of post and story uploads.
+
+Writing an upload into media storage and rendering its derivatives used to
+happen inside the request's transaction, holding it (and on SQLite the
+database-wide write lock) for the whole disk write. Now the view only writes
+the upload to a local staging directory, creates the row in the 'processing'
+state and returns. After the commit the row is handed to a local worker pool:
+
+* a thread pool does the I/O and database work: moving the staged file into
+  content-addressed storage (see blobs.py) and saving the final state
+* a process pool renders the image derivatives, which is CPU-bound
+* with ffmpeg installed, videos get a poster frame (rendered like image
+  derivatives) and low-bitrate renditions, transcoded once the original is
+  already ready on a separate pool of MEDIA_RENDITION_THREADS threads, so
+  long transcodes never hold up other uploads (see video_derivatives.py)
+
+MEDIA_PROCESSING_SYNC runs the same work inline after the commit (useful for
+development and tests); video renditions still go to their pool. A worker claims a row by moving it from 'processing'
+to 'working', so a row is never processed twice at the same time. Rows left
+in 'processing' by a restart, or in 'working' for longer than
+MEDIA_PROCESSING_STALE_AFTER, are picked up again with the
+process_pending_media command.
+"""
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .blob_models import MediaBlob
+from .blobs import acquire_blob, attach_blob_derivatives, attach_blob_renditions, file_sha256, release_blob
+from .image_derivatives import render_derivatives
+from .media_probe import probe_image, probe_video
+from .upload_handlers import sniff_file
+from .story_tray import invalidate_author_story_trays
+from .video_derivatives import discard_outputs, extract_poster, transcode_renditions
+
+logger = logging.getLogger(__name__)
+
+# Models whose uploads go through the pipeline: label -> (file field, derivatives field)
+PROCESSED_MODELS = {
+    'user.MediaItem': ('file', 'derivatives'),
+    'user.Story': ('media', 'derivatives'),
+}
+
+_pools_lock = threading.Lock()
+_pools = {}
+
+
+class StagedFile(File):
+    """
+    A staged upload handed to storage.save(). FileSystemStorage moves files
+    that expose temporary_file_path() instead of copying them chunk by chunk.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def stage_upload(uploaded_file):
+    """
+    Write an uploaded file to the staging directory (outside any transaction).
+    The SHA-256 computed while it was received, if any, is uploaded_digest(uploaded_file).
+    :return: absolute path of the staged file
+    """
+    os.makedirs(settings.MEDIA_STAGING_DIR, exist_ok=True)
+    _, extension = os.path.splitext(uploaded_file.name)
+    path = os.path.join(settings.MEDIA_STAGING_DIR, f"{uuid.uuid4().hex}{extension.lower()}")
+
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        # Large uploads are already on disk: just move them
+        shutil.move(uploaded_file.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+    return path
+
+
+def uploaded_digest(uploaded_file):
+    """SHA-256 StreamingMediaUploadHandler computed while receiving the file, or '' (other handlers)"""
+    return getattr(uploaded_file, 'sha256', None) or ''
+
+
+def discard_staged(paths):
+    """Remove staged files whose rows were never created"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def submit_media_processing(instance):
+    """Queue the processing of a staged row once the current transaction commits"""
+    label = instance._meta.label
+    pk = instance.pk
+    transaction.on_commit(lambda: _dispatch(label, pk))
+
+
+def _dispatch(label, pk):
+    if settings.MEDIA_PROCESSING_SYNC:
+        process_media(label, pk)
+    else:
+        _pool('threads').submit(process_media, label, pk)
+
+
+def _pool(kind):
+    # Pools don't survive a fork, so every worker process creates its own
+    key = (kind, os.getpid())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                if kind == 'threads':
+                    pool = ThreadPoolExecutor(
+                        max_workers=settings.MEDIA_PROCESSING_THREADS, thread_name_prefix='media'
+                    )
+                elif kind == 'renditions':
+                    pool = ThreadPoolExecutor(
+                        max_workers=settings.MEDIA_RENDITION_THREADS, thread_name_prefix='renditions'
+                    )
+                else:
+                    pool = ProcessPoolExecutor(max_workers=settings.MEDIA_PROCESSING_PROCESSES)
+                _pools[key] = pool
+    return pool
+
+
+def _run_cpu_bound(function, *args):
+    # Pure functions only: they may run in another process
+    if settings.MEDIA_PROCESSING_SYNC or not settings.MEDIA_PROCESSING_PROCESSES:
+        return function(*args)
+    return _pool('processes').submit(function, *args).result()
+
+
+def _render(path):
+    return _run_cpu_bound(
+        render_derivatives,
+        path,
+        settings.IMAGE_DERIVATIVE_WIDTHS,
+        settings.IMAGE_DERIVATIVE_FORMATS,
+        settings.IMAGE_DERIVATIVE_QUALITY,
+    )
+
+
+def _render_poster(path, duration):
+    # ffmpeg runs in its own process; only the resizing of the frame is CPU-bound here
+    poster = extract_poster(path, duration)
+    if poster is None:
+        return []
+    try:
+        return _render(poster)
+    finally:
+        discard_outputs([poster])
+
+
+def _probe(path, media_kind):
+    if media_kind == 'image':
+        return _run_cpu_bound(probe_image, path)
+    # ffprobe is a subprocess and the MP4 parser only seeks: fine in the thread
+    return probe_video(path)
+
+
+def process_media(label, pk):
+    """
+    Move a staged upload into storage, check its real type, extract its
+    metadata, render its derivatives and mark the row ready
+    """
+    model = apps.get_model(label)
+    file_field, derivatives_field = PROCESSED_MODELS[label]
+    # Claim the row: a conditional update only one worker can win, so a row
+    # dispatched after the commit and picked up by process_pending_media too
+    # is processed once
+    started_at = timezone.now()
+    if not model.objects.filter(pk=pk, processing_state='processing').update(
+        processing_state='working', processing_started_at=started_at
+    ):
+        return
+    # Later updates only apply while this worker still owns the row
+    owned = model.objects.filter(pk=pk, processing_state='working', processing_started_at=started_at)
+    # Blob reference taken for the row and not handed over to it yet
+    acquired = None
+    try:
+        instance = model.objects.get(pk=pk)
+        staged_path = instance.staged_file
+        if not os.path.exists(staged_path):
+            logger.error("Staged file %s of %s %s is missing", staged_path, label, pk)
+            owned.update(processing_state='failed')
+            return
+
+        # The type comes from the content, not from what the client claimed
+        _, media_kind = sniff_file(staged_path)
+        if media_kind is None:
+            logger.error("Staged file of %s %s is not a supported image or video", label, pk)
+            owned.update(processing_state='failed', staged_file='')
+            _remove_staged(staged_path)
+            return
+
+        with open(staged_path, 'rb') as staged:
+            content = StagedFile(staged, name=staged_path)
+            size_bytes = content.size
+            # Hashed while the upload was received; only older rows and uploads
+            # whose chunks landed on several processes are read again here
+            sha256 = instance.staged_sha256 or file_sha256(content)
+            metadata = _probe(staged_path, media_kind)
+
+            # Images (and video posters) are rendered from the staged copy before it
+            # is moved away, unless the same bytes were uploaded (and rendered) before
+            derivatives_rendered = []
+            known = MediaBlob.objects.filter(sha256=sha256).exclude(derivatives={}).exists()
+            if media_kind == 'image' and not known:
+                derivatives_rendered = _render(staged_path)
+            elif media_kind == 'video' and not known:
+                derivatives_rendered = _render_poster(staged_path, metadata.get('duration'))
+
+            # Stored under its hash: known content is not written again
+            _, extension = os.path.splitext(staged_path)
+            blob, _ = acquire_blob(content, extension, sha256=sha256)
+            acquired = blob.name
+        derivatives = blob.derivatives
+        if derivatives_rendered and not derivatives:
+            derivatives = attach_blob_derivatives(blob, derivatives_rendered)
+
+        # The row may have been deleted (or reclaimed) meanwhile: only update it if this worker still owns it
+        updated = owned.update(**{
+            file_field: blob.name,
+            derivatives_field: derivatives,
+            'renditions': blob.renditions,
+            'media_type': media_kind,
+            'width': metadata.get('width'),
+            'height': metadata.get('height'),
+            'media_duration': metadata.get('duration'),
+            'placeholder': metadata.get('placeholder', ''),
+            'size_bytes': size_bytes,
+            'processing_state': 'ready',
+            'staged_file': '',
+            'staged_sha256': '',
+        })
+        _remove_staged(staged_path)
+        if not updated:
+            return
+        # The reference now belongs to the row
+        acquired = None
+
+        if label == 'user.Story':
+            # Trays cached while the story was processing have no media URL
+            invalidate_author_story_trays(instance.user_id)
+
+        if media_kind == 'video' and not blob.renditions:
+            # The row is ready and serves the original meanwhile: transcoding can
+            # take minutes, so it runs on its own small pool instead of holding a
+            # processing worker (or the request, with MEDIA_PROCESSING_SYNC)
+            _pool('renditions').submit(_attach_renditions, label, pk, blob.pk, metadata)
+    except Exception:
+        logger.exception("Failed to process %s %s", label, pk)
+        owned.update(processing_state='failed')
+    finally:
+        if acquired is not None:
+            # Don't leak the reference taken for a row that never pointed at the blob
+            release_blob(acquired)
+        if not settings.MEDIA_PROCESSING_SYNC:
+            # Worker threads don't go through the request cycle that closes connections
+            connection.close()
+
+
+def _remove_staged(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _attach_renditions(label, pk, blob_pk, metadata):
+    model = apps.get_model(label)
+    renditions = []
+    try:
+        blob = MediaBlob.objects.filter(pk=blob_pk).first()
+        if blob is None:
+            return
+        if not blob.renditions:
+            renditions = transcode_renditions(
+                default_storage.path(blob.name), metadata.get('width'), metadata.get('height')
+            )
+            if not renditions:
+                return
+            stored = attach_blob_renditions(blob, renditions)
+        else:
+            # Another upload of the same video got there first
+            stored = blob.renditions
+        model.objects.filter(pk=pk, **{PROCESSED_MODELS[label][0]: blob.name}).update(renditions=stored)
+        if label == 'user.Story':
+            user_id = model.objects.filter(pk=pk).values_list('user_id', flat=True).first()
+            if user_id is not None:
+                invalidate_author_story_trays(user_id)
+    except Exception:
+        # The row is ready without renditions: clients play the original
+        logger.exception("Failed to make the renditions of %s %s", label, pk)
+    finally:
+        discard_outputs([path for _, path in renditions])
+        # Pool threads don't go through the request cycle that closes connections
+        connection.close()
+
+
+def process_pending_media(include_failed=False):
+    """
+    Process every row still waiting in the calling thread (e.g. after a restart)
+    :param include_failed: also retry rows whose processing failed
+    :return: number of rows processed
+    """
+    stale = timezone.now() - timezone.timedelta(seconds=settings.MEDIA_PROCESSING_STALE_AFTER)
+    processed = 0
+    for label in PROCESSED_MODELS:
+        model = apps.get_model(label)
+        # Rows claimed by a worker that died (e.g. killed by a restart) are given back
+        model.objects.filter(processing_state='working', processing_started_at__lt=stale).update(
+            processing_state='processing'
+        )
+        if include_failed:
+            model.objects.filter(processing_state='failed').update(processing_state='processing')
+        pks = list(model.objects.filter(processing_state='processing').values_list('pk', flat=True))
+        for pk in pks:
+            process_media(label, pk)
+            processed += 1
+    return processed
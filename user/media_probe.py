@@ -0,0 +1,206 @@
+"""
+Metadata of uploaded media, extracted once while the upload is processed.
+
+Clients get the real dimensions, byte size, duration and a blurhash
+placeholder with every post and story, so they can lay out a feed (and paint
+a blurred preview) before downloading any media. Images are probed with
+Pillow; videos with ffprobe when it is installed, otherwise by reading the
+mvhd/tkhd boxes of MP4/MOV files. Every function here is pure (path in,
+dict out), so image probing can run in the process pool.
+"""
+import json
+import math
+import os
+import shutil
+import struct
+import subprocess
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+# Pixels the placeholder is computed from; more would not change a 4x3 blurhash
+PLACEHOLDER_SAMPLE_SIZE = 32
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """Encode a small blurred preview of a Pillow image as a blurhash string"""
+    image = image.convert('RGB')
+    image.thumbnail((PLACEHOLDER_SAMPLE_SIZE, PLACEHOLDER_SAMPLE_SIZE))
+    width, height = image.size
+    pixels = [tuple(_srgb_to_linear(channel) for channel in pixel) for pixel in image.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            red = green = blue = 0.0
+            for y in range(height):
+                cos_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = normalisation * math.cos(math.pi * i * x / width) * cos_y
+                    pixel_red, pixel_green, pixel_blue = pixels[y * width + x]
+                    red += basis * pixel_red
+                    green += basis * pixel_green
+                    blue += basis * pixel_blue
+            scale = 1 / (width * height)
+            factors.append((red * scale, green * scale, blue * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_maximum = max(0, min(82, int(max(abs(value) for factor in ac for value in factor) * 166 - 0.5)))
+        maximum = (quantised_maximum + 1) / 166
+        result += _base83(quantised_maximum, 1)
+    else:
+        maximum = 1
+        result += _base83(0, 1)
+
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        red, green, blue = (
+            max(0, min(18, int(_sign_pow(value / maximum, 0.5) * 9 + 9.5))) for value in factor
+        )
+        result += _base83(red * 19 * 19 + green * 19 + blue, 2)
+    return result
+
+
+def probe_image(path):
+    """Width and height (as displayed, after EXIF rotation) and placeholder of an image"""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                # Orientations that rotate by 90 degrees swap the displayed dimensions
+                width, height = height, width
+            # Only a thumbnail is needed for the placeholder: let the JPEG decoder downscale
+            image.draft('RGB', (PLACEHOLDER_SAMPLE_SIZE * 4, PLACEHOLDER_SAMPLE_SIZE * 4))
+            placeholder = blurhash(ImageOps.exif_transpose(image))
+    except (UnidentifiedImageError, OSError, ValueError):
+        return {}
+    return {'width': width, 'height': height, 'placeholder': placeholder}
+
+
+def _ffprobe(path):
+    binary = shutil.which(settings.FFPROBE_BINARY)
+    if not binary:
+        return None
+    try:
+        output = subprocess.run(
+            [binary, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=width,height:stream_tags=rotate:stream_side_data=rotation:format=duration',
+             '-of', 'json', path],
+            capture_output=True, timeout=settings.FFPROBE_TIMEOUT, check=True,
+        ).stdout
+        info = json.loads(output)
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return None
+
+    streams = info.get('streams') or [{}]
+    stream = streams[0]
+    width, height = stream.get('width'), stream.get('height')
+    rotation = stream.get('tags', {}).get('rotate')
+    for side_data in stream.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    if width and height and rotation is not None and abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+
+    duration = info.get('format', {}).get('duration')
+    return {
+        'width': width,
+        'height': height,
+        'duration': float(duration) if duration else None,
+    }
+
+
+def _iter_boxes(file, start, end):
+    """(type, payload start, payload end) of the ISO base media boxes between start and end"""
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        payload = position + 8
+        if size == 1:
+            size = struct.unpack('>Q', file.read(8))[0]
+            payload += 8
+        elif size == 0:
+            size = end - position
+        if size < payload - position:
+            return
+        yield box_type, payload, position + size
+        position += size
+
+
+def _mp4_probe(path):
+    """Duration and video dimensions read from the moov box of an MP4/MOV file"""
+    result = {}
+    with open(path, 'rb') as file:
+        end = os.fstat(file.fileno()).st_size
+        # moov is often after a huge mdat: boxes are skipped by size, never read
+        moov = next(((start, stop) for box_type, start, stop in _iter_boxes(file, 0, end) if box_type == b'moov'), None)
+        if moov is None:
+            return result
+
+        for box_type, start, stop in _iter_boxes(file, *moov):
+            if box_type == b'mvhd':
+                file.seek(start)
+                version = file.read(1)[0]
+                file.seek(start + (20 if version == 1 else 12))
+                if version == 1:
+                    timescale, duration = struct.unpack('>IQ', file.read(12))
+                else:
+                    timescale, duration = struct.unpack('>II', file.read(8))
+                if timescale:
+                    result['duration'] = duration / timescale
+
+            elif box_type == b'trak' and 'width' not in result:
+                for inner_type, inner_start, _ in _iter_boxes(file, start, stop):
+                    if inner_type != b'tkhd':
+                        continue
+                    file.seek(inner_start)
+                    version = file.read(1)[0]
+                    # Skip version/flags and the fields up to the matrix (longer in version 1)
+                    file.seek(inner_start + (52 if version == 1 else 40))
+                    matrix = struct.unpack('>9i', file.read(36))
+                    width, height = (value / 65536 for value in struct.unpack('>II', file.read(8)))
+                    if width and height:
+                        # A matrix with a == 0 rotates by 90 or 270 degrees
+                        if matrix[0] == 0 and matrix[1] != 0:
+                            width, height = height, width
+                        result['width'], result['height'] = round(width), round(height)
+    return result
+
+
+def probe_video(path):
+    """Width and height (as displayed) and duration in seconds of a video"""
+    probed = _ffprobe(path)
+    if probed is None:
+        try:
+            probed = _mp4_probe(path)
+        except (OSError, struct.error, IndexError):
+            probed = {}
+    return {key: value for key, value in probed.items() if value is not None}
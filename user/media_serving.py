@@ -0,0 +1,196 @@
+"""
+Media file serving with byte ranges, conditional GETs and long-lived caching.
+
+django.views.static.serve answers every request with the whole file and no
+validators, so scrubbing through a video downloads it again and again. The
+serve_media view:
+
+* answers single byte ranges (Range / If-Range) with 206 Partial Content
+* sends a strong ETag derived from the stored name and answers 304 to
+  If-None-Match / If-Modified-Since
+* marks content-addressed and uuid-named files (which never change once
+  written) as immutable for a year; other files are revalidated
+* with MEDIA_SENDFILE_MODE set, only checks the request and hands the
+  transfer to the web server (nginx X-Accel-Redirect or Apache/lighttpd
+  X-Sendfile), which then does the range handling itself
+
+Staged uploads live under MEDIA_ROOT but are never served, nor are quarantined files.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Content hashes (cas/ blobs and their derivatives) and uuid hex names: the bytes behind them never change
+IMMUTABLE_NAME_RE = re.compile(r'(^|[^0-9a-f])([0-9a-f]{32}|[0-9a-f]{64})([^0-9a-f]|$)')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Block size of ranged responses
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def is_immutable_name(name):
+    """Whether a stored name identifies fixed content (content hash or uuid in the file name)"""
+    return bool(IMMUTABLE_NAME_RE.search(os.path.basename(name)))
+
+
+def media_etag(name, stat_result):
+    """
+    Strong ETag of a stored file. Immutable names are their own validator;
+    other names can be replaced by a new file, so size and mtime are mixed in.
+    """
+    key = name if is_immutable_name(name) else f"{name}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive of a single byte range, None when the header should be
+    ignored (absent, malformed or several ranges), or False when it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Strong comparison: weak validators never match
+    return etag in (tag.strip() for tag in header.split(','))
+
+
+def _not_modified(request, etag, modified):
+    if request.headers.get('If-None-Match'):
+        return _etag_matches(request.headers['If-None-Match'], etag)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(modified) <= since
+
+
+def _iter_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = file.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
+def _sendfile_response(name, path):
+    response = HttpResponse()
+    if settings.MEDIA_SENDFILE_MODE == 'x-accel':
+        # nginx maps this internal location onto MEDIA_ROOT and serves the (ranged) body
+        response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIX + name
+    else:
+        response['X-Sendfile'] = path
+    # Let the web server compute the type and length of the body
+    del response['Content-Type']
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file stored under MEDIA_ROOT"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Media file not found")
+
+    # Uploads waiting for processing and quarantined orphans are not public
+    # (the quarantine is outside MEDIA_ROOT by default, but may be configured inside it)
+    for private_dir in (settings.MEDIA_STAGING_DIR, settings.MEDIA_QUARANTINE_DIR):
+        private_dir = os.path.abspath(private_dir)
+        if full_path == private_dir or full_path.startswith(private_dir + os.sep):
+            raise Http404("Media file not found")
+
+    try:
+        stat_result = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("Media file not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404("Media file not found")
+
+    name = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+    etag = media_etag(name, stat_result)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat_result.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable_name(name) else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, stat_result.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if settings.MEDIA_SENDFILE_MODE:
+        response = _sendfile_response(name, full_path)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    size = stat_result.st_size
+
+    byte_range = parse_range(request.headers.get('Range'), size)
+    # A Range conditioned on an outdated version gets the whole new file
+    if byte_range is not None and request.headers.get('If-Range'):
+        if not _etag_matches(request.headers['If-Range'], etag) and request.headers['If-Range'] != headers['Last-Modified']:
+            byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            () if request.method == 'HEAD' else _iter_range(full_path, start, end),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        # FileResponse lets the WSGI server use sendfile() for the whole body
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
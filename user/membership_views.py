@@ -0,0 +1,78 @@
+from django.conf import settings
+from rest_framework.views import APIView
+from rest_framework import status
+from .authentication import CachedJWTAuthentication
+from rest_framework.permissions import IsAuthenticated
+
+from .response import CustomResponse as Response
+from .following_models import UserFollowing
+from .post_serializers import liked_post_ids, saved_post_ids
+
+
+def followed_user_ids(user, user_ids):
+    """Ids among user_ids that the user is following (one query)"""
+    return set(
+        UserFollowing.objects.filter(
+            user=user, following_user_id__in=user_ids
+        ).values_list('following_user_id', flat=True)
+    )
+
+
+def parse_id_list(value):
+    """Parse a comma-separated list of ids from a query parameter"""
+    if not value:
+        return []
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValueError("Ids must be a comma-separated list of integers")
+
+
+class MembershipView(APIView):
+    """
+    View for hydrating a whole screen of posts and users in one request:
+    returns liked/saved flags for post_ids and following flags for user_ids,
+    in the same order as the ids were sent, with one IN query per relation
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            # Get the ids to look up
+            try:
+                post_ids = parse_id_list(request.query_params.get('post_ids'))
+                user_ids = parse_id_list(request.query_params.get('user_ids'))
+            except ValueError as e:
+                return Response.error(message=str(e), status=status.HTTP_400_BAD_REQUEST)
+
+            # Limit the batch size
+            max_ids = settings.MEMBERSHIP_MAX_IDS
+            if len(post_ids) > max_ids or len(user_ids) > max_ids:
+                return Response.error(
+                    message=f"At most {max_ids} post ids and {max_ids} user ids per request",
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # One query per relation, skipped when there is nothing to look up
+            liked_ids = liked_post_ids(request.user, post_ids) if post_ids else set()
+            saved_ids = saved_post_ids(request.user, post_ids) if post_ids else set()
+            following_ids = followed_user_ids(request.user, user_ids) if user_ids else set()
+
+            return Response.success(
+                data={
+                    'post_ids': post_ids,
+                    'liked': [post_id in liked_ids for post_id in post_ids],
+                    'saved': [post_id in saved_ids for post_id in post_ids],
+                    'user_ids': user_ids,
+                    'following': [user_id in following_ids for user_id in user_ids],
+                },
+                message='Membership retrieved successfully',
+                status=status.HTTP_200_OK
+            )
+
+        except Exception as e:
+            return Response.error(
+                message=f"Error retrieving membership: {str(e)}",
+                status=status.HTTP_400_BAD_REQUEST
+            )
@@ -0,0 +1,98 @@
+# Generated by Django 5.1.15 on 2026-10-17 22:58
+
+import django.db.models.deletion
+import django.utils.timezone
+import user.profile_models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_userfollowing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Achievement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('image', models.ImageField(blank=True, null=True, upload_to=user.profile_models.get_achievement_image_path)),
+                ('date', models.DateField()),
+                ('location', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='achievements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Achievement',
+                'verbose_name_plural': 'Achievements',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PortfolioItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('category', models.CharField(blank=True, max_length=100, null=True)),
+                ('date_completed', models.DateField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='portfolio_items', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Portfolio Item',
+                'verbose_name_plural': 'Portfolio Items',
+                'ordering': ['-date_completed'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PortfolioImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to=user.profile_models.get_portfolio_image_path)),
+                ('is_primary', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('portfolio_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='user.portfolioitem')),
+            ],
+            options={
+                'verbose_name': 'Portfolio Image',
+                'verbose_name_plural': 'Portfolio Images',
+                'ordering': ['-is_primary', 'created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Skill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('category', models.CharField(choices=[('it', 'IT bilimlar'), ('language', 'Chet tillari'), ('other', "Boshqa ko'nikmalar")], max_length=20)),
+                ('rating', models.IntegerField(default=0)),
+                ('icon', models.CharField(blank=True, max_length=100, null=True)),
+                ('date_added', models.DateField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='skills', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Skill',
+                'verbose_name_plural': 'Skills',
+                'ordering': ['-rating', 'category'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Tag',
+                'verbose_name_plural': 'User Tags',
+                'ordering': ['name'],
+                'unique_together': {('user', 'name')},
+            },
+        ),
+    ]
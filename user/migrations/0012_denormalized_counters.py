@@ -0,0 +1,65 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:03
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('user', 'Post')
+    PostLike = apps.get_model('user', 'PostLike')
+    PostComment = apps.get_model('user', 'PostComment')
+    User = apps.get_model('user', 'User')
+    UserFollowing = apps.get_model('user', 'UserFollowing')
+
+    def count_of(model, foreign_key):
+        counts = model.objects.filter(
+            **{foreign_key: OuterRef('pk')}
+        ).order_by().values(foreign_key).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Post.objects.update(
+        likes_count=count_of(PostLike, 'post'),
+        comments_count=count_of(PostComment, 'post'),
+    )
+    User.objects.update(
+        post_count=count_of(Post, 'user'),
+        follower_count=count_of(UserFollowing, 'following_user'),
+        following_count=count_of(UserFollowing, 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
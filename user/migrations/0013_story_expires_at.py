@@ -0,0 +1,42 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:41
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_expires_at(apps, schema_editor):
+    Story = apps.get_model('user', 'Story')
+
+    # expires_at = created_at + duration hours, one UPDATE per distinct duration
+    durations = Story.objects.order_by().values_list('duration', flat=True).distinct()
+    for duration in list(durations):
+        Story.objects.filter(duration=duration).update(
+            expires_at=F('created_at') + timedelta(hours=duration)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0012_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='expires_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='story',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['user', 'expires_at'], name='story_user_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0014_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='processing_state',
+            field=models.CharField(choices=[('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='staged_file',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='processing_state',
+            field=models.CharField(choices=[('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='staged_file',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
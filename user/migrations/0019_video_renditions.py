@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0018_media_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0020_profession_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediaitem',
+            name='processing_state',
+            field=models.CharField(choices=[('processing', 'Processing'), ('working', 'Working'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='story',
+            name='processing_state',
+            field=models.CharField(choices=[('processing', 'Processing'), ('working', 'Working'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0021_media_processing_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='staged_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='staged_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def backfill_timelines(apps, schema_editor):
+    """
+    Materialize the timelines of users who followed someone before fan-out
+    existed, so their feed isn't empty after the deploy (same as rebuild_timelines)
+    """
+    UserFollowing = apps.get_model('user', 'UserFollowing')
+    Post = apps.get_model('user', 'Post')
+    TimelineEntry = apps.get_model('user', 'TimelineEntry')
+
+    follower_ids = UserFollowing.objects.order_by().values_list('user_id', flat=True).distinct()
+    for user_id in list(follower_ids):
+        # Timelines already filled by fan-out are left as they are
+        if TimelineEntry.objects.filter(user_id=user_id).exists():
+            continue
+        followee_ids = UserFollowing.objects.filter(user_id=user_id).values_list('following_user_id', flat=True)
+        recent_posts = Post.objects.filter(
+            user_id__in=followee_ids, is_public=True
+        ).order_by('-created_at').values_list('id', 'created_at')[:settings.TIMELINE_MAX_ENTRIES]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+             for post_id, created_at in recent_posts],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0022_staged_sha256'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
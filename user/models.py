@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser,BaseUserManager
 from django.utils.translation import gettext_lazy as _
+from .image_derivatives import derivative_urls
 class UserManager(BaseUserManager):
     """
     Custom manager for User model without username field.
@@ -28,9 +29,20 @@ class UserManager(BaseUserManager):
         return self.create_user(phone, password, **extra_fields)
 class Profession(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # Lets clients fetch only what changed since their copy of the catalog (see profession_catalog.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
+class ProfessionTombstone(models.Model):
+    """
+        Deleted profession, so catalog deltas can tell clients to drop it
+    """
+    profession_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Profession {self.profession_id} deleted at {self.deleted_at}"
 class User(AbstractUser):
     """
         user class
@@ -68,6 +80,12 @@ class User(AbstractUser):
     username = models.CharField(max_length=255,blank=True,null=True,unique=True)
     bio = models.TextField(blank=True, null=True)
     img = models.ImageField(upload_to='users/', blank=True, null=True)
+    # Resized WebP/JPEG copies of img: {width: {format: name}} (see image_derivatives.py)
+    img_derivatives = models.JSONField(default=dict, blank=True)
+    # Denormalized counters, kept up to date with F() increments (see counters.py)
+    post_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
     # background_img = models.ImageField(upload_to='users/backgrounds/', blank=True, null=True)
     objects  = UserManager()
     USERNAME_FIELD = 'phone'
@@ -81,9 +99,15 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.phone
+
+    @property
+    def img_derivative_urls(self):
+        """URLs of the resized copies of the profile picture"""
+        return derivative_urls(self.img.storage, self.img_derivatives)
 class SmSCode(models.Model):
     """
         Sms code for phone verification
+        (no longer written: codes are kept in the OTP cache, see otp.py)
     """
     phone = models.CharField(max_length=20, unique=True)
     code = models.CharField(max_length=6)
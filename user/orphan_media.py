@@ -0,0 +1,189 @@
+"""
+Garbage collection of media files that no row references anymore.
+
+Deleted posts, stories, achievements and portfolio items, swept rows and
+replaced avatars leave their files behind under MEDIA_ROOT. The collector
+loads every referenced storage name (FileField/ImageField values, derivative
+maps and blob names) into a set, streams MEDIA_ROOT with scandir and deletes
+or quarantines the files missing from that set, in batches.
+
+Files younger than the grace period are never touched: an upload being
+processed is written to storage before its row points at it.
+
+The staging directory is collected too: a staged upload is kept while a post,
+a story (staged_file) or an upload session (path) names it, and is an orphan
+once it is older than the grace period and nothing does, e.g. when the
+request that staged it died before creating its row.
+"""
+import logging
+import os
+import shutil
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+
+logger = logging.getLogger(__name__)
+
+# JSON fields holding {width: {format: name}} derivative maps, as (model label, field)
+DERIVATIVE_FIELDS = [
+    ('user.MediaItem', 'derivatives'),
+    ('user.Story', 'derivatives'),
+    ('user.PortfolioImage', 'derivatives'),
+    ('user.User', 'img_derivatives'),
+    ('user.MediaBlob', 'derivatives'),
+    # Video renditions use the same {size: {format: name}} shape
+    ('user.MediaItem', 'renditions'),
+    ('user.Story', 'renditions'),
+    ('user.MediaBlob', 'renditions'),
+]
+
+# Char fields holding storage names directly, as (model label, field)
+NAME_FIELDS = [
+    ('user.MediaBlob', 'name'),
+]
+
+# Char fields holding absolute paths of files in the staging directory, as (model label, field)
+STAGED_PATH_FIELDS = [
+    ('user.MediaItem', 'staged_file'),
+    ('user.Story', 'staged_file'),
+    ('user.UploadSession', 'path'),
+]
+
+
+def referenced_media_names(batch_size=1000):
+    """Every storage name referenced by a row, loaded batch by batch"""
+    names = set()
+
+    def add_column(model, field_name, is_derivatives=False):
+        values = model.objects.order_by().values_list(field_name, flat=True)
+        for value in values.iterator(chunk_size=batch_size):
+            if not value:
+                continue
+            if is_derivatives:
+                for formats in value.values():
+                    names.update(formats.values())
+            else:
+                names.add(str(value))
+
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                add_column(model, field.name)
+    for label, field_name in NAME_FIELDS:
+        add_column(apps.get_model(label), field_name)
+    for label, field_name in DERIVATIVE_FIELDS:
+        add_column(apps.get_model(label), field_name, is_derivatives=True)
+    return names
+
+
+def referenced_staged_paths(batch_size=1000):
+    """Absolute paths of every staged file a row or an upload session still needs"""
+    paths = set()
+    for label, field_name in STAGED_PATH_FIELDS:
+        values = apps.get_model(label).objects.exclude(**{field_name: ''}).order_by().values_list(field_name, flat=True)
+        paths.update(os.path.abspath(value) for value in values.iterator(chunk_size=batch_size))
+    return paths
+
+
+def iter_media_files(root, skip_dirs):
+    """Stream the files under root with scandir, without listing whole trees in memory"""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if os.path.abspath(entry.path) not in skip_dirs:
+                    yield from iter_media_files(entry.path, skip_dirs)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def prune_empty_dirs(root, skip_dirs):
+    """Remove directories left empty by the collection (never root itself)"""
+    removed = 0
+    for directory, _, _ in os.walk(root, topdown=False):
+        directory = os.path.abspath(directory)
+        if directory == os.path.abspath(root) or any(
+            directory == skip or directory.startswith(skip + os.sep) for skip in skip_dirs
+        ):
+            continue
+        try:
+            os.rmdir(directory)
+            removed += 1
+        except OSError:
+            # Not empty
+            pass
+    return removed
+
+
+def collect_orphan_media(batch_size=1000, dry_run=False, quarantine=False, grace_period=None, limit=None):
+    """
+    Delete (or move to MEDIA_QUARANTINE_DIR) the files under MEDIA_ROOT that no row references
+    and the staged uploads that no row or upload session waits for.
+    :param grace_period: seconds a new file is left alone (default MEDIA_ORPHAN_GRACE_PERIOD)
+    :param limit: stop after handling this many orphans
+    :return: dict of statistics
+    """
+    root = os.path.abspath(settings.MEDIA_ROOT)
+    staging_dir = os.path.abspath(settings.MEDIA_STAGING_DIR)
+    quarantine_dir = os.path.abspath(settings.MEDIA_QUARANTINE_DIR)
+    if grace_period is None:
+        grace_period = settings.MEDIA_ORPHAN_GRACE_PERIOD
+    cutoff = time.time() - grace_period
+    # Staged uploads are checked against their own references, quarantined files are left alone
+    skip_dirs = {staging_dir, quarantine_dir}
+
+    referenced = referenced_media_names(batch_size)
+    staged = referenced_staged_paths(batch_size)
+    stats = {'scanned': 0, 'orphans': 0, 'bytes': 0, 'handled': 0, 'directories_removed': 0}
+
+    batch = []
+
+    def handle(batch):
+        for name, path in batch:
+            try:
+                if quarantine:
+                    target = os.path.join(settings.MEDIA_QUARANTINE_DIR, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                else:
+                    os.remove(path)
+                stats['handled'] += 1
+            except OSError:
+                logger.exception("Failed to collect orphan media file %s", path)
+
+    def candidates():
+        # (entry, name, referenced?) of stored files, named relative to MEDIA_ROOT...
+        if os.path.isdir(root):
+            for entry in iter_media_files(root, skip_dirs):
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                yield entry, name, name in referenced
+        # ...and of staged uploads, quarantined under staging/
+        if os.path.isdir(staging_dir):
+            for entry in iter_media_files(staging_dir, {quarantine_dir}):
+                name = 'staging/' + os.path.relpath(entry.path, staging_dir).replace(os.sep, '/')
+                yield entry, name, os.path.abspath(entry.path) in staged
+
+    for entry, name, is_referenced in candidates():
+        stats['scanned'] += 1
+        if is_referenced:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            continue
+
+        stats['orphans'] += 1
+        stats['bytes'] += stat.st_size
+        if not dry_run:
+            batch.append((name, entry.path))
+            if len(batch) >= batch_size:
+                handle(batch)
+                batch = []
+        if limit is not None and stats['orphans'] >= limit:
+            break
+
+    if not dry_run:
+        handle(batch)
+        if os.path.isdir(root):
+            stats['directories_removed'] = prune_empty_dirs(root, skip_dirs)
+    return stats
@@ -0,0 +1,116 @@
+"""
+One-time SMS login codes kept in Django's cache instead of the SmSCode table.
+
+Every code request used to be an update_or_create in a transaction and every
+verification another write, codes never expired and nothing limited how often
+a phone or a client could ask for or guess codes. Codes now live in the
+OTP_CACHE_ALIAS cache (a file cache shared by the worker processes of one
+host; point it at Redis/Memcached when running several hosts):
+
+* a code expires after OTP_TTL seconds and is single-use
+* a code is dropped after OTP_MAX_ATTEMPTS wrong guesses
+* sending and verifying are rate limited per phone and per client IP with
+  token buckets (OTP_RATE_LIMITS)
+
+Nothing on this path touches the database.
+"""
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+def otp_cache():
+    return caches[settings.OTP_CACHE_ALIAS]
+
+
+def _code_key(phone):
+    return f"otp:code:{phone}"
+
+
+def _attempts_key(phone):
+    return f"otp:attempts:{phone}"
+
+
+def _bucket_key(scope, identifier):
+    return f"otp:bucket:{scope}:{identifier}"
+
+
+def _digest(phone, code):
+    # Codes are not stored in clear, the cache may be a shared server or files on disk
+    return salted_hmac('user.otp', f"{phone}:{code}").hexdigest()
+
+
+def client_ip(request):
+    """IP the request came from (the last proxy hop when OTP_TRUSTED_PROXY_COUNT is set)"""
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if settings.OTP_TRUSTED_PROXY_COUNT and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        if len(hops) >= settings.OTP_TRUSTED_PROXY_COUNT:
+            return hops[-settings.OTP_TRUSTED_PROXY_COUNT]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def take_token(scope, identifier):
+    """
+    Take a token from the bucket of (scope, identifier).
+    :return: 0 when allowed, else the seconds to wait before retrying
+    """
+    capacity, interval = settings.OTP_RATE_LIMITS[scope]
+    cache = otp_cache()
+    key = _bucket_key(scope, identifier)
+    now = time.time()
+
+    tokens, updated = cache.get(key, (capacity, now))
+    # Refill one token per interval since the last request, up to capacity
+    tokens = min(capacity, tokens + (now - updated) / interval)
+    if tokens < 1:
+        return int((1 - tokens) * interval) + 1
+    # get/set is not atomic: concurrent requests may both take the last token, which is fine for a limit
+    cache.set(key, (tokens - 1, now), timeout=int(capacity * interval) + 1)
+    return 0
+
+
+def generate_code():
+    if settings.OTP_FIXED_CODE:
+        # Test setups without SMS delivery
+        return str(settings.OTP_FIXED_CODE)
+    return ''.join(secrets.choice('0123456789') for _ in range(settings.OTP_LENGTH))
+
+
+def issue_code(phone):
+    """Create a new code for phone (replacing any previous one) and return it"""
+    code = generate_code()
+    cache = otp_cache()
+    cache.set(_code_key(phone), _digest(phone, code), timeout=settings.OTP_TTL)
+    cache.delete(_attempts_key(phone))
+    return code
+
+
+def check_code(phone, code):
+    """
+    Verify a code, consuming it on success.
+    :return: 'valid', 'invalid' (wrong code) or 'expired' (no code, expired, used or too many attempts)
+    """
+    cache = otp_cache()
+    expected = cache.get(_code_key(phone))
+    if expected is None:
+        return 'expired'
+
+    if constant_time_compare(expected, _digest(phone, str(code))):
+        # Single use: a replayed request finds nothing
+        cache.delete_many([_code_key(phone), _attempts_key(phone)])
+        return 'valid'
+
+    cache.add(_attempts_key(phone), 0, timeout=settings.OTP_TTL)
+    try:
+        attempts = cache.incr(_attempts_key(phone))
+    except ValueError:
+        # The counter expired between add() and incr()
+        attempts = 1
+    if attempts >= settings.OTP_MAX_ATTEMPTS:
+        # Too many guesses: the code is burnt, a new one has to be requested
+        cache.delete_many([_code_key(phone), _attempts_key(phone)])
+    return 'invalid'
@@ -0,0 +1,84 @@
+"""
+Keyset (cursor) pagination shared by the list endpoints.
+
+Clients opt in by sending a `cursor` query parameter (empty for the first page)
+and get back an opaque `next_cursor`. Rows are ordered newest first by
+(created_at, id), so every page is a single indexed range scan regardless of
+how deep the client has scrolled, and no COUNT(*) query is needed.
+Clients that send `page` keep getting the classic offset pagination.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def is_cursor_request(request):
+    """Check if the client asked for cursor pagination instead of page numbers"""
+    return 'cursor' in request.query_params
+
+
+def encode_cursor(position):
+    """Encode a JSON-serializable position into an opaque url-safe cursor"""
+    if position is None:
+        return None
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor (None or empty means the first page)"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def _parse_position(position):
+    """Validate a (created_at, id) position taken from a cursor"""
+    try:
+        value, last_id = position
+        value = parse_datetime(value)
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if value is None:
+        raise ValueError("Invalid cursor")
+    return value, last_id
+
+
+def keyset_page(queryset, position, page_size, field='created_at'):
+    """
+    Return one page of the queryset ordered by (field, id) descending
+    :param position: position decoded from the cursor, or None for the first page
+    :return: (items, next_position) where next_position is None on the last page
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if position is not None:
+        value, last_id = _parse_position(position)
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': last_id})
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    items = list(queryset[:page_size + 1])
+    next_position = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_position = [getattr(last, field).isoformat(), last.id]
+    return items, next_position
+
+
+def cursor_pagination_info(next_position, page_size):
+    """Pagination block returned by endpoints in cursor mode"""
+    return {
+        'page_size': page_size,
+        'next_cursor': encode_cursor(next_position),
+        'has_next': next_position is not None,
+    }
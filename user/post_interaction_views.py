@@ -1,24 +1,29 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
 from .response import CustomResponse as Response
 from .post_models import Post, PostLike, PostComment, SavedPost
+from .post_serializers import post_queryset, serialize_posts
+from .counters import adjust_counter
+from .counter_buffer import likes_buffer
+from .toggles import toggle
+from .pagination import is_cursor_request, decode_cursor, keyset_page, cursor_pagination_info
 
 class LikePostView(APIView):
     """
     View for liking/unliking a post
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
     def post(self, request, post_id):
         try:
-            # Get the post
-            post = get_object_or_404(Post, id=post_id)
+            # Get the post (only the columns this view needs)
+            post = get_object_or_404(Post.objects.only('id', 'allow_likes', 'likes_count'), id=post_id)
             
             # Check if post allows likes
             if not post.allow_likes:
@@ -27,45 +32,20 @@ class LikePostView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Check if user has already liked the post
-            like_exists = PostLike.objects.filter(
-                post=post,
-                user=request.user
-            ).exists()
+            # Like or unlike in a single delete-or-insert
+            liked, changed = toggle(PostLike, post=post, user=request.user)
+            # Part of the delta already written (when buffering is off), on top of the value read above
+            applied = likes_buffer.add(post.id, 1 if liked else -1) if changed else 0
             
-            if like_exists:
-                # If already liked, unlike
-                PostLike.objects.filter(
-                    post=post,
-                    user=request.user
-                ).delete()
-                
-                return Response.success(
-                    data={
-                        'post_id': post_id,
-                        'liked': False,
-                        'likes_count': post.likes.count()
-                    },
-                    message="Post unliked successfully",
-                    status=status.HTTP_200_OK
-                )
-            else:
-                # If not liked, like
-                PostLike.objects.create(
-                    post=post,
-                    user=request.user,
-                    like_type='like'
-                )
-                
-                return Response.success(
-                    data={
-                        'post_id': post_id,
-                        'liked': True,
-                        'likes_count': post.likes.count()
-                    },
-                    message="Post liked successfully",
-                    status=status.HTTP_201_CREATED
-                )
+            return Response.success(
+                data={
+                    'post_id': post_id,
+                    'liked': liked,
+                    'likes_count': post.likes_count + applied + likes_buffer.pending(post.id)
+                },
+                message="Post liked successfully" if liked else "Post unliked successfully",
+                status=status.HTTP_201_CREATED if liked else status.HTTP_200_OK
+            )
                 
         except Exception as e:
             return Response.error(
@@ -77,7 +57,7 @@ class CommentPostView(APIView):
     """
     View for adding a comment to a post
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
@@ -108,6 +88,7 @@ class CommentPostView(APIView):
                 user=request.user,
                 text=text
             )
+            adjust_counter(Post, post.id, 'comments_count', 1)
             
             return Response.success(
                 data={
@@ -135,7 +116,7 @@ class GetPostCommentsView(APIView):
     """
     View for getting comments on a post
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, post_id):
@@ -150,16 +131,33 @@ class GetPostCommentsView(APIView):
             # Get all comments for the post
             comments = PostComment.objects.filter(post=post).order_by('-created_at')
             
-            # Calculate total comments and pages
-            total_comments = comments.count()
-            total_pages = (total_comments + page_size - 1) // page_size  # Ceiling division
-            
-            # Apply pagination
-            start_idx = (page - 1) * page_size
-            end_idx = start_idx + page_size
-            
-            # Get the paginated subset of comments
-            paginated_comments = comments[start_idx:end_idx]
+            if is_cursor_request(request):
+                # Keyset pagination on (created_at, id), no total count
+                paginated_comments, next_position = keyset_page(
+                    comments, decode_cursor(request.query_params.get('cursor')), page_size
+                )
+                pagination_info = cursor_pagination_info(next_position, page_size)
+            else:
+                # Calculate total comments and pages
+                total_comments = comments.count()
+                total_pages = (total_comments + page_size - 1) // page_size  # Ceiling division
+                
+                # Apply pagination
+                start_idx = (page - 1) * page_size
+                end_idx = start_idx + page_size
+                
+                # Get the paginated subset of comments
+                paginated_comments = comments[start_idx:end_idx]
+                
+                # Add pagination information to the response
+                pagination_info = {
+                    'current_page': page,
+                    'total_pages': total_pages,
+                    'page_size': page_size,
+                    'total_comments': total_comments,
+                    'has_next': page < total_pages,
+                    'has_previous': page > 1
+                }
             
             # Prepare response data
             comments_data = []
@@ -176,16 +174,6 @@ class GetPostCommentsView(APIView):
                     'is_own_comment': comment.user.id == request.user.id
                 })
             
-            # Add pagination information to the response
-            pagination_info = {
-                'current_page': page,
-                'total_pages': total_pages,
-                'page_size': page_size,
-                'total_comments': total_comments,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
-            }
-            
             return Response.success(
                 data={
                     'post_id': post_id,
@@ -206,7 +194,7 @@ class DeleteCommentView(APIView):
     """
     View for deleting a comment
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
@@ -224,6 +212,7 @@ class DeleteCommentView(APIView):
             
             # Delete the comment
             comment.delete()
+            adjust_counter(Post, comment.post_id, 'comments_count', -1)
             
             return Response.success(
                 message="Comment deleted successfully",
@@ -240,51 +229,26 @@ class SavePostView(APIView):
     """
     View for saving/unsaving a post
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
     def post(self, request, post_id):
         try:
             # Get the post
-            post = get_object_or_404(Post, id=post_id)
+            post = get_object_or_404(Post.objects.only('id'), id=post_id)
             
-            # Check if user has already saved the post
-            save_exists = SavedPost.objects.filter(
-                post=post,
-                user=request.user
-            ).exists()
+            # Save or unsave in a single delete-or-insert
+            saved, _ = toggle(SavedPost, post=post, user=request.user)
             
-            if save_exists:
-                # If already saved, unsave
-                SavedPost.objects.filter(
-                    post=post,
-                    user=request.user
-                ).delete()
-                
-                return Response.success(
-                    data={
-                        'post_id': post_id,
-                        'saved': False
-                    },
-                    message="Post unsaved successfully",
-                    status=status.HTTP_200_OK
-                )
-            else:
-                # If not saved, save
-                SavedPost.objects.create(
-                    post=post,
-                    user=request.user
-                )
-                
-                return Response.success(
-                    data={
-                        'post_id': post_id,
-                        'saved': True
-                    },
-                    message="Post saved successfully",
-                    status=status.HTTP_201_CREATED
-                )
+            return Response.success(
+                data={
+                    'post_id': post_id,
+                    'saved': saved
+                },
+                message="Post saved successfully" if saved else "Post unsaved successfully",
+                status=status.HTTP_201_CREATED if saved else status.HTTP_200_OK
+            )
                 
         except Exception as e:
             return Response.error(
@@ -296,7 +260,7 @@ class GetSavedPostsView(APIView):
     """
     View for getting saved posts
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -308,69 +272,47 @@ class GetSavedPostsView(APIView):
             # Get all saved posts for the user
             saved_posts = SavedPost.objects.filter(user=request.user).order_by('-created_at')
             
-            # Calculate total saved posts and pages
-            total_saved_posts = saved_posts.count()
-            total_pages = (total_saved_posts + page_size - 1) // page_size  # Ceiling division
-            
-            # Apply pagination
-            start_idx = (page - 1) * page_size
-            end_idx = start_idx + page_size
-            
-            # Get the paginated subset of saved posts
-            paginated_saved_posts = saved_posts[start_idx:end_idx]
-            
-            # Prepare response data
-            posts_data = []
-            for saved_post in paginated_saved_posts:
-                post = saved_post.post
+            if is_cursor_request(request):
+                # Keyset pagination on (created_at, id), no total count
+                paginated_saved_posts, next_position = keyset_page(
+                    saved_posts, decode_cursor(request.query_params.get('cursor')), page_size
+                )
+                pagination_info = cursor_pagination_info(next_position, page_size)
+            else:
+                # Calculate total saved posts and pages
+                total_saved_posts = saved_posts.count()
+                total_pages = (total_saved_posts + page_size - 1) // page_size  # Ceiling division
                 
-                # Get the main media for the post
-                main_media = post.main_media
+                # Apply pagination
+                start_idx = (page - 1) * page_size
+                end_idx = start_idx + page_size
                 
-                # Get additional media items
-                additional_media_items = []
-                for media in post.additional_media:
-                    additional_media_items.append({
-                        'id': media.id,
-                        'media_type': media.media_type,
-                        'file_url': media.file_url,
-                        'filename': media.filename
-                    })
+                # Get the paginated subset of saved posts
+                paginated_saved_posts = saved_posts[start_idx:end_idx]
                 
-                posts_data.append({
-                    'id': post.id,
-                    'user': {
-                        'id': post.user.id,
-                        'username': post.user.username,
-                        'name': post.user.name,
-                        'profile_picture': post.user.img.url if post.user.img else None,
-                    },
-                    'caption': post.caption,
-                    'location_name': post.location_name,
-                    'created_at': post.created_at,
-                    'likes_count': post.likes.count(),
-                    'comments_count': post.comments.count(),
-                    'has_liked': post.likes.filter(user=request.user).exists(),
-                    'has_saved': True,  # Always true since these are saved posts
-                    'main_media': {
-                        'id': main_media.id if main_media else None,
-                        'media_type': main_media.media_type if main_media else None,
-                        'file_url': main_media.file_url if main_media else None,
-                        'filename': main_media.filename if main_media else None
-                    } if main_media else None,
-                    'additional_media': additional_media_items,
-                    'saved_at': saved_post.created_at
-                })
+                # Add pagination information to the response
+                pagination_info = {
+                    'current_page': page,
+                    'total_pages': total_pages,
+                    'page_size': page_size,
+                    'total_saved_posts': total_saved_posts,
+                    'has_next': page < total_pages,
+                    'has_previous': page > 1
+                }
+            
+            # Load the saved posts of the page in one batch, keeping the saved order
+            paginated_saved_posts = list(paginated_saved_posts)
+            posts_by_id = post_queryset().in_bulk([saved_post.post_id for saved_post in paginated_saved_posts])
+            saved_page = [
+                (saved_post, posts_by_id[saved_post.post_id])
+                for saved_post in paginated_saved_posts
+                if saved_post.post_id in posts_by_id
+            ]
             
-            # Add pagination information to the response
-            pagination_info = {
-                'current_page': page,
-                'total_pages': total_pages,
-                'page_size': page_size,
-                'total_saved_posts': total_saved_posts,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
-            }
+            # Prepare response data
+            posts_data = serialize_posts([post for _, post in saved_page], request.user)
+            for (saved_post, _), post_data in zip(saved_page, posts_data):
+                post_data['saved_at'] = saved_post.created_at
             
             return Response.success(
                 data={
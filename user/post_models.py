@@ -2,6 +2,9 @@ from django.db import models
 from django.conf import settings
 from django.utils import timezone
 
+from .image_derivatives import derivative_urls
+from .video_derivatives import poster_url
+
 class Post(models.Model):
     """
     Model for user posts with media content
@@ -12,6 +15,9 @@ class Post(models.Model):
     is_public = models.BooleanField(default=True)
     allow_comments = models.BooleanField(default=True)
     allow_likes = models.BooleanField(default=True)
+    # Denormalized counters, kept up to date with F() increments (see counters.py)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -62,11 +68,32 @@ class MediaItem(models.Model):
         ('image', 'Image'),
         ('video', 'Video'),
     ]
+    PROCESSING_STATE_CHOICES = [
+        ('processing', 'Processing'),  # Waiting for a worker
+        ('working', 'Working'),  # Claimed by a worker (see media_pipeline.process_media)
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='media_items')
     file = models.FileField(upload_to=get_file_path, max_length=500)  # Increased max_length and custom upload path
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES)
     is_main = models.BooleanField(default=False)
+    # Resized WebP/JPEG copies of images (of the poster frame for videos): {width: {format: name}} (see image_derivatives.py)
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Low-bitrate MP4 copies of videos for feed autoplay: {size: {'mp4': name}} (see video_derivatives.py)
+    renditions = models.JSONField(default=dict, blank=True)
+    # Uploads are staged on disk and finished in the background (see media_pipeline.py)
+    processing_state = models.CharField(max_length=10, choices=PROCESSING_STATE_CHOICES, default='ready')
+    staged_file = models.CharField(max_length=500, blank=True)
+    staged_sha256 = models.CharField(max_length=64, blank=True)  # Hashed while the upload was received, if it was
+    processing_started_at = models.DateTimeField(null=True, blank=True)  # When a worker claimed the row
+    # Probed from the content while processing (see media_probe.py), so clients can lay out without downloading
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    size_bytes = models.BigIntegerField(null=True, blank=True)
+    media_duration = models.FloatField(null=True, blank=True)  # Seconds, videos only
+    placeholder = models.CharField(max_length=64, blank=True)  # Blurhash of images
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -83,7 +110,21 @@ class MediaItem(models.Model):
     
     @property
     def file_url(self):
-        return self.file.url if self.file else None
+        # No URL until the staged upload has been moved into place
+        return self.file.url if self.file and self.processing_state == 'ready' else None
+    
+    @property
+    def derivative_urls(self):
+        return derivative_urls(self.file.storage, self.derivatives)
+    
+    @property
+    def poster_url(self):
+        # Videos only: images are their own poster
+        return poster_url(self.file.storage, self.derivatives) if self.media_type == 'video' else None
+    
+    @property
+    def rendition_urls(self):
+        return derivative_urls(self.file.storage, self.renditions)
 
 
 class PostLike(models.Model):
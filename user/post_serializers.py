@@ -0,0 +1,100 @@
+"""
+Shared post hydration for every post list endpoint.
+
+A page of posts is loaded and serialized with a constant number of queries:
+the posts with their authors and denormalized like/comment counters, one
+prefetch for the media items, and one set lookup each for the viewer's likes
+and saves.
+"""
+from .post_models import Post, PostLike, SavedPost
+from .counter_buffer import likes_buffer
+
+
+def post_queryset():
+    """Base queryset for post lists: author joined and media prefetched"""
+    return Post.objects.select_related('user').prefetch_related('media_items')
+
+
+def liked_post_ids(user, post_ids):
+    """Ids among post_ids that the user has liked (one query)"""
+    if not user.is_authenticated:
+        return set()
+    return set(PostLike.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', flat=True))
+
+
+def saved_post_ids(user, post_ids):
+    """Ids among post_ids that the user has saved (one query)"""
+    if not user.is_authenticated:
+        return set()
+    return set(SavedPost.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', flat=True))
+
+
+def serialize_media(media):
+    """Format a media item for the response"""
+    return {
+        'id': media.id,
+        'media_type': media.media_type,
+        'file_url': media.file_url,
+        # Resized WebP/JPEG copies for list views, {width: {format: url}}
+        'derivatives': media.derivative_urls,
+        # Videos: first frame to show before playing, and low-bitrate copies for autoplay {size: {'mp4': url}}
+        'poster_url': media.poster_url,
+        'renditions': media.rendition_urls,
+        # Probed while processing: clients reserve the space and paint the blurhash before loading
+        'width': media.width,
+        'height': media.height,
+        'size_bytes': media.size_bytes,
+        'duration_seconds': media.media_duration,
+        'placeholder': media.placeholder,
+        'filename': media.filename,
+        'processing_state': media.processing_state
+    }
+
+
+def serialize_post(post, user, has_liked, has_saved, pending_likes=None):
+    """Format a post loaded through post_queryset() for the response"""
+    pending_likes = pending_likes or {}
+
+    # Split the prefetched media items instead of querying main/additional media again
+    main_media = None
+    additional_media_items = []
+    for media in post.media_items.all():
+        if media.is_main and main_media is None:
+            main_media = media
+        elif not media.is_main:
+            additional_media_items.append(serialize_media(media))
+
+    return {
+        'id': post.id,
+        'user': {
+            'id': post.user.id,
+            'username': post.user.username,
+            'name': post.user.name,
+            'profile_picture': post.user.img.url if post.user.img else None,
+            'profile_picture_derivatives': post.user.img_derivative_urls,
+        },
+        'caption': post.caption,
+        'location_name': post.location_name,
+        'created_at': post.created_at,
+        # Persisted value plus the likes still waiting in the write-behind buffer
+        'likes_count': post.likes_count + pending_likes.get(post.id, 0),
+        'comments_count': post.comments_count,
+        'has_liked': has_liked,
+        'has_saved': has_saved,
+        'main_media': serialize_media(main_media) if main_media else None,
+        'additional_media': additional_media_items,
+        'is_own_post': post.user.id == user.id
+    }
+
+
+def serialize_posts(posts, user):
+    """Format a page of posts loaded through post_queryset(), keeping their order"""
+    posts = list(posts)
+    post_ids = [post.id for post in posts]
+    liked_ids = liked_post_ids(user, post_ids)
+    saved_ids = saved_post_ids(user, post_ids)
+    pending_likes = likes_buffer.pending_many(post_ids)
+    return [
+        serialize_post(post, user, post.id in liked_ids, post.id in saved_ids, pending_likes)
+        for post in posts
+    ]
@@ -0,0 +1,91 @@
+"""
+Versioned, cached profession catalog.
+
+Every app launch fetches the professions, which almost never change. The
+catalog is built once and cached; its version is the time of the latest
+change (profession saved or deleted) in microseconds, and its strong ETag is
+derived from that version, so a client holding the current catalog gets a
+304 without any work. With ?since=<version> a client gets only the
+professions changed after its copy and the ids deleted since (kept as
+ProfessionTombstone rows).
+
+Saves and deletes drop the cached catalog (see signals.py). The cache is per
+process unless a shared backend is configured, so other processes catch up
+within PROFESSION_CATALOG_TTL seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+
+from .models import Profession, ProfessionTombstone
+
+CATALOG_CACHE_KEY = "profession_catalog"
+
+
+def _version(moment):
+    return int(moment.timestamp() * 1_000_000) if moment else 0
+
+
+def build_catalog():
+    """Load the catalog: version, ETag, professions and deletions, each stamped with its version"""
+    professions = [
+        {'id': profession_id, 'name': name, 'version': _version(updated_at)}
+        for profession_id, name, updated_at in Profession.objects.order_by('id').values_list('id', 'name', 'updated_at')
+    ]
+    deleted = [
+        {'id': profession_id, 'version': _version(deleted_at)}
+        for profession_id, deleted_at in ProfessionTombstone.objects.values_list('profession_id', 'deleted_at')
+    ]
+    version = max(
+        [item['version'] for item in professions] + [item['version'] for item in deleted] + [0]
+    )
+    return {
+        'version': version,
+        'etag': f'"professions-{version}"',
+        'professions': professions,
+        'deleted': deleted,
+    }
+
+
+def get_catalog():
+    """The cached catalog, built on a miss"""
+    catalog = cache.get(CATALOG_CACHE_KEY)
+    if catalog is None:
+        catalog = build_catalog()
+        cache.set(CATALOG_CACHE_KEY, catalog, settings.PROFESSION_CATALOG_TTL)
+    return catalog
+
+
+def invalidate_catalog():
+    cache.delete(CATALOG_CACHE_KEY)
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header covers etag: '*', or any tag in the list compared weakly"""
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    if etags == ['*']:
+        return True
+    # Weak comparison, as for If-None-Match in RFC 9110 (a proxy may have weakened the tag)
+    return etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+
+def catalog_delta(catalog, since):
+    """Professions changed and ids deleted after version since"""
+    current_ids = {item['id'] for item in catalog['professions']}
+    return {
+        'version': catalog['version'],
+        'professions': [
+            {'id': item['id'], 'name': item['name']} for item in catalog['professions'] if item['version'] > since
+        ],
+        # An id that exists again (reused by the database) is an update, not a deletion
+        'deleted': [
+            item['id'] for item in catalog['deleted'] if item['version'] > since and item['id'] not in current_ids
+        ],
+    }
+
+
+def catalog_list(catalog):
+    """The full catalog in the response format of get-profession/"""
+    return [{'id': item['id'], 'name': item['name']} for item in catalog['professions']]
@@ -4,6 +4,8 @@ from django.utils import timezone
 import uuid
 import os
 
+from .image_derivatives import derivative_urls
+
 def get_achievement_image_path(instance, filename):
     """Generate a unique filename for uploaded achievement images"""
     ext = filename.split('.')[-1]
@@ -87,6 +89,8 @@ class PortfolioImage(models.Model):
     """
     portfolio_item = models.ForeignKey(PortfolioItem, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=get_portfolio_image_path)
+    # Resized WebP/JPEG copies: {width: {format: name}} (see image_derivatives.py)
+    derivatives = models.JSONField(default=dict, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -97,6 +101,11 @@ class PortfolioImage(models.Model):
     
     def __str__(self):
         return f"Image for {self.portfolio_item.title}"
+    
+    @property
+    def derivative_urls(self):
+        """Return the URLs of the resized copies of the image"""
+        return derivative_urls(self.image.storage, self.derivatives)
 
 class UserTag(models.Model):
     """
@@ -1,7 +1,7 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
@@ -9,12 +9,13 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from .response import CustomResponse as Response
 from .models import User
 from .profile_views import CompactProfileView
+from .image_derivatives import attach_derivatives
 
 class ProfileUpdateView(APIView):
     """
     View for updating user bio and profile image
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     
@@ -32,17 +33,25 @@ class ProfileUpdateView(APIView):
                 )
             
             user = request.user
+            updated_fields = []
             
             # Update bio if provided
             if 'bio' in request.data:
                 user.bio = request.data.get('bio')
+                updated_fields.append('bio')
             
             # Handle profile picture update if provided
             if 'profile_picture' in request.FILES:
                 user.img = request.FILES['profile_picture']
+                updated_fields.append('img')
             
-            # Save user changes
-            user.save()
+            # Save only the changed fields so the denormalized counters aren't overwritten
+            if updated_fields:
+                user.save(update_fields=updated_fields)
+            
+            # Resize the new profile picture for list views
+            if 'img' in updated_fields:
+                attach_derivatives(user, 'img', 'img_derivatives')
             
             # Return the updated profile using the CompactProfileView
             compact_view = CompactProfileView()
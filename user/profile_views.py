@@ -1,21 +1,23 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
 from django.utils import timezone
 from .response import CustomResponse as Response
 from .models import User
 from .profile_models import Skill, Achievement, PortfolioItem, PortfolioImage, UserTag
+from .blobs import acquire_blob, ensure_blob_derivatives, release_blob
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.db.models import Avg, Count
+import os
 
 class UserProfileView(APIView):
     """
     View for getting a user's profile information
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, user_id=None):
@@ -61,6 +63,7 @@ class UserProfileView(APIView):
                     images.append({
                         'id': img.id,
                         'url': img.image.url,
+                        'derivatives': img.derivative_urls,
                         'is_primary': img.is_primary
                     })
                 
@@ -92,10 +95,11 @@ class UserProfileView(APIView):
                 'phone': user.phone,
                 'bio': user.bio,
                 'profile_picture': user.img.url if user.img else None,
+                'profile_picture_derivatives': user.img_derivative_urls,
                 'rating': user_rating,
-                'post_count': user.posts.count(),
-                'follower_count': user.followers.count(),
-                'following_count': user.following.count(),
+                'post_count': user.post_count,
+                'follower_count': user.follower_count,
+                'following_count': user.following_count,
                 'skills': skills,
                 'achievements': achievements,
                 'portfolio_items': portfolio_items,
@@ -119,7 +123,7 @@ class SkillView(APIView):
     """
     View for managing user skills
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [JSONParser]
     
@@ -212,11 +216,10 @@ class AchievementView(APIView):
     """
     View for managing user achievements
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     
-    @transaction.atomic
     def post(self, request):
         try:
             # Extract data from request
@@ -302,11 +305,10 @@ class PortfolioItemView(APIView):
     """
     View for managing portfolio items
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     
-    @transaction.atomic
     def post(self, request):
         try:
             # Extract data from request
@@ -338,27 +340,49 @@ class PortfolioItemView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Create the portfolio item
-            portfolio_item = PortfolioItem.objects.create(
-                user=request.user,
-                title=title,
-                description=description,
-                category=category,
-                date_completed=date_completed
-            )
+            # Store the images before opening the transaction: files aren't rolled back with
+            # the rows, so the blobs are released again if the rows can't be created
+            stored = []
+            try:
+                for image in images:
+                    # Stored once per distinct content, identical images share the file and its derivatives
+                    _, extension = os.path.splitext(image.name)
+                    blob, _ = acquire_blob(image, extension)
+                    stored.append(blob)
+                    blob.derivatives = ensure_blob_derivatives(blob)
+                
+                with transaction.atomic():
+                    # Create the portfolio item
+                    portfolio_item = PortfolioItem.objects.create(
+                        user=request.user,
+                        title=title,
+                        description=description,
+                        category=category,
+                        date_completed=date_completed
+                    )
+                    
+                    # Add images, the first one is primary
+                    created_images = [
+                        PortfolioImage.objects.create(
+                            portfolio_item=portfolio_item,
+                            image=blob.name,
+                            derivatives=blob.derivatives,
+                            is_primary=(i == 0)
+                        )
+                        for i, blob in enumerate(stored)
+                    ]
+            except Exception:
+                # Drop the references taken above; blobs nobody else uses are deleted with their files
+                for blob in stored:
+                    release_blob(blob.name)
+                raise
             
-            # Add images
             portfolio_images = []
-            for i, image in enumerate(images):
-                is_primary = (i == 0)  # First image is primary
-                portfolio_image = PortfolioImage.objects.create(
-                    portfolio_item=portfolio_item,
-                    image=image,
-                    is_primary=is_primary
-                )
+            for portfolio_image in created_images:
                 portfolio_images.append({
                     'id': portfolio_image.id,
                     'url': portfolio_image.image.url,
+                    'derivatives': portfolio_image.derivative_urls,
                     'is_primary': portfolio_image.is_primary
                 })
             
@@ -412,7 +436,7 @@ class UserTagView(APIView):
     """
     View for managing user tags
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [JSONParser]
     
@@ -484,7 +508,7 @@ class CompactProfileView(APIView):
     View for getting a compact profile view with basic user information
     as shown in the profile header/card
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     
@@ -500,14 +524,10 @@ class CompactProfileView(APIView):
             all_skills = user.skills.all()
             user_rating = 0
             
-            # Get post count
-            post_count = user.posts.count()
-            
-            # Get follower count
-            follower_count = user.followers.count()
-            
-            # Get following count
-            following_count = user.following.count()
+            # Get post, follower and following counts (denormalized counters)
+            post_count = user.post_count
+            follower_count = user.follower_count
+            following_count = user.following_count
             
             # Check if the current user is following this user
             is_following = False
@@ -524,6 +544,7 @@ class CompactProfileView(APIView):
                     'phone': user.phone,
                     'email': user.email,
                     'profile_picture': user.img.url if user.img else None,
+                    'profile_picture_derivatives': user.img_derivative_urls,
                     # 'background_image': user.background_img.url if user.background_img else None,
                     'bio': user.bio,
                     
@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .blobs import release_blob
+from .media_pipeline import discard_staged
+from .models import Profession, ProfessionTombstone, User
+from .post_models import MediaItem
+from .profession_catalog import invalidate_catalog
+from .profile_models import PortfolioImage
+from .story_models import Story
+from .username_index import username_index
+
+
+@receiver(post_delete, sender=MediaItem)
+def release_media_item_blob(sender, instance, **kwargs):
+    release_blob(instance.file.name)
+
+
+@receiver(post_delete, sender=Story)
+def release_story_blob(sender, instance, **kwargs):
+    release_blob(instance.media.name)
+
+
+@receiver(post_delete, sender=PortfolioImage)
+def release_portfolio_image_blob(sender, instance, **kwargs):
+    release_blob(instance.image.name)
+
+
+@receiver(post_delete, sender=MediaItem)
+@receiver(post_delete, sender=Story)
+def remove_staged_upload(sender, instance, **kwargs):
+    # A row deleted before its processing finished (or after it failed) still owns its staged upload
+    staged_path = instance.staged_file
+    if staged_path:
+        transaction.on_commit(lambda: discard_staged([staged_path]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_username(sender, instance, **kwargs):
+    # New and renamed users are reported taken right away by this process
+    username_index.add(instance.username)
+
+
+@receiver(post_save, sender=Profession)
+def invalidate_profession_catalog(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_delete, sender=Profession)
+def record_deleted_profession(sender, instance, **kwargs):
+    # Catalog deltas report the deletion to clients holding an older version
+    ProfessionTombstone.objects.create(profession_id=instance.pk)
+    transaction.on_commit(invalidate_catalog)
@@ -0,0 +1,240 @@
+"""
+Outbox for SMS messages, sent by a background thread.
+
+Sending inline would block the request on the SMS provider's HTTP API (and
+log in to Eskiz again on every request). Views call sms_outbox.enqueue() and
+return right away; a daemon thread per process collects queued messages for
+up to SMS_BATCH_WINDOW seconds, sends them in batches of SMS_BATCH_SIZE
+through one long-lived transport and retries failed messages with
+exponential backoff, giving up after SMS_MAX_ATTEMPTS.
+
+The transport is pluggable (SMS_TRANSPORT):
+
+* ConsoleTransport logs the messages (development, the default)
+* FakeTransport keeps them in memory, for tests and offline use
+* EskizTransport sends them with one reused, authenticated Eskiz session
+
+The queue lives in process memory: messages still queued when a process is
+killed are lost, which for login codes just means asking for a new one.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue to wake the sender up when a retry is scheduled from another thread
+_WAKE = object()
+
+
+@dataclass
+class SmsMessage:
+    phone: str
+    text: str
+    attempts: int = 0
+
+
+class ConsoleTransport:
+    """Logs messages instead of sending them"""
+
+    def send_batch(self, messages):
+        for message in messages:
+            logger.info("SMS to %s: %s", message.phone, message.text)
+        return []
+
+
+class FakeTransport:
+    """
+    Keeps sent messages in .sent. Phones listed in .failing fail every time,
+    so retries can be exercised offline.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+
+    def send_batch(self, messages):
+        failed = [message for message in messages if message.phone in self.failing]
+        self.sent.extend(message for message in messages if message.phone not in self.failing)
+        return failed
+
+
+class EskizTransport:
+    """Sends through Eskiz, logging in once and reusing the session token"""
+
+    def __init__(self):
+        if not settings.ESKIZ_EMAIL or not settings.ESKIZ_PASSWORD:
+            raise ImproperlyConfigured("EskizTransport needs the ESKIZ_EMAIL and ESKIZ_PASSWORD environment variables")
+        self._client = None
+        self._dispatch_ids = itertools.count(int(time.time()))
+
+    def _eskiz(self):
+        if self._client is None:
+            from eskiz_sms import EskizSMS
+
+            # The token is refreshed by the library when it expires
+            self._client = EskizSMS(email=settings.ESKIZ_EMAIL, password=settings.ESKIZ_PASSWORD)
+        return self._client
+
+    def send_batch(self, messages):
+        from eskiz_sms.exceptions import EskizException
+
+        try:
+            if len(messages) == 1:
+                self._eskiz().send_sms(messages[0].phone, messages[0].text, from_whom=settings.SMS_SENDER)
+            else:
+                self._eskiz().send_batch(
+                    messages=[
+                        {'user_sms_id': str(index), 'to': message.phone, 'text': message.text}
+                        for index, message in enumerate(messages)
+                    ],
+                    from_whom=settings.SMS_SENDER,
+                    dispatch_id=next(self._dispatch_ids),
+                )
+        except EskizException:
+            logger.exception("Eskiz refused a batch of %d SMS", len(messages))
+            # Log in again on the next attempt, in case the session is what failed
+            self._client = None
+            return messages
+        return []
+
+
+class SmsOutbox:
+    """Per-process queue of outgoing SMS with a sending thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._retries = []  # Heap of (due time, sequence, message)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._transport = None
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = import_string(settings.SMS_TRANSPORT)()
+        return self._transport
+
+    def enqueue(self, phone, text):
+        """Queue a message; sent right away when SMS_OUTBOX_SYNC is set"""
+        message = SmsMessage(phone=str(phone), text=text)
+        if settings.SMS_OUTBOX_SYNC:
+            self._send([message])
+            if self._retries:
+                # Retries still happen in the background
+                self._ensure_sender()
+            return
+        self._queue.put(message)
+        self._ensure_sender()
+
+    def flush(self):
+        """Send everything queued, including messages waiting for a retry, in the calling thread"""
+        with self._lock:
+            waiting = [message for _, _, message in self._retries]
+            self._retries = []
+        messages = waiting + self._drain(len(waiting) + self._queue.qsize())
+        for start in range(0, len(messages), settings.SMS_BATCH_SIZE):
+            self._send(messages[start:start + settings.SMS_BATCH_SIZE])
+
+    def _drain(self, limit):
+        messages = []
+        while len(messages) < limit:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is not _WAKE:
+                messages.append(message)
+        return messages
+
+    def _send(self, messages):
+        try:
+            failed = self.transport.send_batch(messages)
+        except Exception:
+            logger.exception("Failed to send a batch of %d SMS", len(messages))
+            failed = messages
+        for message in failed:
+            self._schedule_retry(message)
+
+    def _schedule_retry(self, message):
+        message.attempts += 1
+        if message.attempts >= settings.SMS_MAX_ATTEMPTS:
+            logger.error("Giving up on SMS to %s after %d attempts", message.phone, message.attempts)
+            return
+        # 2, 4, 8... seconds
+        due = time.monotonic() + settings.SMS_RETRY_BACKOFF * 2 ** (message.attempts - 1)
+        with self._lock:
+            heapq.heappush(self._retries, (due, next(self._sequence), message))
+        if threading.current_thread() is not self._thread:
+            # The sender may be blocked waiting for a message with no retry in sight
+            self._queue.put(_WAKE)
+
+    def _due_retries(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._retries and self._retries[0][0] <= now and len(due) < settings.SMS_BATCH_SIZE:
+                due.append(heapq.heappop(self._retries)[2])
+        return due
+
+    def _ensure_sender(self):
+        # Threads don't survive a fork, so a worker process starts its own sender
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="sms outbox", daemon=True)
+            self._thread.start()
+
+    def _next_retry_in(self):
+        """Seconds until the earliest retry is due, or None without retries"""
+        with self._lock:
+            if not self._retries:
+                return None
+            return max(0, self._retries[0][0] - time.monotonic())
+
+    def _run(self):
+        while True:
+            batch = self._due_retries()
+            # Wait for a message, but wake up for retries coming due (and don't wait with retries in hand)
+            timeout = 0 if batch else self._next_retry_in()
+            try:
+                message = self._queue.get(timeout=timeout)
+                if message is not _WAKE:
+                    batch.append(message)
+            except queue.Empty:
+                pass
+            if batch:
+                # Give concurrent sign-ins a moment to join the batch
+                deadline = time.monotonic() + settings.SMS_BATCH_WINDOW
+                while len(batch) < settings.SMS_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        message = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if message is not _WAKE:
+                        batch.append(message)
+                self._send(batch)
+
+
+sms_outbox = SmsOutbox()
+
+# Don't drop queued messages on a clean shutdown
+atexit.register(sms_outbox.flush)
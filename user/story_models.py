@@ -4,6 +4,9 @@ from django.utils import timezone
 import uuid
 import os
 
+from .image_derivatives import derivative_urls
+from .video_derivatives import poster_url
+
 def get_story_file_path(instance, filename):
     """Generate a unique filename for uploaded story files"""
     # Get the file extension
@@ -24,6 +27,12 @@ class Story(models.Model):
         ('image', 'Image'),
         ('video', 'Video'),
     ]
+    PROCESSING_STATE_CHOICES = [
+        ('processing', 'Processing'),  # Waiting for a worker
+        ('working', 'Working'),  # Claimed by a worker (see media_pipeline.process_media)
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stories')
     content = models.TextField(blank=True, null=True)
@@ -31,20 +40,44 @@ class Story(models.Model):
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES)
     duration = models.IntegerField(default=24)  # Duration in hours before story expires
     is_public = models.BooleanField(default=True)
+    # Resized WebP/JPEG copies of image stories (of the poster frame for videos): {width: {format: name}} (see image_derivatives.py)
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Low-bitrate MP4 copies of videos for feed autoplay: {size: {'mp4': name}} (see video_derivatives.py)
+    renditions = models.JSONField(default=dict, blank=True)
+    # Uploads are staged on disk and finished in the background (see media_pipeline.py)
+    processing_state = models.CharField(max_length=10, choices=PROCESSING_STATE_CHOICES, default='ready')
+    staged_file = models.CharField(max_length=500, blank=True)
+    staged_sha256 = models.CharField(max_length=64, blank=True)  # Hashed while the upload was received, if it was
+    processing_started_at = models.DateTimeField(null=True, blank=True)  # When a worker claimed the row
+    # Probed from the content while processing (see media_probe.py), so clients can lay out without downloading
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    size_bytes = models.BigIntegerField(null=True, blank=True)
+    media_duration = models.FloatField(null=True, blank=True)  # Seconds, videos only
+    placeholder = models.CharField(max_length=64, blank=True)  # Blurhash of images
     created_at = models.DateTimeField(default=timezone.now)
+    # Stored (created_at + duration) so active stories and expired ones can be found with an index
+    expires_at = models.DateTimeField(editable=False, db_index=True)
     
     class Meta:
         verbose_name = "Story"
         verbose_name_plural = "Stories"
         ordering = ['-created_at']
+        indexes = [
+            # Active stories of a user: user_id = ? AND expires_at > now
+            models.Index(fields=['user', 'expires_at'], name='story_user_expires_idx'),
+        ]
     
     def __str__(self):
         return f"Story by {self.user.username} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
-    @property
-    def expires_at(self):
-        """Return the expiration time of the story"""
-        return self.created_at + timezone.timedelta(hours=self.duration)
+    def save(self, *args, **kwargs):
+        # Keep the stored expiry in sync with created_at and duration
+        self.expires_at = self.created_at + timezone.timedelta(hours=self.duration)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'created_at', 'duration'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'expires_at'}
+        super().save(*args, **kwargs)
     
     @property
     def is_expired(self):
@@ -58,8 +91,23 @@ class Story(models.Model):
     
     @property
     def file_url(self):
-        """Return the URL of the media file"""
-        return self.media.url if self.media else None
+        """Return the URL of the media file (None until the staged upload has been moved into place)"""
+        return self.media.url if self.media and self.processing_state == 'ready' else None
+    
+    @property
+    def derivative_urls(self):
+        """Return the URLs of the resized copies of the media"""
+        return derivative_urls(self.media.storage, self.derivatives)
+    
+    @property
+    def poster_url(self):
+        """Return the URL of the poster frame of a video story"""
+        return poster_url(self.media.storage, self.derivatives) if self.media_type == 'video' else None
+    
+    @property
+    def rendition_urls(self):
+        """Return the URLs of the low-bitrate copies of a video story"""
+        return derivative_urls(self.media.storage, self.renditions)
 
 class StoryView(models.Model):
     """
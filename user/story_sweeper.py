@@ -0,0 +1,66 @@
+"""
+Removal of expired stories.
+
+Expired stories are never shown again, but their rows, their StoryView rows
+and their media files would otherwise stay forever. The sweeper deletes them
+in bounded batches (found through the expires_at index), each batch in its
+own short transaction, and removes the media files once the batch is committed.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .blobs import is_blob_name
+from .image_derivatives import delete_derivatives
+from .story_models import Story, StoryView
+
+logger = logging.getLogger(__name__)
+
+
+def delete_story_files(names, derivatives=()):
+    """Remove story media files and their resized copies from storage, logging (not raising) on failure"""
+    storage = Story._meta.get_field('media').storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception("Failed to delete story file %s", name)
+    for story_derivatives in derivatives:
+        delete_derivatives(storage, story_derivatives)
+
+
+def sweep_expired_stories(batch_size=500, max_batches=None, now=None):
+    """
+    Delete stories that expired before now, with their views and files.
+    :return: number of deleted stories
+    """
+    now = now or timezone.now()
+    deleted = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        # Oldest expired stories first, straight from the expires_at index
+        batch = list(
+            Story.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id', 'media', 'derivatives')[:batch_size]
+        )
+        if not batch:
+            break
+
+        story_ids = [story_id for story_id, _, _ in batch]
+        with transaction.atomic():
+            # Delete the views explicitly, so the cascade doesn't load them one by one
+            StoryView.objects.filter(story_id__in=story_ids).delete()
+            Story.objects.filter(id__in=story_ids).delete()
+
+        # Files are only removed once their rows are gone for good; content-addressed
+        # files are shared and were released by the post_delete signal instead
+        delete_story_files(
+            [name for _, name, _ in batch if name and not is_blob_name(name)],
+            [derivatives for _, name, derivatives in batch if not is_blob_name(name)]
+        )
+
+        deleted += len(story_ids)
+        batches += 1
+
+    return deleted
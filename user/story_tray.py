@@ -0,0 +1,133 @@
+"""
+Story tray (the row of story circles on top of the feed), built once per viewer and cached.
+
+Stories are fetched joined with their authors and the viewer's viewed flags are
+resolved with a single set query, so building a tray costs a constant number of
+queries. The cached tray is invalidated when someone the viewer follows posts a
+story, when the viewer views a story and when the viewer follows or unfollows.
+
+Trays live in the STORY_TRAY_CACHE_ALIAS cache. With the default local-memory
+cache every worker process keeps its own copies and an invalidation only reaches
+the process that handled the change: the other workers may serve a stale tray
+for up to STORY_TRAY_CACHE_TTL seconds. Point the alias at a shared cache
+(Redis/Memcached) for invalidations to reach every worker.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .following_models import UserFollowing
+from .story_models import Story, StoryView
+
+# Keep delete_many() calls to a reasonable size for huge follower lists
+INVALIDATION_BATCH_SIZE = 1000
+
+
+def story_tray_cache():
+    return caches[settings.STORY_TRAY_CACHE_ALIAS]
+
+
+def story_tray_cache_key(user_id):
+    return f"story_tray:{user_id}"
+
+
+def build_story_tray(user):
+    """Group the viewer's own and followed users' active stories by user"""
+    # Get current time
+    now = timezone.now()
+
+    # Get the IDs of users that the current user follows
+    following_user_ids = UserFollowing.objects.filter(
+        user=user
+    ).values_list('following_user_id', flat=True)
+
+    # Get the current user's own active stories
+    own_stories = Story.objects.filter(
+        user=user,
+        expires_at__gt=now  # Each story lives for its own duration
+    ).select_related('user').order_by('-created_at')
+
+    # Get all non-expired, public stories from users the current user follows
+    followed_stories = Story.objects.filter(
+        user_id__in=following_user_ids,
+        is_public=True,
+        expires_at__gt=now  # Each story lives for its own duration
+    ).select_related('user').order_by('-created_at')
+
+    # Combine own stories and followed stories
+    stories = list(own_stories) + list(followed_stories)
+
+    # Resolve which stories the viewer has already seen with one query
+    viewed_story_ids = set(
+        StoryView.objects.filter(
+            viewer=user,
+            story_id__in=[story.id for story in stories]
+        ).values_list('story_id', flat=True)
+    )
+
+    # Group stories by user
+    user_stories = {}
+    for story in stories:
+        if story.user_id not in user_stories:
+            user_stories[story.user_id] = {
+                'user_id': story.user.id,
+                'username': story.user.username,
+                'name': story.user.name,
+                'profile_picture': story.user.img.url if story.user.img else None,
+                'profile_picture_derivatives': story.user.img_derivative_urls,
+                'stories': []
+            }
+
+        user_stories[story.user_id]['stories'].append({
+            'id': story.id,
+            'content': story.content,
+            'media_url': story.file_url,
+            'derivatives': story.derivative_urls,
+            'poster_url': story.poster_url,
+            'renditions': story.rendition_urls,
+            'media_type': story.media_type,
+            'width': story.width,
+            'height': story.height,
+            'size_bytes': story.size_bytes,
+            'duration_seconds': story.media_duration,
+            'placeholder': story.placeholder,
+            'processing_state': story.processing_state,
+            'created_at': story.created_at,
+            'expires_at': story.expires_at,
+            'viewed': story.id in viewed_story_ids,
+            'is_own': story.user_id == user.id
+        })
+
+    return list(user_stories.values())
+
+
+def get_story_tray(user):
+    """Return the viewer's story tray from the cache, building it on a miss"""
+    cache = story_tray_cache()
+    key = story_tray_cache_key(user.id)
+    tray = cache.get(key)
+    if tray is None:
+        tray = build_story_tray(user)
+        # Don't keep serving a story from the cache after it expires
+        timeout = settings.STORY_TRAY_CACHE_TTL
+        expiries = [story['expires_at'] for group in tray for story in group['stories']]
+        if expiries:
+            seconds_left = (min(expiries) - timezone.now()).total_seconds()
+            timeout = max(1, min(timeout, int(seconds_left)))
+        cache.set(key, tray, timeout)
+    return tray
+
+
+def invalidate_story_trays(user_ids):
+    """Drop the cached trays of the given viewers"""
+    keys = [story_tray_cache_key(user_id) for user_id in user_ids]
+    for i in range(0, len(keys), INVALIDATION_BATCH_SIZE):
+        story_tray_cache().delete_many(keys[i:i + INVALIDATION_BATCH_SIZE])
+
+
+def invalidate_author_story_trays(author_id):
+    """Drop the trays that show the author's stories: their own and their followers'"""
+    follower_ids = list(
+        UserFollowing.objects.filter(following_user_id=author_id).values_list('user_id', flat=True)
+    )
+    invalidate_story_trays([author_id] + follower_ids)
@@ -1,3 +1,1611 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .authentication import CachedJWTAuthentication, invalidate_cached_user, user_cache_key
+from .blob_models import MediaBlob
+from .blobs import acquire_blob, release_blob
+from .counter_buffer import CounterBuffer, likes_buffer
+from .counters import adjust_counter, reconcile_counters
+from .orphan_media import collect_orphan_media
+from .image_derivatives import render_derivatives
+from .following_models import UserFollowing
+from .media_pipeline import _attach_renditions, process_media, process_pending_media, stage_upload
+from .media_serving import parse_range, serve_media
+from .media_probe import _mp4_probe, blurhash, probe_image, probe_video
+from .models import Profession, User
+from .otp import check_code, issue_code, take_token
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .post_models import MediaItem, Post, PostComment, PostLike, SavedPost
+from .profession_catalog import etag_matches
+from .profile_models import PortfolioImage, PortfolioItem
+from .sms_outbox import EskizTransport, SmsOutbox, sms_outbox
+from .story_models import Story, StoryView
+from .timeline import fan_out_post, trim_timelines
+from .timeline_models import TimelineEntry
+from .toggles import toggle
+from .upload_models import UploadSession
+from . import uploads
+from .uploads import write_chunk
+from .username_index import BloomFilter, username_index
+from .video_derivatives import poster_url, rendition_heights, store_renditions, transcode_renditions
+
+
+def make_user(phone, username=None):
+    return User.objects.create_user(
+        phone=phone, username=username or f"{phone}@istan.uz", name='Test', second_name='User', is_new=False
+    )
+
+
+def auth_client(user):
+    """API client sending the user's access token"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+    return client
+
+
+def png_bytes(width=64, height=48, color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+# In-memory caches, so tests never touch (or clear) the on-disk OTP cache of the host
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'otp': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'otp-tests'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ApiTestCase(TestCase):
+    def setUp(self):
+        # Cached users and trays would leak between tests (ids are reused after the rollback)
+        for cache in caches.all():
+            cache.clear()
+
+
+class CursorPaginationTests(TestCase):
+    def test_cursor_round_trip(self):
+        position = ['2024-05-01T10:00:00+00:00', 42]
+        cursor = encode_cursor(position)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), position)
+
+    def test_empty_cursor_is_the_first_page(self):
+        self.assertIsNone(encode_cursor(None))
+        self.assertIsNone(decode_cursor(''))
+        self.assertIsNone(decode_cursor(None))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor!')
+        post = Post.objects.create(user=make_user('1'))
+        with self.assertRaises(ValueError):
+            keyset_page(PostComment.objects.filter(post=post), ['not a date', 1], 10)
+
+    def test_pages_cover_every_row_once(self):
+        user = make_user('1')
+        post = Post.objects.create(user=user)
+        comments = [PostComment.objects.create(post=post, user=user, text=str(i)) for i in range(7)]
+
+        seen, position = [], None
+        while True:
+            items, position = keyset_page(PostComment.objects.filter(post=post), decode_cursor(encode_cursor(position)), 3)
+            seen.extend(comment.id for comment in items)
+            if position is None:
+                break
+        self.assertEqual(seen, [comment.id for comment in reversed(comments)])
+
+
+class CounterTests(ApiTestCase):
+    def test_adjust_counter_never_goes_below_zero(self):
+        user = make_user('1')
+        adjust_counter(User, user.id, 'post_count', 2)
+        adjust_counter(User, user.id, 'post_count', -5)
+        user.refresh_from_db()
+        self.assertEqual(user.post_count, 0)
+
+    def test_follow_and_unfollow_move_both_counters(self):
+        alice, bob = make_user('1'), make_user('2')
+        client = auth_client(alice)
+
+        self.assertEqual(client.post(f'/api/v1/user/follow/{bob.id}/').status_code, 201)
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual((alice.following_count, bob.follower_count), (1, 1))
+
+        self.assertEqual(client.post(f'/api/v1/user/follow/{bob.id}/').status_code, 200)
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual((alice.following_count, bob.follower_count), (0, 0))
+
+    @override_settings(COUNTER_BUFFER_ENABLED=False)
+    def test_reconcile_repairs_drift(self):
+        alice, bob = make_user('1'), make_user('2')
+        post = Post.objects.create(user=alice)
+        PostLike.objects.create(post=post, user=bob)
+        UserFollowing.objects.create(user=bob, following_user=alice)
+
+        self.assertEqual(reconcile_counters(dry_run=True)['Post.likes_count'], 1)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+        reconcile_counters()
+        post.refresh_from_db()
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual((alice.post_count, alice.follower_count, bob.following_count), (1, 1, 1))
+        self.assertFalse(any(reconcile_counters(dry_run=True).values()))
+
+    def test_reconcile_skips_buffered_likes(self):
+        post = Post.objects.create(user=make_user('1'))
+        # The like is in the table while its +1 is still buffered by a web worker
+        PostLike.objects.create(post=post, user=make_user('2'))
+
+        self.assertNotIn('Post.likes_count', reconcile_counters())
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+        self.assertEqual(reconcile_counters(include_buffered=True)['Post.likes_count'], 1)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+
+
+class CounterBufferTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(user=make_user('1'))
+        self.buffer = CounterBuffer(Post, 'likes_count')
+        # Flushed by hand: no background thread touching the test database
+        patcher = mock.patch.object(self.buffer, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def likes(self):
+        self.post.refresh_from_db()
+        return self.post.likes_count
+
+    def test_deltas_are_pending_until_flushed(self):
+        self.assertEqual(self.buffer.add(self.post.id, 1), 0)
+        self.buffer.add(self.post.id, 1)
+        self.buffer.add(self.post.id, -1)
+        self.assertEqual(self.buffer.pending(self.post.id), 1)
+        self.assertEqual(self.buffer.pending_many([self.post.id, 999]), {self.post.id: 1})
+        self.assertEqual(self.likes(), 0)
+
+        self.buffer.flush()
+        self.assertEqual(self.likes(), 1)
+        self.assertEqual(self.buffer.pending(self.post.id), 0)
+
+    @override_settings(COUNTER_BUFFER_ENABLED=False)
+    def test_unbuffered_add_is_applied_right_away(self):
+        self.assertEqual(self.buffer.add(self.post.id, 1), 1)
+        self.assertEqual(self.likes(), 1)
+        self.assertEqual(self.buffer.pending(self.post.id), 0)
+
+    def test_flushing_deltas_stay_visible(self):
+        self.buffer.add(self.post.id, 2)
+        seen = []
+        apply = self.buffer._apply
+
+        def observed_apply(deltas):
+            seen.append((self.buffer.pending(self.post.id), self.buffer.pending_many([self.post.id])))
+            apply(deltas)
+
+        with mock.patch.object(self.buffer, '_apply', side_effect=observed_apply):
+            self.buffer.flush()
+        self.assertEqual(seen, [(2, {self.post.id: 2})])
+        self.assertEqual((self.likes(), self.buffer.pending(self.post.id)), (2, 0))
+
+    def test_failed_flush_keeps_the_deltas(self):
+        self.buffer.add(self.post.id, 3)
+        with mock.patch.object(self.buffer, '_apply', side_effect=RuntimeError("database is locked")):
+            with self.assertLogs('user.counter_buffer', 'ERROR'):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending(self.post.id), 3)
+
+        self.buffer.flush()
+        self.assertEqual(self.likes(), 3)
+
+
+class LikeCountTests(ApiTestCase):
+    def like(self, client, post):
+        return client.post(f'/api/v1/user/posts/{post.id}/like/').data['data']
+
+    def test_like_reports_the_count_after_the_write(self):
+        post = Post.objects.create(user=make_user('1'))
+        client = auth_client(make_user('2'))
+        for enabled in (False, True):
+            with self.subTest(buffered=enabled), override_settings(COUNTER_BUFFER_ENABLED=enabled), \
+                    mock.patch.object(likes_buffer, '_ensure_flusher'):
+                self.assertEqual(self.like(client, post)['likes_count'], 1)
+                self.assertEqual(self.like(client, post)['likes_count'], 0)
+                likes_buffer.flush()
+
+
+class ToggleTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('1')
+        self.post = Post.objects.create(user=make_user('2'))
+
+    def test_toggle_flips_the_row(self):
+        self.assertEqual(toggle(SavedPost, post=self.post, user=self.user), (True, True))
+        self.assertTrue(SavedPost.objects.filter(post=self.post, user=self.user).exists())
+        self.assertEqual(toggle(SavedPost, post=self.post, user=self.user), (False, True))
+        self.assertFalse(SavedPost.objects.exists())
+
+    def test_concurrent_insert_changes_nothing(self):
+        SavedPost.objects.create(post=self.post, user=self.user)
+        # The DELETE ran before the other request's INSERT committed
+        with mock.patch('django.db.models.query.QuerySet.delete', return_value=(0, {})):
+            self.assertEqual(toggle(SavedPost, post=self.post, user=self.user), (True, False))
+        self.assertEqual(SavedPost.objects.count(), 1)
+
+    @override_settings(COUNTER_BUFFER_ENABLED=False)
+    def test_like_counter_only_moves_when_the_toggle_changed(self):
+        client = auth_client(self.user)
+        url = f'/api/v1/user/posts/{self.post.id}/like/'
+        self.assertEqual(client.post(url).status_code, 201)
+        with mock.patch('user.post_interaction_views.toggle', return_value=(True, False)):
+            self.assertEqual(client.post(url).data['data']['likes_count'], 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    def test_save_endpoint_toggles(self):
+        client = auth_client(self.user)
+        url = f'/api/v1/user/posts/{self.post.id}/save/'
+        self.assertEqual(client.post(url).data['data']['saved'], True)
+        self.assertEqual(client.post(url).data['data']['saved'], False)
+
+
+class MediaTestCase(ApiTestCase):
+    """Media storage and staging in a temporary directory, uploads processed right after the commit"""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=root,
+            MEDIA_STAGING_DIR=os.path.join(root, 'staging'),
+            MEDIA_PROCESSING_SYNC=True,
+            MEDIA_PROCESSING_PROCESSES=0,
+            FFMPEG_BINARY='no-such-ffmpeg',
+            FFPROBE_BINARY='no-such-ffprobe',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('1')
+        self.client = auth_client(self.user)
+
+
+class ResumableUploadTests(MediaTestCase):
+    def start(self, data, filename='photo.png'):
+        response = self.client.post('/api/v1/user/uploads/', {'filename': filename, 'size': len(data)})
+        self.assertEqual(response.status_code, 201)
+        return f"/api/v1/user/uploads/{response.data['data']['upload_id']}/", response.data['data']['upload_id']
+
+    def put(self, url, chunk, offset):
+        return self.client.put(f'{url}?offset={offset}', chunk, content_type='application/octet-stream')
+
+    def upload(self, data):
+        url, upload_id = self.start(data)
+        self.put(url, data, 0)
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 200)
+        return upload_id
+
+    def test_resume_from_the_reported_offset(self):
+        data = png_bytes()
+        url, upload_id = self.start(data)
+        self.assertEqual(self.put(url, data[:100], 0).data['data']['offset'], 100)
+        # A repeated chunk is refused, the client asks for the offset and resumes
+        self.assertEqual(self.put(url, data[:100], 0).status_code, 409)
+        self.assertEqual(self.client.get(url).data['data']['offset'], 100)
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 409)
+
+        self.put(url, data[100:], 100)
+        self.assertEqual(self.client.post(url + 'complete/').data['data']['state'], 'complete')
+        session = UploadSession.objects.get(id=upload_id)
+        with open(session.path, 'rb') as file:
+            self.assertEqual(file.read(), data)
+        self.assertEqual(session.sha256, hashlib.sha256(data).hexdigest())
+
+    @override_settings(UPLOAD_MAX_RUNNING_HASHES=1)
+    @mock.patch.dict(uploads._hashes, clear=True)
+    def test_running_hashes_are_bounded(self):
+        first, second = png_bytes(), png_bytes(color=(0, 0, 200))
+        first_url, first_id = self.start(first)
+        second_url, second_id = self.start(second)
+        self.put(first_url, first[:100], 0)
+        # Evicts the running hash of the first upload, which is then hashed later by the pipeline
+        self.put(second_url, second[:100], 0)
+        self.put(first_url, first[100:], 100)
+        self.put(second_url, second[100:], 100)
+        self.client.post(first_url + 'complete/')
+        self.client.post(second_url + 'complete/')
+        self.assertEqual(UploadSession.objects.get(id=first_id).sha256, '')
+        self.assertEqual(UploadSession.objects.get(id=second_id).sha256, hashlib.sha256(second).hexdigest())
+        self.assertEqual(uploads._hashes, {})
+
+    @mock.patch.dict(uploads._hashes, clear=True)
+    def test_abandoned_running_hashes_expire(self):
+        url, _ = self.start(png_bytes())
+        self.put(url, png_bytes()[:100], 0)
+        abandoned = next(iter(uploads._hashes))
+        later = time.monotonic() + settings.UPLOAD_SESSION_TTL + 1
+        with mock.patch('user.uploads.time.monotonic', return_value=later):
+            url, _ = self.start(png_bytes())
+            self.put(url, png_bytes()[:100], 0)
+        self.assertNotIn(abandoned, uploads._hashes)
+        self.assertEqual(len(uploads._hashes), 1)
+
+    def test_dropped_connection_keeps_the_bytes_received(self):
+        data = png_bytes()
+        _, upload_id = self.start(data)
+        session = UploadSession.objects.get(id=upload_id)
+        # The client announced the whole file but the connection dropped after 40 bytes
+        write_chunk(session, 0, io.BytesIO(data[:40]), len(data))
+        self.assertEqual(UploadSession.objects.get(id=upload_id).received, 40)
+
+    def test_other_users_cant_see_the_upload(self):
+        url, _ = self.start(png_bytes())
+        self.assertEqual(auth_client(make_user('2')).get(url).status_code, 404)
+
+    def test_claimed_upload_becomes_a_story_once(self):
+        data = png_bytes()
+        upload_id = self.upload(data)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/user/story/create/', {'media_upload_id': upload_id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).state, 'consumed')
+        story = Story.objects.get()
+        self.assertEqual(story.processing_state, 'ready')
+        with story.media.open('rb') as file:
+            self.assertEqual(file.read(), data)
+
+        response = self.client.post('/api/v1/user/story/create/', {'media_upload_id': upload_id})
+        self.assertEqual(response.status_code, 409)
+
+    def test_failed_creation_leaves_the_upload_usable(self):
+        upload_id = self.upload(png_bytes())
+        with mock.patch('user.views.submit_media_processing', side_effect=RuntimeError("database is locked")):
+            with self.assertLogs('user.views', 'ERROR'):
+                response = self.client.post('/api/v1/user/story/create/', {'media_upload_id': upload_id})
+        self.assertEqual(response.status_code, 400)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(session.state, 'complete')
+        self.assertTrue(os.path.exists(session.path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/user/story/create/', {'media_upload_id': upload_id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Story.objects.get().processing_state, 'ready')
+
+    def test_unfinalized_upload_cant_be_claimed(self):
+        url, upload_id = self.start(png_bytes())
+        response = self.client.post('/api/v1/user/story/create/', {'media_upload_id': upload_id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_size_cap_of_the_sniffed_kind(self):
+        data = png_bytes()
+        with override_settings(MEDIA_MAX_IMAGE_SIZE=len(data) - 1):
+            url, _ = self.start(data)
+            self.assertEqual(self.put(url, data, 0).status_code, 413)
+            self.assertEqual(self.client.get(url).data['data']['offset'], 0)
+
+    def test_unsupported_content_is_refused_on_the_first_chunk(self):
+        url, _ = self.start(b'just some text, not an image')
+        self.assertEqual(self.put(url, b'just some text, not an image', 0).status_code, 415)
+
+
+class StreamingUploadTests(MediaTestCase):
+    def create_post(self, content, name='photo.png'):
+        return self.client.post(
+            '/api/v1/user/post/create/', {'media': SimpleUploadedFile(name, content)}, format='multipart'
+        )
+
+    def test_upload_is_hashed_while_received(self):
+        data = png_bytes()
+        with mock.patch('user.media_pipeline.file_sha256') as rehash, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.create_post(data).status_code, 201)
+        rehash.assert_not_called()
+        media = MediaItem.objects.get()
+        self.assertEqual((media.processing_state, media.media_type), ('ready', 'image'))
+        self.assertTrue(MediaBlob.objects.filter(sha256=hashlib.sha256(data).hexdigest(), name=media.file.name).exists())
+
+    def test_type_comes_from_the_content(self):
+        response = self.create_post(b'MZ this is not an image at all', name='photo.png')
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(MediaItem.objects.exists())
+
+    def test_oversized_upload_is_stopped(self):
+        data = png_bytes(400, 400)
+        with override_settings(MEDIA_MAX_IMAGE_SIZE=len(data) // 2):
+            response = self.create_post(data)
+        self.assertEqual(response.status_code, 413)
+        # Nothing is left in the staging directory
+        self.assertEqual(os.listdir(settings.MEDIA_STAGING_DIR), [])
+
+
+class BlobTests(MediaTestCase):
+    def test_same_content_is_stored_once(self):
+        data = png_bytes()
+        first, created = acquire_blob(ContentFile(data), '.PNG')
+        self.assertTrue(created)
+        self.assertEqual(first.name, f"cas/{first.sha256[:2]}/{first.sha256[2:4]}/{first.sha256}.png")
+        second, created = acquire_blob(ContentFile(data), '.png')
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        blob, _ = acquire_blob(ContentFile(png_bytes()), '.png')
+        acquire_blob(ContentFile(png_bytes()), '.png')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.name)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.name))
+
+    def test_deleting_a_post_releases_its_media(self):
+        data = png_bytes()
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                self.client.post('/api/v1/user/post/create/', {'media': SimpleUploadedFile('p.png', data)}, format='multipart')
+        blob = MediaBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.first().delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.first().delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.name))
+
+    def test_release_of_a_file_stored_before_blobs_is_ignored(self):
+        acquire_blob(ContentFile(png_bytes()), '.png')
+        release_blob('posts/2024/1/1/old.png')
+        release_blob('')
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+
+@override_settings(
+    OTP_FIXED_CODE=None,
+    OTP_MAX_ATTEMPTS=3,
+    OTP_RATE_LIMITS={'send_phone': (2, 60), 'send_ip': (100, 1), 'verify_phone': (100, 1), 'verify_ip': (100, 1)},
+    SMS_TRANSPORT='user.sms_outbox.FakeTransport',
+    SMS_CODE_TEMPLATE='{code}',
+    SMS_OUTBOX_SYNC=True,
+)
+class OtpTests(ApiTestCase):
+    phone = '998901112233'
+
+    def setUp(self):
+        super().setUp()
+        # A fresh FakeTransport per test
+        sms_outbox._transport = None
+        self.addCleanup(setattr, sms_outbox, '_transport', None)
+
+    def test_codes_stay_in_memory(self):
+        # The host's on-disk OTP cache is never read, written or cleared by the tests
+        self.assertEqual(settings.CACHES, TEST_CACHES)
+        self.assertIsInstance(caches['otp'], LocMemCache)
+
+    def test_code_is_single_use(self):
+        code = issue_code(self.phone)
+        self.assertEqual(len(code), settings.OTP_LENGTH)
+        self.assertEqual(check_code(self.phone, code), 'valid')
+        self.assertEqual(check_code(self.phone, code), 'expired')
+
+    def test_code_expires(self):
+        code = issue_code(self.phone)
+        later = time.time() + settings.OTP_TTL + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(check_code(self.phone, code), 'expired')
+
+    def test_code_is_burnt_after_too_many_wrong_guesses(self):
+        code = issue_code(self.phone)
+        wrong = '0000' if code != '0000' else '1111'
+        for _ in range(settings.OTP_MAX_ATTEMPTS):
+            self.assertEqual(check_code(self.phone, wrong), 'invalid')
+        self.assertEqual(check_code(self.phone, code), 'expired')
+
+    def test_new_code_resets_the_attempts(self):
+        issue_code(self.phone)
+        for _ in range(settings.OTP_MAX_ATTEMPTS - 1):
+            check_code(self.phone, 'nope')
+        code = issue_code(self.phone)
+        check_code(self.phone, 'nope')
+        self.assertEqual(check_code(self.phone, code), 'valid')
+
+    def test_token_bucket_refills(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            self.assertEqual(take_token('send_phone', self.phone), 0)
+            self.assertEqual(take_token('send_phone', self.phone), 0)
+            self.assertEqual(take_token('send_phone', self.phone), 61)
+            # Buckets are per identifier
+            self.assertEqual(take_token('send_phone', '998900000000'), 0)
+        with mock.patch('time.time', return_value=now + 60):
+            self.assertEqual(take_token('send_phone', self.phone), 0)
+
+    def test_sign_in_flow(self):
+        client = APIClient()
+        response = client.post('/api/v1/user/sms/generate/', {'phone': self.phone})
+        self.assertEqual(response.status_code, 200)
+        code = sms_outbox.transport.sent[-1].text
+
+        response = client.post('/api/v1/user/sms/verify/', {'phone': self.phone, 'code': code})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.filter(phone=self.phone).exists())
+        # The code can't be replayed
+        response = client.post('/api/v1/user/sms/verify/', {'phone': self.phone, 'code': code})
+        self.assertEqual(response.status_code, 400)
+
+    def verify(self):
+        code = issue_code(self.phone)
+        response = APIClient().post('/api/v1/user/sms/verify/', {'phone': self.phone, 'code': code})
+        self.assertEqual(response.status_code, 200)
+        return User.objects.get(phone=self.phone)
+
+    def test_user_created_by_phone_has_no_usable_password(self):
+        self.assertFalse(self.verify().has_usable_password())
+
+    def test_password_of_an_existing_user_is_cleared_once(self):
+        User.objects.create_user(phone=self.phone, password='secret')
+        password = self.verify().password
+        self.assertFalse(User.objects.get(phone=self.phone).has_usable_password())
+        # Unusable passwords are random: an unchanged value means the row wasn't written again
+        self.assertEqual(self.verify().password, password)
+
+    def test_staff_keep_their_password(self):
+        User.objects.create_user(phone=self.phone, password='secret', is_staff=True)
+        self.assertTrue(self.verify().check_password('secret'))
+
+    def test_sending_is_rate_limited_per_phone(self):
+        client = APIClient()
+        for _ in range(2):
+            self.assertEqual(client.post('/api/v1/user/sms/generate/', {'phone': self.phone}).status_code, 200)
+        response = client.post('/api/v1/user/sms/generate/', {'phone': self.phone})
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertEqual(len(sms_outbox.transport.sent), 2)
+
+
+class MediaProcessingTests(MediaTestCase):
+    def create_post(self, data):
+        # Staged and recorded, but not processed yet
+        response = self.client.post('/api/v1/user/post/create/', {'media': SimpleUploadedFile('p.png', data)}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return MediaItem.objects.get()
+
+    def test_row_is_processed_once(self):
+        media = self.create_post(png_bytes())
+        process_media('user.MediaItem', media.pk)
+        process_media('user.MediaItem', media.pk)
+        media.refresh_from_db()
+        self.assertEqual(media.processing_state, 'ready')
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def test_claimed_row_is_left_to_its_worker(self):
+        media = self.create_post(png_bytes())
+        MediaItem.objects.filter(pk=media.pk).update(processing_state='working', processing_started_at=timezone.now())
+        self.assertEqual(process_pending_media(), 0)
+        self.assertEqual(MediaItem.objects.get().processing_state, 'working')
+
+        # Until the claim is stale, e.g. the worker was killed
+        stale = timezone.now() - timezone.timedelta(seconds=settings.MEDIA_PROCESSING_STALE_AFTER + 1)
+        MediaItem.objects.filter(pk=media.pk).update(processing_started_at=stale)
+        self.assertEqual(process_pending_media(), 1)
+        self.assertEqual(MediaItem.objects.get().processing_state, 'ready')
+
+    def test_failure_after_acquiring_releases_the_blob(self):
+        media = self.create_post(png_bytes())
+        with mock.patch('user.media_pipeline.attach_blob_derivatives', side_effect=RuntimeError("disk full")), \
+                self.assertLogs('user.media_pipeline', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            process_media('user.MediaItem', media.pk)
+        self.assertEqual(MediaItem.objects.get().processing_state, 'failed')
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+class ProfessionCatalogTests(ApiTestCase):
+    url = '/api/v1/user/get-profession/'
+
+    def test_if_none_match(self):
+        Profession.objects.create(name='Developer')
+        etag = self.client.get(self.url)['ETag']
+        for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            with self.subTest(header=header):
+                self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=header).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_etag_changes_with_the_catalog(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            profession = Profession.objects.create(name='Developer')
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            profession.delete()
+        self.assertFalse(etag_matches(etag, self.client.get(self.url)['ETag']))
+
+
+class TimelineTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author, self.follower, self.stranger = make_user('1'), make_user('2'), make_user('3')
+        UserFollowing.objects.create(user=self.follower, following_user=self.author)
+
+    def timeline(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by('-created_at', '-id').values_list('post_id', flat=True))
+
+    def test_public_posts_fan_out_to_followers_only(self):
+        public = Post.objects.create(user=self.author, is_public=True)
+        private = Post.objects.create(user=self.author, is_public=False)
+        fan_out_post(public)
+        fan_out_post(private)
+        self.assertEqual(self.timeline(self.follower), [public.id])
+        self.assertEqual(self.timeline(self.author), [])
+        self.assertEqual(self.timeline(self.stranger), [])
+
+    def test_follow_backfills_and_unfollow_purges(self):
+        posts = [Post.objects.create(user=self.stranger, is_public=True) for _ in range(3)]
+        client = auth_client(self.follower)
+
+        client.post(f'/api/v1/user/follow/{self.stranger.id}/')
+        self.assertEqual(set(self.timeline(self.follower)), {post.id for post in posts})
+
+        client.post(f'/api/v1/user/follow/{self.stranger.id}/')
+        self.assertEqual(self.timeline(self.follower), [])
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_timelines_are_trimmed_to_the_cap(self):
+        posts = [Post.objects.create(user=self.author, is_public=True) for _ in range(5)]
+        for post in posts:
+            fan_out_post(post)
+        self.assertEqual(self.timeline(self.follower), [post.id for post in reversed(posts)][:3])
+
+        # Timelines under the cap are left alone
+        TimelineEntry.objects.create(user=self.stranger, post=posts[0], created_at=posts[0].created_at)
+        trim_timelines([self.stranger.id])
+        self.assertEqual(self.timeline(self.stranger), [posts[0].id])
+
+    def test_migration_fills_existing_timelines(self):
+        post = Post.objects.create(user=self.author, is_public=True)
+        Post.objects.create(user=self.author, is_public=False)
+        migration = importlib.import_module('user.migrations.0023_backfill_timelines')
+        migration.backfill_timelines(apps, None)
+        self.assertEqual(self.timeline(self.follower), [post.id])
+
+        # Filled timelines are not rebuilt
+        Post.objects.create(user=self.author, is_public=True)
+        migration.backfill_timelines(apps, None)
+        self.assertEqual(self.timeline(self.follower), [post.id])
+
+
+class FeedShuffleTests(ApiTestCase):
+    url = '/api/v1/user/posts/feed/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('1')
+        self.client = auth_client(self.user)
+        self.author = make_user('2')
+        self.posts = [Post.objects.create(user=self.author, is_public=True) for _ in range(25)]
+
+    def feed(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        return [post['id'] for post in data['posts']], data['pagination']
+
+    def test_new_users_get_a_different_sample_per_session(self):
+        samples = {tuple(self.feed(cursor='')[0]) for _ in range(5)}
+        self.assertGreater(len(samples), 1)
+
+    def test_new_user_sample_is_reproducible_within_a_session(self):
+        ids, pagination = self.feed(cursor='')
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(self.feed(cursor='', seed=pagination['seed'])[0], ids)
+
+    def test_cursor_pages_keep_the_session(self):
+        UserFollowing.objects.create(user=self.user, following_user=self.author)
+        for post in self.posts:
+            fan_out_post(post)
+
+        first, pagination = self.feed(cursor='')
+        cursor = pagination['next_cursor']
+        second, second_pagination = self.feed(cursor=cursor)
+        self.assertEqual(second_pagination['seed'], pagination['seed'])
+        # The same cursor gives the same page, and the pages don't overlap
+        self.assertEqual(self.feed(cursor=cursor)[0], second)
+        self.assertFalse(set(first) & set(second))
+
+        seen = first + second
+        cursor = second_pagination['next_cursor']
+        while cursor:
+            ids, page = self.feed(cursor=cursor)
+            seen += ids
+            cursor = page['next_cursor']
+        self.assertEqual(sorted(seen), sorted(post.id for post in self.posts))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': encode_cursor(['x', 1])}).status_code, 400)
+
+
+class PostListQueryTests(ApiTestCase):
+    """Post lists load a page with the same number of queries whatever its size"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('1')
+        self.client = auth_client(self.user)
+        self.author = make_user('2')
+        UserFollowing.objects.create(user=self.user, following_user=self.author)
+        # Warm the cached user so the counts below don't depend on test order
+        self.client.get('/api/v1/user/posts/saved/')
+
+    def make_posts(self, count):
+        for _ in range(count):
+            post = Post.objects.create(user=self.author, is_public=True)
+            MediaItem.objects.create(post=post, file='posts/a.jpg', media_type='image')
+            MediaItem.objects.create(post=post, file='posts/b.jpg', media_type='image')
+            PostLike.objects.create(user=self.user, post=post)
+            SavedPost.objects.create(user=self.user, post=post)
+            fan_out_post(post)
+
+    def count_queries(self, url, params, expected_posts, key):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data'][key]), expected_posts)
+        return len(queries)
+
+    def assert_constant(self, url, params, key):
+        self.make_posts(2)
+        small = self.count_queries(url, params, 2, key)
+        self.make_posts(10)
+        with self.assertNumQueries(small):
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.data['data'][key]), 10)
+        return small
+
+    def test_feed(self):
+        self.assertEqual(self.assert_constant('/api/v1/user/posts/feed/', {'cursor': ''}, 'posts'), 8)
+
+    def test_user_posts(self):
+        self.assertEqual(
+            self.assert_constant('/api/v1/user/posts/user/', {'user_id': self.author.id, 'cursor': ''}, 'posts'), 5
+        )
+
+    def test_saved_posts(self):
+        self.assertEqual(self.assert_constant('/api/v1/user/posts/saved/', {'cursor': ''}, 'saved_posts'), 5)
+
+
+class MembershipTests(ApiTestCase):
+    url = '/api/v1/user/membership/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('1')
+        self.client = auth_client(self.user)
+        self.others = [make_user('2'), make_user('3'), make_user('4')]
+        self.posts = [Post.objects.create(user=self.others[0]) for _ in range(3)]
+        # Warm the cached user so only the membership queries are counted
+        self.client.get(self.url)
+
+    def test_flags_follow_the_order_of_the_ids(self):
+        PostLike.objects.create(user=self.user, post=self.posts[2])
+        SavedPost.objects.create(user=self.user, post=self.posts[0])
+        UserFollowing.objects.create(user=self.user, following_user=self.others[1])
+        post_ids = [self.posts[2].id, 999, self.posts[0].id, self.posts[1].id]
+        user_ids = [self.others[1].id, self.others[0].id]
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {
+                'post_ids': ','.join(map(str, post_ids)),
+                'user_ids': ','.join(map(str, user_ids)),
+            })
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(data['post_ids'], post_ids)
+        self.assertEqual(data['liked'], [True, False, False, False])
+        self.assertEqual(data['saved'], [False, False, True, False])
+        self.assertEqual(data['user_ids'], user_ids)
+        self.assertEqual(data['following'], [True, False])
+
+    def test_relations_without_ids_are_not_queried(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'post_ids': str(self.posts[0].id)})
+        self.assertEqual(response.data['data']['following'], [])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(MEMBERSHIP_MAX_IDS=2)
+    def test_too_many_ids(self):
+        self.assertEqual(self.client.get(self.url, {'post_ids': '1,2'}).status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'post_ids': '1,2,3'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'user_ids': '1,2,3'}).status_code, 400)
+
+    def test_ids_must_be_integers(self):
+        self.assertEqual(self.client.get(self.url, {'post_ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'user_ids': '1.5'}).status_code, 400)
+
+
+class StoryTrayTests(MediaTestCase):
+    url = '/api/v1/user/story/feed/'
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('2')
+        self.stranger = make_user('3')
+        UserFollowing.objects.create(user=self.user, following_user=self.author)
+
+    def story(self, user, is_public=True):
+        return Story.objects.create(user=user, media='stories/a.jpg', media_type='image', is_public=is_public)
+
+    def tray(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return {
+            group['user_id']: [(story['id'], story['viewed']) for story in group['stories']]
+            for group in response.data['data']['user_stories']
+        }
+
+    def test_contents_and_viewed_flags(self):
+        own = self.story(self.user)
+        seen, unseen = self.story(self.author), self.story(self.author)
+        self.story(self.author, is_public=False)
+        self.story(self.stranger)
+        expired = self.story(self.author)
+        Story.objects.filter(id=expired.id).update(expires_at=timezone.now())
+        StoryView.objects.create(story=seen, viewer=self.user)
+
+        self.assertEqual(self.tray(), {
+            self.user.id: [(own.id, False)],
+            self.author.id: [(unseen.id, False), (seen.id, True)],
+        })
+
+    def test_cached_until_invalidated(self):
+        story = self.story(self.author)
+        self.assertEqual(self.tray(), {self.author.id: [(story.id, False)]})
+        # Changes that skip the views are only picked up after the TTL
+        self.story(self.author)
+        self.assertEqual(self.tray(), {self.author.id: [(story.id, False)]})
+
+    def test_new_story_of_a_followee(self):
+        self.assertEqual(self.tray(), {})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = auth_client(self.author).post('/api/v1/user/story/create/', {
+                'media': SimpleUploadedFile('story.png', png_bytes(), content_type='image/png'),
+                'is_public': 'true',
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.tray(), {self.author.id: [(Story.objects.get().id, False)]})
+
+    def test_viewing_a_story(self):
+        story = self.story(self.author)
+        self.assertEqual(self.tray(), {self.author.id: [(story.id, False)]})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/v1/user/story/view/{story.id}/').status_code, 200)
+        self.assertEqual(self.tray(), {self.author.id: [(story.id, True)]})
+
+    def test_following_and_unfollowing(self):
+        story = self.story(self.stranger)
+        self.assertEqual(self.tray(), {})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/v1/user/follow/{self.stranger.id}/').status_code, 201)
+        self.assertEqual(self.tray(), {self.stranger.id: [(story.id, False)]})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/v1/user/follow/{self.stranger.id}/').status_code, 200)
+        self.assertEqual(self.tray(), {})
+
+
+class StorySweepTests(MediaTestCase):
+    def story(self, hours_ago=0, duration=24, media=None):
+        return Story.objects.create(
+            user=self.user,
+            media=media or default_storage.save('stories/s.png', ContentFile(png_bytes())),
+            media_type='image',
+            duration=duration,
+            created_at=timezone.now() - timezone.timedelta(hours=hours_ago),
+        )
+
+    def test_expiry_follows_created_at_and_duration(self):
+        story = self.story(duration=6)
+        self.assertEqual(story.expires_at, story.created_at + timezone.timedelta(hours=6))
+
+        story.duration = 12
+        story.save(update_fields=['duration'])
+        story.refresh_from_db()
+        self.assertEqual(story.expires_at, story.created_at + timezone.timedelta(hours=12))
+
+        story.created_at -= timezone.timedelta(hours=1)
+        story.save()
+        story.refresh_from_db()
+        self.assertEqual(story.expires_at, story.created_at + timezone.timedelta(hours=12))
+
+    def test_expired_stories_are_deleted_in_batches(self):
+        expired = [self.story(hours_ago=25) for _ in range(5)]
+        active = self.story(hours_ago=1)
+        StoryView.objects.create(story=expired[0], viewer=make_user('2'))
+        derivative = default_storage.save('stories/s_320.webp', ContentFile(b'webp'))
+        Story.objects.filter(id=expired[1].id).update(derivatives={'320': {'webp': derivative}})
+
+        out = io.StringIO()
+        call_command('sweep_stories', batch_size=2, max_batches=2, stdout=out)
+        self.assertIn("Deleted 4 expired story(ies)", out.getvalue())
+        self.assertEqual(Story.objects.count(), 2)
+        # Oldest expiries first: the last expired story is left for the next run
+        self.assertEqual(
+            set(Story.objects.values_list('id', flat=True)), {expired[4].id, active.id}
+        )
+        self.assertFalse(StoryView.objects.exists())
+        self.assertFalse(default_storage.exists(derivative))
+        for story in expired[:4]:
+            self.assertFalse(default_storage.exists(story.media.name))
+
+        call_command('sweep_stories', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(Story.objects.values_list('id', flat=True)), [active.id])
+        self.assertTrue(default_storage.exists(active.media.name))
+
+    def test_blob_files_are_left_to_the_blob(self):
+        blob, _ = acquire_blob(ContentFile(png_bytes()), '.png')
+        acquire_blob(ContentFile(png_bytes()), '.png')
+        self.story(hours_ago=25, media=blob.name)
+        self.story(hours_ago=1, media=blob.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('sweep_stories', stdout=io.StringIO())
+        self.assertEqual(Story.objects.count(), 1)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.name))
+
+
+class PortfolioTests(MediaTestCase):
+    url = '/api/v1/user/profile/portfolio/'
+
+    def post(self, *images):
+        return self.client.post(self.url, {
+            'title': 'Kitchen',
+            'date_completed': '2026-01-02',
+            'images': [SimpleUploadedFile(f'{i}.png', data, content_type='image/png') for i, data in enumerate(images)],
+        }, format='multipart')
+
+    def stored_files(self):
+        root = settings.MEDIA_ROOT
+        return [
+            os.path.relpath(os.path.join(directory, name), root)
+            for directory, _, names in os.walk(root) for name in names
+        ]
+
+    def test_images_are_stored_as_blobs_with_derivatives(self):
+        response = self.post(png_bytes(), png_bytes(color=(0, 0, 200)))
+        self.assertEqual(response.status_code, 201)
+        images = response.data['data']['images']
+        self.assertEqual([image['is_primary'] for image in images], [True, False])
+        self.assertEqual(MediaBlob.objects.count(), 2)
+        for image in PortfolioImage.objects.all():
+            self.assertEqual(image.derivatives, MediaBlob.objects.get(name=image.image.name).derivatives)
+            self.assertEqual(set(image.derivatives['64']), {'webp', 'jpeg'})
+
+    def test_failed_creation_releases_the_blobs(self):
+        with mock.patch.object(PortfolioImage.objects, 'create', side_effect=RuntimeError("database is locked")):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post(png_bytes(), png_bytes(color=(0, 0, 200)))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PortfolioItem.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failure_keeps_blobs_used_elsewhere(self):
+        self.assertEqual(self.post(png_bytes()).status_code, 201)
+        files = sorted(self.stored_files())
+        with mock.patch.object(PortfolioImage.objects, 'create', side_effect=RuntimeError("database is locked")):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.post(png_bytes()).status_code, 400)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertEqual(sorted(self.stored_files()), files)
+
+
+class ImageDerivativeTests(MediaTestCase):
+    def test_widths_never_exceed_the_original(self):
+        rendered = render_derivatives(io.BytesIO(png_bytes(500, 250)), (320, 640, 1080), ('webp', 'jpeg'), 80)
+        self.assertEqual(sorted({width for width, _, _ in rendered}), [320, 500])
+        for width, name, data in rendered:
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual(image.format, {'webp': 'WEBP', 'jpeg': 'JPEG'}[name])
+                self.assertEqual(image.size, (width, width // 2))
+
+    def test_every_width_is_written_in_both_formats(self):
+        rendered = render_derivatives(io.BytesIO(png_bytes(800, 400)), (320, 640), ('webp', 'jpeg'), 80)
+        self.assertEqual(
+            sorted((width, name) for width, name, _ in rendered),
+            [(320, 'jpeg'), (320, 'webp'), (640, 'jpeg'), (640, 'webp')],
+        )
+
+    def test_not_an_image(self):
+        self.assertEqual(render_derivatives(io.BytesIO(b'not an image'), (320,), ('webp',), 80), [])
+
+    def test_generate_image_derivatives_is_idempotent(self):
+        post = Post.objects.create(user=self.user)
+        name = default_storage.save('post_media/old.png', ContentFile(png_bytes(400, 200)))
+        media = MediaItem.objects.create(post=post, file=name, media_type='image')
+
+        out = io.StringIO()
+        call_command('generate_image_derivatives', stdout=out)
+        self.assertIn("Processed 1 image(s)", out.getvalue())
+        media.refresh_from_db()
+        self.assertEqual(set(media.derivatives), {'320', '400'})
+        derivatives = media.derivatives
+        files = sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'post_media')))
+
+        out = io.StringIO()
+        call_command('generate_image_derivatives', stdout=out)
+        self.assertIn("Processed 0 image(s)", out.getvalue())
+        media.refresh_from_db()
+        self.assertEqual(media.derivatives, derivatives)
+        self.assertEqual(sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'post_media'))), files)
+
+
+class StagedUploadCleanupTests(MediaTestCase):
+    def staged(self, age=0):
+        path = stage_upload(SimpleUploadedFile('p.png', png_bytes()))
+        if age:
+            past = time.time() - age
+            os.utime(path, (past, past))
+        return path
+
+    def test_deleting_an_unprocessed_row_removes_its_staged_upload(self):
+        post = Post.objects.create(user=self.user)
+        path = self.staged()
+        media = MediaItem.objects.create(post=post, media_type='image', processing_state='failed', staged_file=path)
+        story = Story.objects.create(user=self.user, media_type='image', processing_state='failed', staged_file=self.staged())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            media.delete()
+            story.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(story.staged_file))
+
+    def test_abandoned_staged_uploads_are_collected(self):
+        post = Post.objects.create(user=self.user)
+        waiting = self.staged(age=7200)
+        MediaItem.objects.create(post=post, media_type='image', processing_state='failed', staged_file=waiting)
+        uploading = self.staged(age=7200)
+        UploadSession.objects.create(user=self.user, filename='p.png', size=10, path=uploading)
+        abandoned = self.staged(age=7200)
+        fresh = self.staged()
+
+        stats = collect_orphan_media(grace_period=3600)
+        self.assertEqual((stats['orphans'], stats['handled']), (1, 1))
+        self.assertFalse(os.path.exists(abandoned))
+        self.assertTrue(os.path.exists(waiting))
+        self.assertTrue(os.path.exists(uploading))
+        self.assertTrue(os.path.exists(fresh))
+
+
+class OrphanMediaTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.quarantine, ignore_errors=True)
+        settings_override = override_settings(MEDIA_QUARANTINE_DIR=self.quarantine)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stored(self, name, age=7200):
+        name = default_storage.save(name, ContentFile(b'data'))
+        past = time.time() - age
+        os.utime(default_storage.path(name), (past, past))
+        return name
+
+    def exists(self, name):
+        return default_storage.exists(name)
+
+    def collect(self, **options):
+        out = io.StringIO()
+        call_command('collect_orphan_media', grace_period=3600, stdout=out, **options)
+        return out.getvalue()
+
+    def test_referenced_files_are_kept(self):
+        post = Post.objects.create(user=self.user)
+        media = MediaItem.objects.create(post=post, file=self.stored('post_media/a.png'), media_type='video')
+        MediaItem.objects.filter(id=media.id).update(
+            derivatives={'320': {'webp': self.stored('post_media/a_320.webp')}},
+            renditions={'360': {'mp4': self.stored('post_media/a_360.mp4')}},
+        )
+        MediaBlob.objects.create(sha256='ab' * 32, name=self.stored('cas/ab/ab/blob.png'), size=4)
+        orphan = self.stored('post_media/gone.png')
+
+        self.assertIn("Deleted 1 orphaned file(s), 4 byte(s)", self.collect())
+        for name in ['post_media/a.png', 'post_media/a_320.webp', 'post_media/a_360.mp4', 'cas/ab/ab/blob.png']:
+            self.assertTrue(self.exists(name), name)
+        self.assertFalse(self.exists(orphan))
+
+    def test_fresh_files_are_protected(self):
+        fresh = self.stored('post_media/new.png', age=0)
+        self.assertIn("Deleted 0 orphaned file(s)", self.collect())
+        self.assertTrue(self.exists(fresh))
+
+    def test_dry_run_deletes_nothing(self):
+        orphan = self.stored('post_media/gone.png')
+        self.assertIn("Found 1 orphaned file(s)", self.collect(dry_run=True))
+        self.assertTrue(self.exists(orphan))
+
+    def test_quarantine_moves_the_files(self):
+        orphan = self.stored('post_media/2026/gone.png')
+        self.assertIn("Quarantined 1 orphaned file(s)", self.collect(quarantine=True))
+        self.assertFalse(self.exists(orphan))
+        with open(os.path.join(self.quarantine, 'post_media', '2026', 'gone.png'), 'rb') as file:
+            self.assertEqual(file.read(), b'data')
+
+    def test_limit(self):
+        orphans = [self.stored(f'post_media/gone{i}.png') for i in range(3)]
+        self.assertIn("Deleted 2 orphaned file(s)", self.collect(limit=2))
+        self.assertEqual(sum(self.exists(name) for name in orphans), 1)
+
+    def test_empty_directories_are_pruned(self):
+        self.stored('post_media/2026/1/gone.png')
+        kept = self.stored('post_media/2026/2/gone.png', age=0)
+        stats = collect_orphan_media(grace_period=3600)
+        self.assertEqual(stats['directories_removed'], 1)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'post_media', '2026', '1')))
+        self.assertTrue(self.exists(kept))
+        self.assertTrue(os.path.isdir(settings.MEDIA_ROOT))
+
+
+def mp4_box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def mp4_bytes(width, height, timescale, duration, version=0, rotated=False):
+    """Minimal MP4: ftyp, a 64-bit sized mdat, then moov with mvhd and one trak/tkhd"""
+    if version == 1:
+        mvhd = bytes([1, 0, 0, 0]) + bytes(16) + struct.pack('>IQ', timescale, duration)
+        tkhd = bytes([1, 0, 0, 0]) + bytes(48)
+    else:
+        mvhd = bytes(4) + bytes(8) + struct.pack('>II', timescale, duration)
+        tkhd = bytes(40)
+    if rotated:
+        matrix = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000)
+    else:
+        matrix = (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd += struct.pack('>9i', *matrix) + struct.pack('>II', width << 16, height << 16)
+    mdat_payload = bytes(1000)
+    mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + len(mdat_payload)) + mdat_payload
+    moov = mp4_box(b'moov', mp4_box(b'mvhd', mvhd + bytes(80)) + mp4_box(b'trak', mp4_box(b'tkhd', tkhd)))
+    return mp4_box(b'ftyp', b'isom' + bytes(4)) + mdat + moov
+
+
+class MediaProbeTests(TestCase):
+    def write(self, data, suffix):
+        file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        self.addCleanup(os.remove, file.name)
+        with file:
+            file.write(data)
+        return file.name
+
+    def test_exif_rotated_jpeg_reports_displayed_dimensions(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+        buffer = io.BytesIO()
+        Image.new('RGB', (80, 40), (10, 120, 200)).save(buffer, 'JPEG', exif=exif)
+        probed = probe_image(self.write(buffer.getvalue(), '.jpg'))
+        self.assertEqual((probed['width'], probed['height']), (40, 80))
+
+        probed = probe_image(self.write(png_bytes(80, 40), '.png'))
+        self.assertEqual((probed['width'], probed['height']), (80, 40))
+
+    def test_blurhash_length_follows_the_components(self):
+        image = Image.new('RGB', (50, 30), (200, 30, 30))
+        for x_components, y_components in [(1, 1), (4, 3), (3, 5)]:
+            self.assertEqual(
+                len(blurhash(image, x_components, y_components)), 6 + 2 * (x_components * y_components - 1)
+            )
+        self.assertEqual(len(probe_image(self.write(png_bytes(), '.png'))['placeholder']), 28)
+
+    def test_not_an_image(self):
+        self.assertEqual(probe_image(self.write(b'not an image', '.png')), {})
+
+    def test_mp4_boxes(self):
+        probed = _mp4_probe(self.write(mp4_bytes(1920, 1080, 600, 3000), '.mp4'))
+        self.assertEqual(probed, {'width': 1920, 'height': 1080, 'duration': 5.0})
+
+    def test_mp4_version_1_boxes(self):
+        probed = _mp4_probe(self.write(mp4_bytes(640, 360, 1000, 2 ** 33, version=1), '.mp4'))
+        self.assertEqual(probed, {'width': 640, 'height': 360, 'duration': 2 ** 33 / 1000})
+
+    def test_mp4_rotation_matrix_swaps_the_dimensions(self):
+        probed = _mp4_probe(self.write(mp4_bytes(1920, 1080, 600, 600, rotated=True), '.mp4'))
+        self.assertEqual((probed['width'], probed['height']), (1080, 1920))
+
+    @override_settings(FFPROBE_BINARY='no-such-ffprobe')
+    def test_probe_video_falls_back_to_the_boxes(self):
+        self.assertEqual(probe_video(self.write(mp4_bytes(320, 240, 10, 25), '.mp4'))['duration'], 2.5)
+        self.assertEqual(probe_video(self.write(b'\x00\x00\x00\x08moo', '.mp4')), {})
+
+
+class ParseRangeTests(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+
+    def test_unsatisfiable(self):
+        self.assertIs(parse_range('bytes=1000-', 1000), False)
+        self.assertIs(parse_range('bytes=50-10', 1000), False)
+        self.assertIs(parse_range('bytes=-0', 1000), False)
+
+    def test_ignored(self):
+        for header in [None, '', 'bytes=-', 'bytes=0-1,5-9', 'items=0-9', 'bytes=a-b']:
+            self.assertIsNone(parse_range(header, 1000), header)
+
+
+class MediaServingTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 4
+        self.name = default_storage.save('post_media/clip.mp4', ContentFile(self.data))
+        self.url = '/media/' + self.name
+
+    def get(self, url=None, **headers):
+        return self.client.get(url or self.url, headers=headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+
+    def test_single_range(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.data[10:20])
+
+    def test_suffix_and_open_ended_ranges(self):
+        response = self.get(Range='bytes=-24')
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1023/{len(self.data)}')
+        self.assertEqual(self.body(response), self.data[-24:])
+
+        response = self.get(Range='bytes=1000-')
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1023/{len(self.data)}')
+        self.assertEqual(self.body(response), self.data[1000:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_multiple_and_malformed_ranges_get_the_whole_file(self):
+        for header in ['bytes=0-1,5-9', 'bytes=x-y']:
+            response = self.get(Range=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(self.body(response), self.data)
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range=etag).status_code, 206)
+        response = self.get(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+
+    def test_if_none_match(self):
+        etag = self.get()['ETag']
+        response = self.get(If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_private_directories_are_not_served(self):
+        staged = stage_upload(SimpleUploadedFile('p.png', png_bytes()))
+        self.assertEqual(self.get('/media/staging/' + os.path.basename(staged)).status_code, 404)
+
+        quarantine = os.path.join(settings.MEDIA_ROOT, 'quarantine')
+        os.makedirs(quarantine)
+        with open(os.path.join(quarantine, 'old.png'), 'wb') as file:
+            file.write(png_bytes())
+        with override_settings(MEDIA_QUARANTINE_DIR=quarantine):
+            self.assertEqual(self.get('/media/quarantine/old.png').status_code, 404)
+
+    def test_traversal_is_rejected(self):
+        # A real file next to MEDIA_ROOT
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(settings.MEDIA_ROOT)) as outside:
+            secret = os.path.basename(outside.name)
+            request = RequestFactory().get('/media/')
+            with self.assertRaises(Http404):
+                serve_media(request, '../' + secret)
+            with self.assertRaises(Http404):
+                serve_media(request, 'post_media/../../' + secret)
+        self.assertEqual(self.get('/media/../core/settings.py').status_code, 404)
+
+
+class VideoDerivativeTests(MediaTestCase):
+    def fake_ffmpeg(self, failing=()):
+        """Stands in for ffmpeg: writes the output file, or fails for the scale sizes in failing"""
+        def run(arguments, timeout):
+            if any(f"{size})'" in argument for argument in arguments for size in failing):
+                return False
+            with open(arguments[-1], 'wb') as output:
+                output.write(b'mp4')
+            return True
+        return mock.patch('user.video_derivatives._run_ffmpeg', side_effect=run)
+
+    @override_settings(VIDEO_RENDITION_HEIGHTS=(240, 480, 720))
+    def test_rendition_heights_are_smaller_than_the_short_side(self):
+        self.assertEqual(rendition_heights(1920, 1080), [240, 480, 720])
+        self.assertEqual(rendition_heights(640, 360), [240])
+        self.assertEqual(rendition_heights(720, 1280), [240, 480])
+        self.assertEqual(rendition_heights(480, 480), [240])
+        # Unknown dimensions: every size is attempted
+        self.assertEqual(rendition_heights(None, None), [240, 480, 720])
+
+    def test_poster_url_prefers_the_widest_jpeg(self):
+        self.assertIsNone(poster_url(default_storage, {}))
+        derivatives = {
+            '320': {'webp': 'v_320.webp', 'jpeg': 'v_320.jpg'},
+            '1080': {'webp': 'v_1080.webp', 'jpeg': 'v_1080.jpg'},
+        }
+        self.assertEqual(poster_url(default_storage, derivatives), default_storage.url('v_1080.jpg'))
+        self.assertEqual(poster_url(default_storage, {'640': {'webp': 'v.webp'}}), default_storage.url('v.webp'))
+
+    @override_settings(VIDEO_RENDITION_HEIGHTS=(240, 480))
+    def test_renditions_are_stored_next_to_the_original(self):
+        with self.fake_ffmpeg(failing=[480]):
+            renditions = transcode_renditions('/videos/in.mp4', 1920, 1080)
+        self.assertEqual([size for size, _ in renditions], [240])
+        stored = store_renditions(default_storage, 'cas/ab/cd/abcd.mp4', renditions)
+        self.assertEqual(stored, {'240': {'mp4': 'cas/ab/cd/abcd_240.mp4'}})
+        self.assertTrue(default_storage.exists('cas/ab/cd/abcd_240.mp4'))
+        # The failed transcode left nothing behind in the staging directory
+        self.assertEqual(os.listdir(settings.MEDIA_STAGING_DIR), [os.path.basename(renditions[0][1])])
+
+    def test_renditions_only_reach_rows_still_on_the_blob(self):
+        blob, _ = acquire_blob(ContentFile(b'video'), '.mp4')
+        acquire_blob(ContentFile(b'video'), '.mp4')
+        post = Post.objects.create(user=self.user)
+        current = MediaItem.objects.create(post=post, file=blob.name, media_type='video')
+        # Re-uploaded meanwhile: the row points at other media now
+        replaced = MediaItem.objects.create(post=post, file='post_media/other.mp4', media_type='video')
+
+        transcoded = os.path.join(settings.MEDIA_STAGING_DIR, 'out.mp4')
+        os.makedirs(settings.MEDIA_STAGING_DIR, exist_ok=True)
+        with open(transcoded, 'wb') as file:
+            file.write(b'mp4')
+        metadata = {'width': 1920, 'height': 1080}
+        # Pool threads close their connection when done; the test's one must stay open
+        with mock.patch('user.media_pipeline.connection'), \
+                mock.patch('user.media_pipeline.transcode_renditions', return_value=[(480, transcoded)]) as transcode:
+            _attach_renditions('user.MediaItem', current.pk, blob.pk, metadata)
+            _attach_renditions('user.MediaItem', replaced.pk, blob.pk, metadata)
+        self.assertEqual(transcode.call_count, 1)
+        self.assertFalse(os.path.exists(transcoded))
+
+        stored = MediaBlob.objects.get(pk=blob.pk).renditions
+        self.assertEqual(set(stored), {'480'})
+        current.refresh_from_db()
+        replaced.refresh_from_db()
+        self.assertEqual(current.renditions, stored)
+        self.assertEqual(replaced.renditions, {})
+
+
+class CachedAuthenticationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('1')
+        self.token = AccessToken.for_user(self.user)
+        self.authentication = CachedJWTAuthentication()
+
+    def authenticate(self):
+        return self.authentication.get_user(self.token)
+
+    def is_cached(self):
+        return caches['default'].get(user_cache_key(self.user.id)) is not None
+
+    def test_cached_user_is_served_without_a_query(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate().id, self.user.id)
+
+    def test_save_and_delete_invalidate(self):
+        self.authenticate()
+        self.user.name = 'Renamed'
+        self.user.save()
+        self.assertFalse(self.is_cached())
+        self.assertEqual(self.authenticate().name, 'Renamed')
+
+        self.user.delete()
+        self.assertFalse(self.is_cached())
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_counter_updates_invalidate(self):
+        self.authenticate()
+        adjust_counter(User, self.user.id, 'post_count', 1)
+        self.assertFalse(self.is_cached())
+        self.assertEqual(self.authenticate().post_count, 1)
+
+    def test_deactivated_user_is_rejected_once_invalidated(self):
+        self.authenticate()
+        # update() sends no signal: the cached copy is served until it is invalidated (or expires)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertTrue(self.authenticate().is_active)
+
+        invalidate_cached_user(self.user.id)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_cached_inactive_user_is_rejected(self):
+        self.user.is_active = False
+        caches['default'].set(user_cache_key(self.user.id), self.user)
+        with self.assertNumQueries(0), self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+@override_settings(
+    SMS_TRANSPORT='user.sms_outbox.FakeTransport',
+    SMS_OUTBOX_SYNC=True,
+    SMS_MAX_ATTEMPTS=3,
+    SMS_RETRY_BACKOFF=10,
+    SMS_BATCH_WINDOW=0,
+)
+class SmsOutboxTests(TestCase):
+    def setUp(self):
+        self.outbox = SmsOutbox()
+        self.transport = self.outbox.transport
+
+    def without_sender(self):
+        # Retries are driven by hand, with a frozen clock
+        return mock.patch.object(self.outbox, '_ensure_sender')
+
+    def test_retries_back_off_and_come_due_in_order(self):
+        self.transport.failing = {'1', '2'}
+        with self.without_sender(), mock.patch('user.sms_outbox.time.monotonic', return_value=100):
+            self.outbox.enqueue('1', 'first')
+        with self.without_sender(), mock.patch('user.sms_outbox.time.monotonic', return_value=105):
+            self.outbox.enqueue('2', 'second')
+        # First attempt failed at 100 and 105: due 10 seconds later
+        self.assertEqual([(due, message.phone) for due, _, message in sorted(self.outbox._retries)], [(110, '1'), (115, '2')])
+
+        with mock.patch('user.sms_outbox.time.monotonic', return_value=109):
+            self.assertEqual(self.outbox._due_retries(), [])
+        with mock.patch('user.sms_outbox.time.monotonic', return_value=116):
+            due = self.outbox._due_retries()
+        self.assertEqual([message.phone for message in due], ['1', '2'])
+
+        # The second failure waits twice as long
+        with self.without_sender(), mock.patch('user.sms_outbox.time.monotonic', return_value=116):
+            self.outbox._send(due[:1])
+        self.assertEqual([(due, message.attempts) for due, _, message in self.outbox._retries], [(136, 2)])
+
+    def test_gives_up_after_max_attempts(self):
+        self.transport.failing = {'1'}
+        with self.without_sender():
+            self.outbox.enqueue('1', 'code')
+            for _ in range(settings.SMS_MAX_ATTEMPTS - 2):
+                self.outbox.flush()
+            self.assertEqual(len(self.outbox._retries), 1)
+            with self.assertLogs('user.sms_outbox', 'ERROR'):
+                self.outbox.flush()
+        self.assertEqual(self.outbox._retries, [])
+        self.assertEqual(self.transport.sent, [])
+
+    @override_settings(SMS_RETRY_BACKOFF=0.05)
+    def test_retry_wakes_an_idle_sender(self):
+        # The sender is idle, blocked waiting for a message
+        self.outbox._ensure_sender()
+        time.sleep(0.1)
+        self.transport.failing = {'1'}
+        self.outbox.enqueue('1', 'code')
+        self.transport.failing.clear()
+
+        deadline = time.monotonic() + 5
+        while not self.transport.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([message.phone for message in self.transport.sent], ['1'])
+
+    @override_settings(ESKIZ_EMAIL='', ESKIZ_PASSWORD='')
+    def test_eskiz_needs_credentials(self):
+        with self.assertRaises(ImproperlyConfigured):
+            EskizTransport()
+
+
+class UsernameCheckTests(ApiTestCase):
+    url = '/api/v1/user/username/check/'
+
+    def setUp(self):
+        super().setUp()
+        # A fresh index per test, built on the first check
+        self.addCleanup(setattr, username_index, '_filter', None)
+        username_index._filter = None
+
+    def available(self, handle):
+        response = self.client.get(self.url, {'username': handle})
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']['available']
+
+    def test_taken_names_are_always_taken(self):
+        make_user('1', 'alice@istan.uz')
+        self.assertFalse(self.available('alice'))
+        built_at = username_index._built_at
+        # Created after the build: added to the index by post_save, no rebuild needed
+        make_user('2', 'bob@istan.uz')
+        self.assertFalse(self.available('bob'))
+        self.assertEqual(username_index._built_at, built_at)
+
+    def test_free_names_skip_the_database(self):
+        make_user('1', 'alice@istan.uz')
+        self.available('alice')
+        with self.assertNumQueries(0):
+            self.assertTrue(self.available('carol'))
+
+    def test_false_positive_is_confirmed_free(self):
+        self.available('warmup')
+        with mock.patch.object(username_index, 'might_exist', return_value=True), self.assertNumQueries(1):
+            self.assertTrue(self.available('carol'))
+
+    def test_rebuild_picks_up_renames(self):
+        user = make_user('1', 'alice@istan.uz')
+        self.assertFalse(self.available('alice'))
+        # Renamed by another process: this one sees no signal
+        User.objects.filter(id=user.id).update(username='alicia@istan.uz')
+        self.assertTrue(self.available('alice'))
+
+        later = time.monotonic() + settings.USERNAME_INDEX_TTL + 1
+        with mock.patch('user.username_index.time.monotonic', return_value=later):
+            self.assertFalse(self.available('alicia'))
+            self.assertFalse(username_index.might_exist('alice@istan.uz'))
+
+    def test_username_is_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        names = [f'user{i}@istan.uz' for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(f'other{i}@istan.uz' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
@@ -0,0 +1,176 @@
+"""
+Fan-out-on-write home timeline.
+
+Every public post is pushed into the timeline of each of the author's followers
+when it is created, so the feed only has to read one bounded slice of
+TimelineEntry rows instead of scanning every post of every followed user.
+Timelines are capped at TIMELINE_MAX_ENTRIES entries per user.
+"""
+import random
+import secrets
+
+from django.conf import settings
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Window
+from django.db.models.functions import RowNumber
+
+from .following_models import UserFollowing
+from .pagination import keyset_page
+from .post_models import Post
+from .timeline_models import TimelineEntry
+
+# Keep IN (...) lists well below the SQLite bound parameter limit
+BATCH_SIZE = 500
+
+# Seeded feed shuffles work on ids reduced modulo 2**31
+SHUFFLE_MODULUS = 2 ** 31
+SHUFFLE_MULTIPLIERS = (0x5bd1e995, 0x1b873593, 0x2c1b3c6d)
+
+
+def _chunks(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def trim_timelines(user_ids):
+    """Drop the oldest entries of every timeline that grew past the cap"""
+    cap = settings.TIMELINE_MAX_ENTRIES
+    for chunk in _chunks(list(user_ids)):
+        # Only timelines that are actually over the cap need the window query
+        overflowing = list(
+            TimelineEntry.objects.filter(user_id__in=chunk)
+            .values('user_id')
+            .annotate(total=Count('id'))
+            .filter(total__gt=cap)
+            .values_list('user_id', flat=True)
+        )
+        if not overflowing:
+            continue
+
+        stale_ids = list(
+            TimelineEntry.objects.filter(user_id__in=overflowing)
+            .annotate(position=Window(
+                RowNumber(),
+                partition_by=[F('user_id')],
+                order_by=[F('created_at').desc(), F('id').desc()],
+            ))
+            .filter(position__gt=cap)
+            .values_list('id', flat=True)
+        )
+        for stale_chunk in _chunks(stale_ids):
+            TimelineEntry.objects.filter(id__in=stale_chunk).delete()
+
+
+def fan_out_post(post):
+    """Push a newly created post into the timelines of the author's followers"""
+    if not post.is_public:
+        return
+
+    follower_ids = list(
+        UserFollowing.objects.filter(following_user_id=post.user_id).values_list('user_id', flat=True)
+    )
+    if not follower_ids:
+        return
+
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=follower_id, post_id=post.id, created_at=post.created_at)
+         for follower_id in follower_ids],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines(follower_ids)
+
+
+def backfill_timeline(user_id, followee_id):
+    """Copy the latest public posts of a newly followed user into the follower's timeline"""
+    recent_posts = Post.objects.filter(
+        user_id=followee_id,
+        is_public=True
+    ).order_by('-created_at').values_list('id', 'created_at')[:settings.TIMELINE_BACKFILL_SIZE]
+
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+         for post_id, created_at in recent_posts],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines([user_id])
+
+
+def purge_timeline(user_id, followee_id):
+    """Remove all posts of an unfollowed user from the follower's timeline"""
+    TimelineEntry.objects.filter(user_id=user_id, post__user_id=followee_id).delete()
+
+
+def rebuild_timeline(user_id):
+    """Rebuild a user's timeline from scratch from the latest posts of everyone they follow"""
+    followee_ids = UserFollowing.objects.filter(user_id=user_id).values_list('following_user_id', flat=True)
+    recent_posts = Post.objects.filter(
+        user_id__in=followee_ids,
+        is_public=True
+    ).order_by('-created_at').values_list('id', 'created_at')[:settings.TIMELINE_MAX_ENTRIES]
+
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at)
+         for post_id, created_at in recent_posts],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def shuffle_key(field, seed):
+    """
+    SQL expression that orders integer ids pseudo-randomly but reproducibly for a seed,
+    so a shuffled window can be read with ORDER BY ... LIMIT instead of in Python
+    """
+    offsets = random.Random(seed).sample(range(SHUFFLE_MODULUS), len(SHUFFLE_MULTIPLIERS))
+
+    # Add a seeded offset, multiply and swap the 16-bit halves, three times over.
+    # Every intermediate value stays below 2**63.
+    key = F(field) % SHUFFLE_MODULUS
+    for offset, multiplier in zip(offsets, SHUFFLE_MULTIPLIERS):
+        key = ((key + offset) * multiplier) % SHUFFLE_MODULUS
+        key = (key % 65536) * 32768 + key / 65536
+    return ExpressionWrapper(key, output_field=BigIntegerField())
+
+
+def new_feed_session(user_id):
+    """
+    Start a feed session: a random seed plus the newest timeline entry id, so every page
+    of the session is cut from the same permutation of the same set of posts
+    """
+    seed = secrets.randbelow(SHUFFLE_MODULUS)
+    snapshot_id = TimelineEntry.objects.filter(
+        user_id=user_id
+    ).order_by('-id').values_list('id', flat=True).first() or 0
+    return f"{seed}.{snapshot_id}"
+
+
+def parse_feed_session(session):
+    """Return (seed, snapshot_id) from a session issued by new_feed_session"""
+    try:
+        seed, snapshot_id = (int(part) for part in session.split('.'))
+    except ValueError:
+        raise ValueError("Invalid feed seed")
+    return seed, snapshot_id
+
+
+def shuffled_timeline_window(user_id, session, start, end):
+    """Return (post_ids, total) for one window of the seeded shuffle of a user's timeline"""
+    seed, snapshot_id = parse_feed_session(session)
+    entries = TimelineEntry.objects.filter(user_id=user_id, id__lte=snapshot_id)
+    post_ids = list(
+        entries.annotate(shuffle=shuffle_key('post_id', seed))
+        .order_by('shuffle', 'post_id')
+        .values_list('post_id', flat=True)[start:end]
+    )
+    return post_ids, entries.count()
+
+
+def timeline_page(user_id, position, page_size):
+    """Return one keyset page of a user's timeline as (post_ids, next_position)"""
+    entries, next_position = keyset_page(
+        TimelineEntry.objects.filter(user_id=user_id).only('id', 'post_id', 'created_at'),
+        position,
+        page_size
+    )
+    return [entry.post_id for entry in entries], next_position
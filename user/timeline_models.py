@@ -0,0 +1,32 @@
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+
+class TimelineEntry(models.Model):
+    """
+    Materialized home timeline entry: a post pushed into a follower's feed
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    post = models.ForeignKey(
+        'user.Post',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Copy of the post's created_at so the timeline can be ordered without a join
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Timeline Entry"
+        verbose_name_plural = "Timeline Entries"
+        unique_together = ('user', 'post')  # A post appears only once in a timeline
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='timeline_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in timeline of user {self.user_id}"
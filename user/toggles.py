@@ -0,0 +1,26 @@
+from django.db import IntegrityError, transaction
+
+
+def toggle(model, **lookup):
+    """
+    Flip the existence of the row identified by lookup, which must match a
+    unique_together constraint of model (like, save and follow rows).
+
+    Tries the DELETE first and only INSERTs when nothing was deleted, so a tap
+    costs one or two statements instead of exists() + delete()/create(), and
+    the unique constraint resolves concurrent taps instead of a check-then-act race.
+    :return: (exists, changed) - whether the row exists now, and whether this
+             call changed anything (False when a concurrent request won the insert)
+    """
+    deleted, _ = model.objects.filter(**lookup).delete()
+    if deleted:
+        return False, True
+
+    try:
+        # Savepoint, so a duplicate key doesn't break the caller's transaction
+        with transaction.atomic():
+            model.objects.create(**lookup)
+    except IntegrityError:
+        # A concurrent request inserted the same row first
+        return True, False
+    return True, True
@@ -0,0 +1,165 @@
+"""
+Streaming upload handler for the media endpoints.
+
+Django's default handlers keep uploads under FILE_UPLOAD_MAX_MEMORY_SIZE in
+memory and spool bigger ones to a temp file; a burst of concurrent video
+posts still means a lot of buffered data and a second pass over every file
+to hash or inspect it. StreamingMediaUploadHandler writes every file straight
+to the staging directory in fixed 64KB blocks and, in that same single pass:
+
+* sniffs the real MIME type from the file's magic number (the client's
+  Content-Type is not trusted)
+* computes the SHA-256 of the content
+* stops the upload as soon as the file passes the size cap of its type
+
+Peak memory per upload is one block, whatever the file size.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers, StopUpload
+
+from .uploads import UploadError
+
+# Bytes needed to recognize every supported format
+SNIFF_SIZE = 16
+
+# ISO base media (ftyp box) brands of image formats; every other brand is a video
+IMAGE_BRANDS = {
+    b'heic': 'image/heic', b'heix': 'image/heic', b'hevc': 'image/heic', b'heim': 'image/heic',
+    b'mif1': 'image/heif', b'msf1': 'image/heif',
+    b'avif': 'image/avif', b'avis': 'image/avif',
+}
+
+
+def sniff_media_type(header):
+    """
+    Recognize an image or video from its first bytes.
+    :return: (MIME type, 'image' or 'video'), or (None, None) for anything else
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg', 'image'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png', 'image'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif', 'image'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp', 'image'
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'video/x-msvideo', 'video'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in IMAGE_BRANDS:
+            return IMAGE_BRANDS[brand], 'image'
+        if brand == b'qt  ':
+            return 'video/quicktime', 'video'
+        if brand.startswith(b'3g'):
+            return 'video/3gpp', 'video'
+        return 'video/mp4', 'video'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm', 'video'
+    return None, None
+
+
+def sniff_file(path):
+    """sniff_media_type() of a file on disk"""
+    with open(path, 'rb') as file:
+        return sniff_media_type(file.read(SNIFF_SIZE))
+
+
+def max_upload_size(kind):
+    """Size cap in bytes of an uploaded image or video"""
+    return settings.MEDIA_MAX_IMAGE_SIZE if kind == 'image' else settings.MEDIA_MAX_VIDEO_SIZE
+
+
+class StagingUploadedFile(TemporaryUploadedFile):
+    """
+    A TemporaryUploadedFile created in the staging directory, so staging it
+    afterwards is a rename instead of a copy across file systems
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        os.makedirs(settings.MEDIA_STAGING_DIR, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=settings.MEDIA_STAGING_DIR)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class StreamingMediaUploadHandler(FileUploadHandler):
+    """
+    Writes uploads to disk block by block while hashing, sniffing and size-checking
+    them. The files it returns carry .sha256 and .media_kind, and their
+    content_type is the sniffed one. Refused files are recorded in .rejection.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.rejection = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = StagingUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.sha256 = hashlib.sha256()
+        self.header = b''
+        self.mime_type = None
+        self.media_kind = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.media_kind is None:
+            self.header += raw_data[:SNIFF_SIZE]
+            if len(self.header) >= SNIFF_SIZE and not self._sniff():
+                raise SkipFile()
+
+        if self.media_kind is not None and start + len(raw_data) > max_upload_size(self.media_kind):
+            self.rejection = UploadError(
+                f"{self.file_name} is larger than the {max_upload_size(self.media_kind)} byte limit for {self.media_kind}s",
+                status=413,
+            )
+            # Stop reading the request body right away
+            raise StopUpload(connection_reset=True)
+
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.media_kind is None and not self._sniff():
+            # Files shorter than SNIFF_SIZE: drop the file instead of returning it
+            self.file.close()
+            return None
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.content_type = self.mime_type
+        self.file.sha256 = self.sha256.hexdigest()
+        self.file.media_kind = self.media_kind
+        return self.file
+
+    def _sniff(self):
+        self.mime_type, self.media_kind = sniff_media_type(self.header)
+        if self.media_kind is None:
+            self.rejection = UploadError(f"{self.file_name} is not a supported image or video", status=415)
+            return False
+        return True
+
+
+class StreamingUploadMixin:
+    """
+    Installs StreamingMediaUploadHandler as the only upload handler of a view.
+    Views call rejected_upload() after reading request.FILES.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Handlers must be set on the Django request before DRF parses the body
+        request.upload_handlers = [StreamingMediaUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def rejected_upload(self, request):
+        """The UploadError of a file the handler refused, or None"""
+        for handler in request._request.upload_handlers:
+            if getattr(handler, 'rejection', None) is not None:
+                return handler.rejection
+        return None
@@ -0,0 +1,34 @@
+from django.db import models
+from django.conf import settings
+import uuid
+
+
+class UploadSession(models.Model):
+    """
+    Resumable upload: the file is sent as chunks appended to a partial file on
+    disk, then handed to post or story creation by its id (see upload_views.py)
+    """
+    STATE_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),  # Every byte received, waiting to be attached to a post or story
+        ('consumed', 'Consumed'),  # Attached to a post or story
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # Total size announced by the client
+    received = models.BigIntegerField(default=0)  # Bytes written so far, i.e. the offset of the next chunk
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='uploading')
+    path = models.CharField(max_length=500)  # Partial file in the staging directory
+    sha256 = models.CharField(max_length=64, blank=True)  # Set on completion when every chunk was hashed as it arrived
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Upload Session"
+        verbose_name_plural = "Upload Sessions"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename} ({self.received}/{self.size})"
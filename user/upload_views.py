@@ -0,0 +1,124 @@
+from django.conf import settings
+from rest_framework.views import APIView
+from rest_framework import status
+from .authentication import CachedJWTAuthentication
+from rest_framework.permissions import IsAuthenticated
+
+from .response import CustomResponse as Response
+from .uploads import (
+    UploadError, create_upload_session, get_upload_session, write_chunk, finalize_upload,
+)
+
+
+def serialize_upload(session):
+    """Format an upload session for the response"""
+    return {
+        'upload_id': session.id,
+        'filename': session.filename,
+        'size': session.size,
+        'offset': session.received,
+        'state': session.state,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+    }
+
+
+class UploadSessionCreateView(APIView):
+    """
+    View for starting a resumable upload:
+    POST {filename, size} returns the upload_id to send the chunks to
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            filename = request.data.get('filename')
+            try:
+                size = int(request.data.get('size'))
+            except (TypeError, ValueError):
+                return Response.error(message="Size must be an integer", status=status.HTTP_400_BAD_REQUEST)
+
+            if not filename:
+                return Response.error(message="Filename is required", status=status.HTTP_400_BAD_REQUEST)
+
+            session = create_upload_session(request.user, filename, size)
+            return Response.success(
+                data=serialize_upload(session),
+                message='Upload started',
+                status=status.HTTP_201_CREATED
+            )
+
+        except UploadError as e:
+            return Response.error(message=str(e), status=e.status)
+        except Exception as e:
+            return Response.error(message=f"Error starting upload: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadSessionView(APIView):
+    """
+    View for one resumable upload:
+    GET returns the offset to resume from,
+    PUT ?offset=N with the raw chunk as the body appends it to the file
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        try:
+            session = get_upload_session(request.user, upload_id)
+            return Response.success(
+                data=serialize_upload(session),
+                message='Upload retrieved successfully',
+                status=status.HTTP_200_OK
+            )
+
+        except UploadError as e:
+            return Response.error(message=str(e), status=e.status)
+        except Exception as e:
+            return Response.error(message=f"Error retrieving upload: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
+
+    def put(self, request, upload_id):
+        try:
+            session = get_upload_session(request.user, upload_id)
+
+            try:
+                offset = int(request.query_params.get('offset', request.headers.get('Upload-Offset', '')))
+                length = int(request.headers.get('Content-Length') or 0)
+            except ValueError:
+                return Response.error(message="Offset must be an integer", status=status.HTTP_400_BAD_REQUEST)
+
+            # The body is read from the stream directly instead of through request.data
+            session = write_chunk(session, offset, request.stream, length)
+            return Response.success(
+                data=serialize_upload(session),
+                message='Chunk received',
+                status=status.HTTP_200_OK
+            )
+
+        except UploadError as e:
+            return Response.error(message=str(e), status=e.status)
+        except Exception as e:
+            return Response.error(message=f"Error writing chunk: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadCompleteView(APIView):
+    """
+    View for finalizing a resumable upload once every chunk is received;
+    the upload_id can then be sent to post or story creation instead of a file
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        try:
+            session = finalize_upload(get_upload_session(request.user, upload_id))
+            return Response.success(
+                data=serialize_upload(session),
+                message='Upload complete',
+                status=status.HTTP_200_OK
+            )
+
+        except UploadError as e:
+            return Response.error(message=str(e), status=e.status)
+        except Exception as e:
+            return Response.error(message=f"Error finalizing upload: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,251 @@
+"""
+Resumable chunked uploads.
+
+A client creates an upload session announcing the file name and size, then
+PUTs the file as chunks, each with the offset it starts at. Chunks are copied
+from the request stream to the partial file in small reads, so memory stays
+bounded whatever the file size. A connection that drops mid-chunk keeps the
+bytes that arrived; the client asks for the session's offset and resumes from
+there. Once every byte is received the client finalizes the session, and
+post/story creation takes the assembled file by the session id.
+
+Chunks are hashed as they are written, so the SHA-256 of a completed upload
+is known without reading the file again. The running hash lives in the
+memory of the process that received the chunks; when chunks land on
+different processes the media pipeline hashes the file itself.
+
+The media type is sniffed from the first chunk, so an upload is refused as
+soon as its size is over the cap of its kind (MEDIA_MAX_IMAGE_SIZE or
+MEDIA_MAX_VIDEO_SIZE), and checked again when the upload is finalized.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from .upload_models import UploadSession
+
+# Bytes read from the request stream at a time
+READ_SIZE = 64 * 1024
+
+
+# Running SHA-256 of the uploads this process received every chunk of:
+# session id -> (bytes hashed, hash, monotonic time of the last chunk), least recently written first
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def _take_hash(session_id):
+    """Remove and return the running hash of a session as (bytes hashed, hash or None)"""
+    with _hashes_lock:
+        hashed, digest, _ = _hashes.pop(session_id, (0, None, None))
+    return hashed, digest
+
+
+def _keep_hash(session_id, hashed, digest):
+    """
+    Store the running hash of a session, dropping the hashes of uploads abandoned
+    for longer than UPLOAD_SESSION_TTL and the oldest ones beyond UPLOAD_MAX_RUNNING_HASHES
+    (sessions are swept by another process, so this one has to forget them itself)
+    """
+    now = time.monotonic()
+    with _hashes_lock:
+        _hashes[session_id] = (hashed, digest, now)
+        while _hashes:
+            oldest_id = next(iter(_hashes))
+            _, _, written_at = _hashes[oldest_id]
+            if len(_hashes) <= settings.UPLOAD_MAX_RUNNING_HASHES and now - written_at <= settings.UPLOAD_SESSION_TTL:
+                break
+            # The upload is hashed again from its file if it is ever finalized
+            del _hashes[oldest_id]
+
+
+class UploadError(Exception):
+    """An upload request that can't be served, with the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def uploads_dir():
+    return os.path.join(settings.MEDIA_STAGING_DIR, 'uploads')
+
+
+def create_upload_session(user, filename, size):
+    """Start an upload session with an empty partial file"""
+    if size <= 0:
+        raise UploadError("Size must be a positive number of bytes")
+    if size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f"Files larger than {settings.UPLOAD_MAX_SIZE} bytes are not allowed", status=413)
+
+    os.makedirs(uploads_dir(), exist_ok=True)
+    session_id = uuid.uuid4()
+    # The file is processed where it is once attached, so it keeps the upload's extension
+    _, extension = os.path.splitext(filename)
+    path = os.path.join(uploads_dir(), f"{session_id.hex}{extension.lower()}")
+    open(path, 'wb').close()
+    return UploadSession.objects.create(
+        id=session_id, user=user, filename=os.path.basename(filename)[:255], size=size, path=path
+    )
+
+
+def get_upload_session(user, upload_id):
+    """The user's upload session with this id, or UploadError(404)"""
+    try:
+        upload_id = uuid.UUID(str(upload_id))
+    except ValueError:
+        raise UploadError("Invalid upload id")
+
+    session = UploadSession.objects.filter(id=upload_id, user=user).first()
+    if session is None or session.updated_at < timezone.now() - timezone.timedelta(seconds=settings.UPLOAD_SESSION_TTL):
+        raise UploadError("Upload not found", status=404)
+    return session
+
+
+def check_media_kind(session, header=None):
+    """
+    Refuse an upload that is not an image or video, or whose announced size is over the cap of its kind.
+    :param header: first bytes of the file, read from the partial file when not given
+    """
+    # Imported here: upload_handlers imports UploadError from this module
+    from .upload_handlers import SNIFF_SIZE, max_upload_size, sniff_file, sniff_media_type
+
+    if header is None:
+        _, media_kind = sniff_file(session.path)
+    elif len(header) < SNIFF_SIZE:
+        # Too short to tell, checked again when the upload is finalized
+        return
+    else:
+        _, media_kind = sniff_media_type(header[:SNIFF_SIZE])
+    if media_kind is None:
+        raise UploadError(f"{session.filename} is not a supported image or video", status=415)
+    if session.size > max_upload_size(media_kind):
+        raise UploadError(
+            f"{session.filename} is larger than the {max_upload_size(media_kind)} byte limit for {media_kind}s",
+            status=413,
+        )
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Append a chunk read from stream to the partial file.
+    :param offset: position of the chunk in the file, must equal the bytes received so far
+    :param length: number of bytes in the chunk (the request's Content-Length)
+    :return: the updated session
+    """
+    if session.state != 'uploading':
+        raise UploadError("Upload is already finalized", status=409)
+    if length <= 0 or stream is None:
+        raise UploadError("Empty chunk")
+    if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError(f"Chunks larger than {settings.UPLOAD_MAX_CHUNK_SIZE} bytes are not allowed", status=413)
+    if offset + length > session.size:
+        raise UploadError("Chunk goes past the announced size")
+
+    with open(session.path, 'r+b') as partial:
+        # One writer per session at a time
+        try:
+            fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Another chunk of this upload is being written", status=409)
+
+        # Re-read the offset under the lock, a concurrent chunk may have just landed
+        session.refresh_from_db(fields=['received', 'state'])
+        if offset != session.received:
+            raise UploadError(f"Expected a chunk at offset {session.received}", status=409)
+
+        # Continue the running hash only if it covers everything before this chunk
+        hashed, digest = _take_hash(session.id)
+        if offset == 0:
+            digest = hashlib.sha256()
+        elif hashed != offset:
+            digest = None
+
+        partial.seek(offset)
+        written = 0
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                # Connection dropped: keep what arrived, the client resumes from the new offset
+                break
+            if offset == 0 and written == 0:
+                # The first bytes tell the kind: refuse an oversized video or image before storing anything
+                check_media_kind(session, data)
+            partial.write(data)
+            if digest is not None:
+                digest.update(data)
+            written += len(data)
+        partial.truncate(offset + written)
+        if digest is not None:
+            _keep_hash(session.id, offset + written, digest)
+
+        session.received = offset + written
+        session.save(update_fields=['received', 'updated_at'])
+    return session
+
+
+def finalize_upload(session):
+    """Mark a fully received upload as ready to be attached to a post or story"""
+    if session.state != 'uploading':
+        raise UploadError("Upload is already finalized", status=409)
+    if session.received != session.size:
+        raise UploadError(f"Upload is incomplete: {session.received} of {session.size} bytes received", status=409)
+    check_media_kind(session)
+    hashed, digest = _take_hash(session.id)
+    if digest is not None and hashed == session.size:
+        session.sha256 = digest.hexdigest()
+    session.state = 'complete'
+    session.save(update_fields=['state', 'sha256', 'updated_at'])
+    return session
+
+
+def claim_upload(user, upload_id):
+    """
+    A finalized upload that can be attached to a post or story. The file stays
+    where it is and the session is only marked consumed by consume_upload(),
+    in the transaction creating the row, so a failed creation leaves the
+    upload intact for another try.
+    :return: the upload session; its path is the file to process
+    """
+    session = get_upload_session(user, upload_id)
+    if session.state == 'uploading':
+        raise UploadError("Upload is not finalized")
+    if session.state == 'consumed':
+        raise UploadError("Upload was already used", status=409)
+    return session
+
+
+def consume_upload(session):
+    """Mark a claimed upload as attached; must run in the transaction creating its row"""
+    # Conditional update, so an upload can't be attached twice by concurrent requests
+    consumed = UploadSession.objects.filter(id=session.id, state='complete').update(
+        state='consumed', updated_at=timezone.now()
+    )
+    if not consumed:
+        raise UploadError("Upload was already used", status=409)
+
+
+def sweep_upload_sessions():
+    """
+    Delete sessions idle for longer than UPLOAD_SESSION_TTL with their partial files.
+    :return: number of deleted sessions
+    """
+    cutoff = timezone.now() - timezone.timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    expired = UploadSession.objects.filter(updated_at__lt=cutoff)
+    deleted = 0
+    for session_id, path, state in expired.values_list('id', 'path', 'state').iterator():
+        # The file of a consumed upload belongs to its post or story (the media pipeline removes it)
+        if state != 'consumed':
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        _take_hash(session_id)
+        deleted += UploadSession.objects.filter(id=session_id).delete()[0]
+    return deleted
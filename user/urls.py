@@ -1,15 +1,18 @@
 from django.urls import path
-from .views import SmsGenerateView, SmsVerifyView, GetProfession,UserPartialCreate,UserView,PostContetn,StoryCreate,MyStoriesView,FeedStoriesView,ViewStoryView
+from .views import SmsGenerateView, SmsVerifyView, GetProfession,UserPartialCreate,UsernameCheckView,UserView,PostContetn,StoryCreate,MyStoriesView,FeedStoriesView,ViewStoryView
 from .following_views import FollowUserView, GetFollowersView, GetFollowingView, RandomizedPostFeedView
 from .post_interaction_views import LikePostView, CommentPostView, GetPostCommentsView, DeleteCommentView, SavePostView, GetSavedPostsView
 from .profile_views import UserProfileView, SkillView, AchievementView, PortfolioItemView, UserTagView, CompactProfileView
 from .profile_update_views import ProfileUpdateView
 from .media_filter_views import MediaFilteredPostsView, UserPostsView
+from .membership_views import MembershipView
+from .upload_views import UploadSessionCreateView, UploadSessionView, UploadCompleteView
 urlpatterns = [
     path('sms/generate/', SmsGenerateView.as_view(), name='sms-generate'),
     path('sms/verify/', SmsVerifyView.as_view(), name='sms-verify'),
     path('get-profession/', GetProfession.as_view(), name='get-profession'),
     path('partial-create/', UserPartialCreate.as_view(), name='user-partial-create'),
+    path('username/check/', UsernameCheckView.as_view(), name='username-check'),
     path('me/', UserView.as_view(), name='get-user'),
     path('post/create/', PostContetn.as_view(), name='post-create'),
     path('story/create/', StoryCreate.as_view(), name='story-create'),
@@ -31,6 +34,12 @@ urlpatterns = [
     path('comments/<int:comment_id>/', DeleteCommentView.as_view(), name='delete-comment'),
     path('posts/<int:post_id>/save/', SavePostView.as_view(), name='save-post'),
     path('posts/saved/', GetSavedPostsView.as_view(), name='get-saved-posts'),
+    # Bulk liked/saved/following lookup
+    path('membership/', MembershipView.as_view(), name='membership'),
+    # Resumable chunked uploads
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:upload_id>/', UploadSessionView.as_view(), name='upload-chunk'),
+    path('uploads/<uuid:upload_id>/complete/', UploadCompleteView.as_view(), name='upload-complete'),
     # Profile endpoints
     path('profile/', UserProfileView.as_view(), name='own-profile'),
     path('profile/<int:user_id>/', UserProfileView.as_view(), name='user-profile'),
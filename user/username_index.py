@@ -0,0 +1,96 @@
+"""
+In-memory index of taken usernames for the live availability check.
+
+The signup form checks the username on every keystroke. Instead of a query per
+keystroke, every process keeps a Bloom filter of users.username: a name that
+is not in the filter is certainly free and is answered without touching the
+database; only names the filter reports (taken, or a rare false positive) are
+confirmed with a query.
+
+Usernames saved in this process are added right away (see signals.py). The
+filter is rebuilt every USERNAME_INDEX_TTL seconds to pick up users created by
+other processes and to forget deleted or renamed ones; until then a name taken
+through another process may be reported free. The availability check is a
+hint: UserPartialCreate still checks the database before saving.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .models import User
+
+# Suffix every stored username gets (see UserPartialCreate)
+USERNAME_SUFFIX = "@istan.uz"
+
+
+def full_username(handle):
+    return handle + USERNAME_SUFFIX
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        # Optimal size and number of hashes for the expected capacity and false positive rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Two 64-bit hashes combined (Kirsch-Mitzenmacher) give all the positions
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UsernameIndex:
+    """Per-process Bloom filter of taken usernames, rebuilt every USERNAME_INDEX_TTL seconds"""
+
+    def __init__(self):
+        self._filter = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        usernames = User.objects.exclude(username__isnull=True).values_list('username', flat=True)
+        # Room for the users signing up until the next rebuild
+        bloom = BloomFilter(int(usernames.count() * 1.2) + 1000, settings.USERNAME_BLOOM_ERROR_RATE)
+        for username in usernames.iterator(chunk_size=5000):
+            bloom.add(username)
+        return bloom
+
+    def _current(self):
+        if self._filter is None or time.monotonic() - self._built_at > settings.USERNAME_INDEX_TTL:
+            with self._lock:
+                if self._filter is None or time.monotonic() - self._built_at > settings.USERNAME_INDEX_TTL:
+                    self._filter = self._build()
+                    self._built_at = time.monotonic()
+        return self._filter
+
+    def add(self, username):
+        """Record a username saved in this process"""
+        if username and self._filter is not None:
+            self._filter.add(username)
+
+    def might_exist(self, username):
+        return username in self._current()
+
+    def is_taken(self, username):
+        """Whether a stored username exists: no query unless the filter reports it"""
+        if not self.might_exist(username):
+            return False
+        return User.objects.filter(username=username).exists()
+
+
+username_index = UsernameIndex()
@@ -0,0 +1,140 @@
+"""
+Poster frames and low-bitrate renditions of uploaded videos.
+
+A feed card showing a video used to start downloading the original just to
+paint its first frame, and autoplay streamed the full-quality file. When
+ffmpeg is installed the processing pipeline now also makes, per video:
+
+* a poster: one frame grabbed with ffmpeg, then rendered like an image
+  derivative (WebP and JPEG at IMAGE_DERIVATIVE_WIDTHS) into the same
+  derivatives field
+* renditions: H.264/AAC MP4 copies with the short side scaled down to each of
+  VIDEO_RENDITION_HEIGHTS, capped at VIDEO_RENDITION_MAX_BITRATE and with the
+  moov box up front so playback starts before the download ends
+
+Renditions are kept in the same {size: {format: name}} shape as derivatives:
+
+    {"480": {"mp4": "cas/ab/cd/abcd..._480.mp4"}}
+
+Without ffmpeg nothing is generated and clients fall back to the original.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+
+logger = logging.getLogger(__name__)
+
+RENDITION_FORMAT = 'mp4'
+
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable, or None when it is not installed"""
+    return shutil.which(settings.FFMPEG_BINARY)
+
+
+def _run_ffmpeg(arguments, timeout):
+    binary = ffmpeg_binary()
+    if not binary:
+        return False
+    try:
+        subprocess.run([binary, '-v', 'error', '-y', *arguments], capture_output=True, timeout=timeout, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.warning("ffmpeg failed: %s", e.stderr.decode(errors='replace').strip())
+        return False
+    except (subprocess.SubprocessError, OSError):
+        logger.exception("ffmpeg could not be run")
+        return False
+    return True
+
+
+def _temporary_path(extension):
+    os.makedirs(settings.MEDIA_STAGING_DIR, exist_ok=True)
+    return os.path.join(settings.MEDIA_STAGING_DIR, f"{uuid.uuid4().hex}.{extension}")
+
+
+def extract_poster(path, duration=None):
+    """
+    Grab the poster frame of a video as a JPEG in the staging directory.
+    :return: path of the JPEG, or None
+    """
+    # A little past the start skips black fade-ins, but stays inside short clips
+    offset = settings.VIDEO_POSTER_OFFSET
+    if duration:
+        offset = min(offset, duration / 2)
+    output = _temporary_path('jpg')
+
+    for seek in (offset, 0) if offset else (0,):
+        arguments = ['-ss', f'{seek:.3f}', '-i', path, '-frames:v', '1', '-q:v', '2', output]
+        if _run_ffmpeg(arguments, settings.FFMPEG_TIMEOUT) and os.path.exists(output) and os.path.getsize(output):
+            return output
+    discard_outputs([output])
+    return None
+
+
+def rendition_heights(width, height):
+    """Rendition sizes worth making for a video: only ones smaller than the original"""
+    if not width or not height:
+        return list(settings.VIDEO_RENDITION_HEIGHTS)
+    return [size for size in settings.VIDEO_RENDITION_HEIGHTS if size < min(width, height)]
+
+
+def transcode_renditions(path, width=None, height=None):
+    """
+    Transcode the renditions of a video into the staging directory.
+    :return: list of (size, path)
+    """
+    renditions = []
+    for size in rendition_heights(width, height):
+        output = _temporary_path(RENDITION_FORMAT)
+        # Scale the short side (portrait videos too); ffmpeg applies the rotation first
+        scale = f"scale='if(gt(iw,ih),-2,{size})':'if(gt(iw,ih),{size},-2)'"
+        arguments = [
+            '-i', path, '-map', '0:v:0', '-map', '0:a:0?', '-vf', scale,
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(settings.VIDEO_RENDITION_CRF),
+            '-maxrate', settings.VIDEO_RENDITION_MAX_BITRATE,
+            '-bufsize', settings.VIDEO_RENDITION_BUFFER_SIZE,
+            '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '96k',
+            '-movflags', '+faststart', output,
+        ]
+        if _run_ffmpeg(arguments, settings.VIDEO_RENDITION_TIMEOUT):
+            renditions.append((size, output))
+        else:
+            discard_outputs([output])
+    return renditions
+
+
+def store_renditions(storage, original_name, renditions):
+    """
+    Save transcoded renditions next to the original file.
+    :return: {size: {'mp4': stored name}} as kept in the renditions JSON field
+    """
+    root, _ = os.path.splitext(original_name)
+    stored = {}
+    for size, path in renditions:
+        with open(path, 'rb') as rendition:
+            stored_name = storage.save(f"{root}_{size}.{RENDITION_FORMAT}", File(rendition))
+        stored.setdefault(str(size), {})[RENDITION_FORMAT] = stored_name
+    return stored
+
+
+def poster_url(storage, derivatives):
+    """URL of the widest JPEG (else any format) poster among derivatives, or None"""
+    if not derivatives:
+        return None
+    widest = derivatives[max(derivatives, key=int)]
+    name = widest.get('jpeg') or next(iter(widest.values()), None)
+    return storage.url(name) if name else None
+
+
+def discard_outputs(paths):
+    """Remove temporary ffmpeg outputs"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,25 +1,43 @@
 from django.shortcuts import render
 from django.db import transaction
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
 from .response import CustomResponse as Response
-from .models import User, SmSCode
+from .models import User
 from django.utils import timezone
 # Create your views here.
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from eskiz_sms import EskizSMS
-from user.models import Profession
 import random
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CachedJWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 # Import the post models
 from .post_models import Post, MediaItem, PostLike, PostComment
 # Import the story models
 from .story_models import Story, StoryView
-email = "qodirxonyusufjanov5@gmail.com"
-password = "ThoIH2cYssktvU3Zak8YIlzX9ZMY3BthQYtIAjkU"
+from .timeline import fan_out_post
+from .counters import adjust_counter
+from .media_pipeline import stage_upload, uploaded_digest, discard_staged, submit_media_processing
+from .uploads import UploadError, claim_upload, consume_upload
+from .upload_handlers import StreamingUploadMixin, sniff_file
+from .otp import check_code, client_ip, issue_code, take_token
+from .sms_outbox import sms_outbox
+from .username_index import full_username, username_index
+from .profession_catalog import catalog_delta, catalog_list, etag_matches, get_catalog
+from .story_tray import get_story_tray, invalidate_author_story_trays, invalidate_story_trays
+import logging
+
+logger = logging.getLogger(__name__)
+
+def too_many_requests(retry_after):
+    """429 response telling the client when to retry"""
+    response = Response.error("Too many requests, try again later", status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(retry_after)
+    return response
 
 class SmsGenerateView(APIView):
     """
@@ -27,38 +45,22 @@ class SmsGenerateView(APIView):
     """
     permission_classes = [AllowAny]
 
-    @transaction.atomic
     def post(self, request):
         try:
             phone = request.data.get('phone')
             if not phone:
                 return Response.error("Phone number is required", status=status.HTTP_400_BAD_REQUEST)
             
-            # Generate a 6-digit code
-            # code = str(random.randint(1000, 9999))
-            code = 1111
-            message = f"Bu Eskiz dan test"
-            print(code)
-            print(phone)
-            # try:
-            #     # Initialize EskizSMS and send SMS
-            #     eskiz = EskizSMS(email=email, password=password)
-            #     response = eskiz.send_sms(phone, message)
-            #     print(response)
-            #     # Check if the response indicates success
-            #     # if response.status != 'success':  # Access the 'status' attribute directly
-            #     #     return Response.error("Failed to send SMS", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            # except Exception as e:
-            #     return Response.error(f"Error sending SMS: {str(e)}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            # Create or update the SMS code entry
-            sms_code, created = SmSCode.objects.update_or_create(
-                phone=phone,
-                defaults={'code': code, 'is_verified': False}
-            )
+            # Limit how often a client and a phone can ask for codes (SMS flooding)
+            retry_after = take_token('send_ip', client_ip(request)) or take_token('send_phone', phone)
+            if retry_after:
+                return too_many_requests(retry_after)
+            
+            # Store a new code in the OTP cache (OTP_FIXED_CODE while SMS sending is off)
+            code = issue_code(phone)
             
-            # Log the SMS sending (for debugging purposes)
-            print(f"Sending SMS to {phone}: Your verification code is {code}")
+            # Queue the SMS; the outbox thread sends it, the request doesn't wait for the provider
+            sms_outbox.enqueue(phone, settings.SMS_CODE_TEMPLATE.format(code=code))
             
             return Response.success(message="SMS sent successfully", status=status.HTTP_200_OK)
         except Exception as e:
@@ -70,7 +72,6 @@ class SmsVerifyView(APIView):
     """
     permission_classes = [AllowAny]
 
-    @transaction.atomic
     def post(self, request):
         phone = request.data.get('phone')
         code = request.data.get('code')
@@ -78,23 +79,36 @@ class SmsVerifyView(APIView):
         if not phone or not code:
             return Response.error("Phone number and code are required", status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            sms_code = SmSCode.objects.get(phone=phone, code=code)
-            if sms_code.is_verified:
-                return Response.error("Code already verified", status=status.HTTP_400_BAD_REQUEST)
-            
-            # Mark the code as verified
-            sms_code.is_verified = True
-            sms_code.save()
+        # Limit how often a client and a phone can guess codes (brute force)
+        retry_after = take_token('verify_ip', client_ip(request)) or take_token('verify_phone', phone)
+        if retry_after:
+            return too_many_requests(retry_after)
 
-            # Optionally, you can create or update the user here
-            user, created = User.objects.update_or_create(
-                phone=phone,
-                defaults={'is_active': True}
-            )
-            password = str(random.randint(100000, 999999))  # Convert password to string
-            user.set_password(password)
-            user.save()  # Don't forget to save the user after setting the password
+        # Codes are single-use and burnt after OTP_MAX_ATTEMPTS wrong guesses
+        result = check_code(phone, code)
+        if result == 'expired':
+            return Response.error("Code expired, request a new one", status=status.HTTP_400_BAD_REQUEST)
+        if result == 'invalid':
+            return Response.error("Invalid code", status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Get or create the user. Phone users log in with SMS codes only, so new users
+            # get an unusable password (no hashing) and returning users are not written at all
+            user = User.objects.filter(phone=phone).first()
+            if user is None:
+                user = User.objects.create_user(phone=phone)
+            else:
+                update_fields = []
+                if not user.is_active:
+                    user.is_active = True
+                    update_fields.append('is_active')
+                # Users created before this still have a random hashed password: replace it once.
+                # Staff keep theirs, they need it for the admin
+                if not user.is_staff and user.has_usable_password():
+                    user.set_unusable_password()
+                    update_fields.append('password')
+                if update_fields:
+                    user.save(update_fields=update_fields)
 
             if user.is_new:
                 return Response.success(data={'is_new': True}, message="Code verified successfully", status=status.HTTP_200_OK)
@@ -105,8 +119,8 @@ class SmsVerifyView(APIView):
                 refresh_token = str(refresh)
                 access_token = str(access)
                 return Response.success(data={'is_new': False, 'refresh': refresh_token, 'access': access_token}, message="Code verified successfully", status=status.HTTP_200_OK)
-        except SmSCode.DoesNotExist:
-            return Response.error("Invalid code", status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response.error(f"Error: {str(e)}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class UserPartialCreate(APIView):
     """
@@ -116,7 +130,7 @@ class UserPartialCreate(APIView):
     def checkusername(self, username):
         # jiyloniy@istan.uz
         # add @istan.uz
-        username = username + "@istan.uz"
+        username = full_username(username)
         if User.objects.filter(username=username).exists():
             return False
         return True
@@ -145,12 +159,12 @@ class UserPartialCreate(APIView):
                 return Response.success(data={'is_new':False,'refresh':refresh_token,'access':access_token}, message="User already exists", status=status.HTTP_400_BAD_REQUEST)
             if get_user.is_new:
                 get_user.user_type = user_type
-                get_user.username = username + "@istan.uz"
+                get_user.username = full_username(username)
                 get_user.name = name
                 get_user.profession.set(profession) 
                 get_user.is_new = False
                 get_user.second_name = second_name
-                get_user.save()
+                get_user.save(update_fields=['user_type', 'username', 'name', 'is_new', 'second_name'])
                 refresh = RefreshToken.for_user(get_user)
                 access = refresh.access_token
                 refresh_token = str(refresh)
@@ -158,28 +172,52 @@ class UserPartialCreate(APIView):
                 return Response.success(data={'is_new':True,'refresh':refresh_token,'access':access_token}, message="User created successfully", status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response.error(f"Error: {str(e)}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+class UsernameCheckView(APIView):
+    """
+        Username availability check for the signup form (called on every keystroke)
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        username = request.query_params.get('username', '').strip()
+        if not username:
+            return Response.error("Username is required", status=status.HTTP_400_BAD_REQUEST)
+        # Free names are answered from the in-memory index, taken ones are confirmed in the database
+        available = not username_index.is_taken(full_username(username))
+        return Response.success(data={'username': username, 'available': available}, message="Username checked successfully", status=status.HTTP_200_OK)
 class GetProfession(APIView):
     """
         Get all profession
+        (?since=<version> returns only the professions changed and the ids deleted after that version)
     """
     permission_classes = [AllowAny]
     def get(self, request):
         try:
-            professions = Profession.objects.all()
-            data = []
-            for profession in professions:
-                data.append({
-                    'id': profession.id,
-                    'name': profession.name,
-                })
-            return Response.success(data=data, message="Professions retrieved successfully", status=status.HTTP_200_OK)
+            since = request.query_params.get('since')
+            if since is not None and not since.isdigit():
+                return Response.error("since must be a catalog version", status=status.HTTP_400_BAD_REQUEST)
+
+            # Served from the cache; rebuilt only after a profession changed
+            catalog = get_catalog()
+            if etag_matches(request.headers.get('If-None-Match'), catalog['etag']):
+                # The client already has this version
+                response = HttpResponseNotModified()
+            elif since is not None:
+                response = Response.success(data=catalog_delta(catalog, int(since)), message="Professions retrieved successfully", status=status.HTTP_200_OK)
+            else:
+                response = Response.success(data=catalog_list(catalog), message="Professions retrieved successfully", status=status.HTTP_200_OK)
+            response['ETag'] = catalog['etag']
+            response['X-Catalog-Version'] = str(catalog['version'])
+            # Clients keep the catalog but check the ETag on every launch
+            patch_cache_control(response, public=True, no_cache=True)
+            return response
         except Exception as e:
             return Response.error(f"Error: {str(e)}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
 class UserView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
     permission_classes = [IsAuthenticated]
 
@@ -197,65 +235,119 @@ class UserView(APIView):
         return Response.success(data=data, message="User retrieved successfully", status=status.HTTP_200_OK)
     
 
-class PostContetn(APIView):
-    authentication_classes = [JWTAuthentication]
+class PostContetn(StreamingUploadMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]  # Focus on handling form data with files
 
-    @transaction.atomic
     def post(self, request):
         try:
-            # Log request info for debugging
-            print(request)
-            print(request.data)
-            print(request.content_type)
-            
             # Extract data from the request
             caption = request.data.get('caption', '')
             location_name = request.data.get('location_name', '')
-            media_type = request.data.get('media_type', '')
             is_public = request.data.get('is_public', 'false').lower() == 'true'
             allow_comments = request.data.get('allow_comments', 'false').lower() == 'true'
             allow_likes = request.data.get('allow_likes', 'false').lower() == 'true'
             
-            # Handle file uploads
+            # Handle file uploads, sent in this request or beforehand as resumable uploads
             media_file = request.FILES.get('media')
+            media_upload_id = request.data.get('media_upload_id')
             additional_media_files = request.FILES.getlist('additional_media')
-            additional_media_types = request.data.getlist('additional_media_types')
+            additional_media_upload_ids = request.data.getlist('additional_media_upload_ids')
+            
+            # Refuse the request if the upload handler stopped a file (unsupported type or too large)
+            rejection = self.rejected_upload(request)
+            if rejection:
+                return Response.error(message=str(rejection), status=rejection.status)
             
             # Validate required fields
-            if not media_file:
+            if not media_file and not media_upload_id:
                 return Response.error(message="Main media file is required", status=status.HTTP_400_BAD_REQUEST)
             
-            # Create the post record
-            post = Post.objects.create(
-                user=request.user,
-                caption=caption,
-                location_name=location_name,
-                is_public=is_public,
-                allow_comments=allow_comments,
-                allow_likes=allow_likes
-            )
-            
-            # Save the main media file
-            main_media = MediaItem.objects.create(
-                post=post,
-                file=media_file,
-                media_type=media_type,
-                is_main=True
-            )
+            # Write the uploads to the staging area before opening the transaction,
+            # so the disk writes don't hold the database write lock
+            # (resumable uploads are already on disk and only claimed: they are
+            # marked used in the transaction, so a failure leaves them reusable)
+            # (the digests computed while receiving them are kept for the worker)
+            staged_files = []
+            uploads = []
+            try:
+                if media_upload_id:
+                    uploads.append(claim_upload(request.user, media_upload_id))
+                    media_paths, media_digests = [uploads[0].path], [uploads[0].sha256]
+                else:
+                    staged_files.append(stage_upload(media_file))
+                    media_paths, media_digests = [staged_files[0]], [uploaded_digest(media_file)]
+                for file in additional_media_files:
+                    staged_files.append(stage_upload(file))
+                    media_paths.append(staged_files[-1])
+                    media_digests.append(uploaded_digest(file))
+                for upload_id in additional_media_upload_ids:
+                    uploads.append(claim_upload(request.user, upload_id))
+                    media_paths.append(uploads[-1].path)
+                    media_digests.append(uploads[-1].sha256)
+            except UploadError as e:
+                discard_staged(staged_files)
+                return Response.error(message=str(e), status=e.status)
+            
+            # The media types come from the files' content, not from the client
+            media_types = [sniff_file(path)[1] for path in media_paths]
+            if None in media_types:
+                discard_staged(staged_files)
+                return Response.error(message="Unsupported media file. Must be an image or a video", status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+            staged_main, staged_additional = media_paths[0], media_paths[1:]
             
-            # Save additional media files if any
-            additional_media_items = []
-            for i, file in enumerate(additional_media_files):
-                media_type_value = additional_media_types[i] if i < len(additional_media_types) else 'unknown'
-                media_item = MediaItem.objects.create(
-                    post=post,
-                    file=file,
-                    media_type=media_type_value,
-                    is_main=False
-                )
-                additional_media_items.append(media_item)
+            try:
+                with transaction.atomic():
+                    # Rolled back with the post if anything below fails
+                    for upload in uploads:
+                        consume_upload(upload)
+                    
+                    # Create the post record
+                    post = Post.objects.create(
+                        user=request.user,
+                        caption=caption,
+                        location_name=location_name,
+                        is_public=is_public,
+                        allow_comments=allow_comments,
+                        allow_likes=allow_likes
+                    )
+                    
+                    # Record the main media file; a worker moves it into place after the commit
+                    main_media = MediaItem.objects.create(
+                        post=post,
+                        media_type=media_types[0],
+                        is_main=True,
+                        processing_state='processing',
+                        staged_file=staged_main,
+                        staged_sha256=media_digests[0]
+                    )
+                    submit_media_processing(main_media)
+                    
+                    # Record additional media files if any
+                    additional_media_items = []
+                    for staged_file, media_type, digest in zip(staged_additional, media_types[1:], media_digests[1:]):
+                        media_item = MediaItem.objects.create(
+                            post=post,
+                            media_type=media_type,
+                            is_main=False,
+                            processing_state='processing',
+                            staged_file=staged_file,
+                            staged_sha256=digest
+                        )
+                        submit_media_processing(media_item)
+                        additional_media_items.append(media_item)
+                    
+                    adjust_counter(User, request.user.id, 'post_count', 1)
+                    
+                    # Push the post into the followers' home timelines
+                    fan_out_post(post)
+            except UploadError as e:
+                discard_staged(staged_files)
+                return Response.error(message=str(e), status=e.status)
+            except Exception:
+                discard_staged(staged_files)
+                raise
             
             # Prepare response data
             response_data = {
@@ -270,7 +362,8 @@ class PostContetn(APIView):
                     'id': main_media.id,
                     'media_type': main_media.media_type,
                     'filename': main_media.filename,
-                    'file_url': main_media.file_url
+                    'file_url': main_media.file_url,
+                    'processing_state': main_media.processing_state
                 },
                 'additional_media_count': len(additional_media_items),
                 'additional_media': []
@@ -284,53 +377,87 @@ class PostContetn(APIView):
                 status=status.HTTP_201_CREATED
             )
         except Exception as e:
-            print(f"Error processing request: {str(e)}")
+            logger.exception("Failed to create a post")
             return Response.error(message=f"Error processing request: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
 
 
-class StoryCreate(APIView):
-    authentication_classes = [JWTAuthentication]
+class StoryCreate(StreamingUploadMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     
-    @transaction.atomic
     def post(self, request):
         try:
-            # Log request info for debugging
-            print(request.data)
-            print(request.FILES)
-            
             # Extract data from the request
             content = request.data.get('content', '')
-            media_type = request.data.get('media_type', 'image')
             duration = int(request.data.get('duration', 24))  # Default 24 hours
             is_public = request.data.get('is_public', 'false').lower() == 'true'
             
-            # Handle media file upload
+            # Handle media file upload, sent in this request or beforehand as a resumable upload
             media_file = request.FILES.get('media')
+            media_upload_id = request.data.get('media_upload_id')
+            
+            # Refuse the request if the upload handler stopped the file (unsupported type or too large)
+            rejection = self.rejected_upload(request)
+            if rejection:
+                return Response.error(message=str(rejection), status=rejection.status)
             
             # Validate required fields
-            if not media_file:
+            if not media_file and not media_upload_id:
                 return Response.error(message="Media file is required", status=status.HTTP_400_BAD_REQUEST)
             
-            # Validate media type
-            if media_type not in ['image', 'video']:
-                return Response.error(message="Invalid media type. Must be 'image' or 'video'", status=status.HTTP_400_BAD_REQUEST)
+            # Write the upload to the staging area before opening the transaction
+            # (a resumable upload is already on disk and only claimed, it is marked used in the transaction)
+            upload = None
+            staged_files = []
+            try:
+                if media_upload_id:
+                    upload = claim_upload(request.user, media_upload_id)
+                    staged_media, staged_sha256 = upload.path, upload.sha256
+                else:
+                    staged_media, staged_sha256 = stage_upload(media_file), uploaded_digest(media_file)
+                    staged_files.append(staged_media)
+            except UploadError as e:
+                return Response.error(message=str(e), status=e.status)
+            
+            # The media type comes from the file's content, not from the client
+            _, media_type = sniff_file(staged_media)
+            if media_type is None:
+                discard_staged(staged_files)
+                return Response.error(message="Invalid media type. Must be an image or a video", status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
             
-            # Create the story record
-            story = Story.objects.create(
-                user=request.user,
-                content=content,
-                media=media_file,
-                media_type=media_type,
-                duration=duration,
-                is_public=is_public
-            )
+            try:
+                with transaction.atomic():
+                    if upload is not None:
+                        consume_upload(upload)
+                    
+                    # Create the story record; a worker moves the media into place after the commit
+                    story = Story.objects.create(
+                        user=request.user,
+                        content=content,
+                        media_type=media_type,
+                        duration=duration,
+                        is_public=is_public,
+                        processing_state='processing',
+                        staged_file=staged_media,
+                        staged_sha256=staged_sha256
+                    )
+                    submit_media_processing(story)
+                    
+                    # Refresh the story trays that show this story once it is committed
+                    transaction.on_commit(lambda: invalidate_author_story_trays(request.user.id))
+            except UploadError as e:
+                discard_staged(staged_files)
+                return Response.error(message=str(e), status=e.status)
+            except Exception:
+                discard_staged(staged_files)
+                raise
             
             # Prepare response data
             response_data = {
                 'story_id': story.id,
                 'expires_at': story.expires_at,
+                'processing_state': story.processing_state,
             }
             
             # Return success response with story data
@@ -341,12 +468,12 @@ class StoryCreate(APIView):
             )
             
         except Exception as e:
-            print(f"Error processing request: {str(e)}")
+            logger.exception("Failed to create a story")
             return Response.error(message=f"Error processing request: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
 
 
 class MyStoriesView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -357,7 +484,7 @@ class MyStoriesView(APIView):
             # Get all non-expired stories for the current user
             stories = Story.objects.filter(
                 user=request.user,
-                created_at__gte=now - timezone.timedelta(hours=24)  # Only stories from the last 24 hours
+                expires_at__gt=now  # Each story lives for its own duration
             ).order_by('-created_at')
             
             # Prepare response data
@@ -373,7 +500,15 @@ class MyStoriesView(APIView):
                     'id': story.id,
                     'content': story.content,
                     'media_url': story.file_url,
+                    'derivatives': story.derivative_urls,
+                    'poster_url': story.poster_url,
+                    'renditions': story.rendition_urls,
                     'media_type': story.media_type,
+                    'width': story.width,
+                    'height': story.height,
+                    'size_bytes': story.size_bytes,
+                    'duration_seconds': story.media_duration,
+                    'placeholder': story.placeholder,
                     'created_at': story.created_at,
                     'expires_at': story.expires_at,
                     'is_expired': story.is_expired,
@@ -392,66 +527,13 @@ class MyStoriesView(APIView):
 
 
 class FeedStoriesView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         try:
-            # Get current time
-            now = timezone.now()
-            
-            # Get all users that the current user follows using the UserFollowing model
-            from .following_models import UserFollowing
-            
-            # Get the IDs of users that the current user follows
-            following_user_ids = UserFollowing.objects.filter(
-                user=request.user
-            ).values_list('following_user_id', flat=True)
-            
-            # Get the current user's own active stories
-            own_stories = Story.objects.filter(
-                user=request.user,
-                created_at__gte=now - timezone.timedelta(hours=24)  # Only stories from the last 24 hours
-            ).order_by('-created_at')
-            
-            # Get all non-expired, public stories from users the current user follows
-            followed_stories = Story.objects.filter(
-                user_id__in=following_user_ids,
-                is_public=True,
-                created_at__gte=now - timezone.timedelta(hours=24)  # Only stories from the last 24 hours
-            ).order_by('-created_at')
-            
-            # Combine own stories and followed stories
-            stories = list(own_stories) + list(followed_stories)
-            
-            # Group stories by user
-            user_stories = {}
-            for story in stories:
-                if story.user.id not in user_stories:
-                    user_stories[story.user.id] = {
-                        'user_id': story.user.id,
-                        'username': story.user.username,
-                        'name': story.user.name,
-                        'profile_picture': story.user.img.url if story.user.img else None,
-                        'stories': []
-                    }
-                
-                # Check if the current user has viewed this story
-                viewed = StoryView.objects.filter(story=story, viewer=request.user).exists()
-                
-                user_stories[story.user.id]['stories'].append({
-                    'id': story.id,
-                    'content': story.content,
-                    'media_url': story.file_url,
-                    'media_type': story.media_type,
-                    'created_at': story.created_at,
-                    'expires_at': story.expires_at,
-                    'viewed': viewed,
-                    'is_own': story.user.id == request.user.id
-                })
-            
-            # Convert the dictionary to a list
-            result = list(user_stories.values())
+            # Build the tray (or read it from the per-viewer cache)
+            result = get_story_tray(request.user)
             
             return Response.success(
                 data={'user_stories': result},
@@ -465,7 +547,7 @@ class FeedStoriesView(APIView):
 
 
 class ViewStoryView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     @transaction.atomic
@@ -491,6 +573,10 @@ class ViewStoryView(APIView):
                 viewer=request.user
             )
             
+            # The viewer's tray now has a stale viewed flag
+            if created:
+                transaction.on_commit(lambda: invalidate_story_trays([request.user.id]))
+            
             return Response.success(
                 message="Story marked as viewed" if created else "Story already viewed",
                 status=status.HTTP_200_OK